@@ -0,0 +1,68 @@
+import re
+
+from config import CHUNK_MAX_CHARS
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_QUOTED = re.compile(r'"([^"]{3,})"|“([^”]{3,})”|\'([^\']{3,})\'')
+_SECTION_REF = re.compile(r"\b(?:section|chunk|part)\s+(\d+)\b", re.IGNORECASE)
+
+
+def _split_long_paragraph(paragraph: str, max_chars: int) -> list:
+    """Splits an oversize paragraph on sentence boundaries, hard-splitting only as a last resort."""
+    pieces, current = [], ""
+    for sentence in _SENTENCE_END.split(paragraph):
+        while len(sentence) > max_chars:
+            if current:
+                pieces.append(current)
+                current = ""
+            pieces.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + 1 + len(sentence) > max_chars:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = f"{current} {sentence}" if current else sentence
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_into_chunks(text: str, max_chars: int = CHUNK_MAX_CHARS) -> list:
+    """
+    Packs whole paragraphs (blank-line separated) into chunks of at most
+    `max_chars`, so sections are never cut mid-paragraph unless a single
+    paragraph is itself too long.
+    """
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    chunks, current = [], ""
+    for paragraph in paragraphs:
+        parts = _split_long_paragraph(paragraph, max_chars) if len(paragraph) > max_chars else [paragraph]
+        for part in parts:
+            if current and len(current) + 2 + len(part) > max_chars:
+                chunks.append(current)
+                current = part
+            else:
+                current = f"{current}\n\n{part}" if current else part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def chunks_touched_by_feedback(feedback: str, original_chunks: list, generated_chunks: list) -> set:
+    """
+    Returns the indices of chunks a feedback message refers to, via quoted
+    passages ("...") or explicit "section N" references. Feedback that points at
+    nothing specific touches every chunk.
+    """
+    touched = set()
+    for match in _SECTION_REF.finditer(feedback):
+        index = int(match.group(1)) - 1
+        if 0 <= index < len(original_chunks):
+            touched.add(index)
+    for groups in _QUOTED.findall(feedback):
+        phrase = next(g for g in groups if g).lower()
+        for i, original in enumerate(original_chunks):
+            generated = generated_chunks[i] if i < len(generated_chunks) else ""
+            if phrase in original.lower() or phrase in generated.lower():
+                touched.add(i)
+    return touched or set(range(len(original_chunks)))
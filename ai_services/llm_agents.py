@@ -1,15 +1,22 @@
 # In ai_services/llm_agents.py
 
+import logging
 import os
-from langchain_core.language_models import BaseChatModel
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_groq import ChatGroq
-from langchain_core.language_models.llms import LLM
-from typing import Any, List, Mapping
-import requests
+import asyncio
 import json
+import threading
+import time
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from typing import Any, AsyncIterator, Iterator, List, Mapping, Optional
+import httpx
 
-from config import GEMINI_API_KEY, GROQ_API_KEY, CEREBRAS_API_KEY
+from config import (GEMINI_API_KEY, GROQ_API_KEY, CEREBRAS_API_KEY, ROUTER_PROVIDERS, CEREBRAS_BASE_URL,
+                    CEREBRAS_TIMEOUT, CEREBRAS_MAX_RETRIES, LLM_HTTP_MAX_CONNECTIONS)
+from ai_services.llm_router import LLMRouter
+
+logger = logging.getLogger(__name__)
 
 MODEL_MAP = {
     "gemini": "gemini-1.5-flash-latest",
@@ -17,41 +24,216 @@ MODEL_MAP = {
     "cerebras": "llama-4-scout-17b-16e-instruct"
 }
 
-class CustomChatCerebras(LLM):
+PROVIDER_API_KEYS = {"gemini": GEMINI_API_KEY, "groq": GROQ_API_KEY, "cerebras": CEREBRAS_API_KEY}
+
+# --- Shared HTTP Clients ---
+# One pooled client per process (and per event loop for the async one) so
+# Cerebras calls reuse keep-alive TLS connections instead of reconnecting.
+_HTTP_LIMITS = httpx.Limits(max_connections=LLM_HTTP_MAX_CONNECTIONS, max_keepalive_connections=LLM_HTTP_MAX_CONNECTIONS)
+_sync_client = None
+_async_clients = {}
+
+def _get_sync_client() -> httpx.Client:
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = httpx.Client(limits=_HTTP_LIMITS)
+    return _sync_client
+
+def _get_async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        # Drop clients of loops that have been closed since (their sockets cannot be used again).
+        for stale in [l for l in list(_async_clients) if l.is_closed()]:
+            _async_clients.pop(stale, None)
+        client = _async_clients[loop] = httpx.AsyncClient(limits=_HTTP_LIMITS)
+    return client
+
+async def close_http_clients():
+    """Closes the pooled clients (call on application shutdown)."""
+    global _sync_client
+    for client in list(_async_clients.values()):
+        await client.aclose()
+    _async_clients.clear()
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
+
+_RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
+
+class CustomChatCerebras(BaseChatModel):
+    """Cerebras chat completions with pooled connections, SSE token streaming and retries."""
     model_name: str = MODEL_MAP["cerebras"]
+    base_url: str = CEREBRAS_BASE_URL
+    api_key: Optional[str] = CEREBRAS_API_KEY
+    timeout: float = CEREBRAS_TIMEOUT
+    max_retries: int = CEREBRAS_MAX_RETRIES
+
     @property
     def _llm_type(self) -> str: return "custom_cerebras"
-    def _call(self, prompt: str, **kwargs: Any) -> str:
-        response = requests.post(
-            url="https://api.cerebras.ai/v1/chat/completions",
-            headers={"Authorization": f"Bearer {CEREBRAS_API_KEY}"},
-            data=json.dumps({"model": self.model_name, "messages": [{"role": "user", "content": prompt}]})
-        )
-        response.raise_for_status()
-        return response.json()['choices'][0]['message']['content']
     @property
     def _identifying_params(self) -> Mapping[str, Any]: return {"model_name": self.model_name}
 
+    def _request(self, client, messages: List[BaseMessage], stop: Optional[List[str]], stream: bool) -> httpx.Request:
+        payload = {
+            "model": self.model_name,
+            "messages": [{"role": _ROLES.get(m.type, "user"), "content": m.content} for m in messages],
+            "stream": stream,
+        }
+        if stop: payload["stop"] = stop
+        return client.build_request(
+            "POST", f"{self.base_url}/chat/completions",
+            headers={"Authorization": f"Bearer {self.api_key}"}, json=payload, timeout=self.timeout,
+        )
+
+    @staticmethod
+    def _backoff(attempt: int) -> float:
+        return min(0.5 * 2 ** attempt, 8.0)
+
+    def _send(self, messages, stop, stream: bool) -> httpx.Response:
+        """Sends with retries on connection errors and retryable statuses; the caller closes the response."""
+        client = _get_sync_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = client.send(self._request(client, messages, stop, stream), stream=True)
+            except httpx.TransportError:
+                if attempt == self.max_retries: raise
+            else:
+                if response.status_code not in _RETRY_STATUS or attempt == self.max_retries:
+                    if response.is_error:
+                        response.read()
+                        response.close()
+                    response.raise_for_status()
+                    return response
+                response.close()
+            time.sleep(self._backoff(attempt))
+
+    async def _asend(self, messages, stop, stream: bool) -> httpx.Response:
+        client = _get_async_client()
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await client.send(self._request(client, messages, stop, stream), stream=True)
+            except httpx.TransportError:
+                if attempt == self.max_retries: raise
+            else:
+                if response.status_code not in _RETRY_STATUS or attempt == self.max_retries:
+                    if response.is_error:
+                        await response.aread()
+                        await response.aclose()
+                    response.raise_for_status()
+                    return response
+                await response.aclose()
+            await asyncio.sleep(self._backoff(attempt))
+
+    @staticmethod
+    def _result(body: dict) -> ChatResult:
+        content = body['choices'][0]['message']['content']
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))], llm_output={"usage": body.get("usage")})
+
+    @staticmethod
+    def _parse_sse(line: str) -> Optional[ChatGenerationChunk]:
+        """Turns one `data: {...}` server-sent-events line into a chunk; None for keep-alives and [DONE]."""
+        if not line.startswith("data:"):
+            return None
+        data = line[5:].strip()
+        if not data or data == "[DONE]":
+            return None
+        choices = json.loads(data).get("choices") or [{}]
+        delta = choices[0].get("delta", {}).get("content")
+        return ChatGenerationChunk(message=AIMessageChunk(content=delta)) if delta else None
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        response = self._send(messages, stop, stream=False)
+        try:
+            return self._result(json.loads(response.read()))
+        finally:
+            response.close()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        response = await self._asend(messages, stop, stream=False)
+        try:
+            return self._result(json.loads(await response.aread()))
+        finally:
+            await response.aclose()
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        response = self._send(messages, stop, stream=True)
+        try:
+            for line in response.iter_lines():
+                chunk = self._parse_sse(line)
+                if chunk is None: continue
+                if run_manager: run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        finally:
+            response.close()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        response = await self._asend(messages, stop, stream=True)
+        try:
+            async for line in response.aiter_lines():
+                chunk = self._parse_sse(line)
+                if chunk is None: continue
+                if run_manager: await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+        finally:
+            # Closing mid-stream (e.g. the client went away) drops the upstream request too.
+            await response.aclose()
+
 # --- LLM Factory Function ---
+# Chat model clients are safe to share between concurrent requests, so each
+# provider/model is built once per process and reused (with its connection pool).
+_llm_registry = {}
+_llm_registry_lock = threading.Lock()
+
 def get_llm_chain(provider: str):
+    """Returns the process-wide LLM instance for `provider`, building it on first use."""
+    key = (provider, MODEL_MAP.get(provider, provider))
+    llm = _llm_registry.get(key)
+    if llm is None:
+        with _llm_registry_lock:
+            llm = _llm_registry.get(key)
+            if llm is None:
+                llm = _llm_registry[key] = _build_llm(provider)
+    return llm
+
+def warm_llm_clients() -> list:
+    """Builds the clients of every provider with an API key; returns the providers warmed."""
+    warmed = []
+    for provider in [p for p in MODEL_MAP if PROVIDER_API_KEYS.get(p)] + ["auto"]:
+        try:
+            get_llm_chain(provider)
+            warmed.append(provider)
+        except Exception as e:
+            logger.warning("Could not warm LLM client '%s': %s", provider, e)
+    return warmed
+
+def _build_llm(provider: str):
     """
     This function now ONLY creates and returns the LLM instance,
     with streaming explicitly enabled where supported.
+    The "auto" provider returns a router that hedges and fails over between
+    every configured provider.
     """
+    if provider == "auto":
+        providers = [p for p in ROUTER_PROVIDERS if PROVIDER_API_KEYS.get(p)] or ROUTER_PROVIDERS
+        return LLMRouter(providers, llm_factory=get_llm_chain)
+
     model_name = MODEL_MAP.get(provider)
     if not model_name:
         raise ValueError(f"Invalid provider specified: {provider}")
 
     if provider == "gemini":
         # FIX: Explicitly enable token-by-token streaming from the provider.
+        from langchain_google_genai import ChatGoogleGenerativeAI  # Provider SDKs are imported only when used
         return ChatGoogleGenerativeAI(model=model_name, api_key=GEMINI_API_KEY, streaming=True)
     
     if provider == "groq":
         # FIX: Explicitly enable token-by-token streaming from the provider.
+        from langchain_groq import ChatGroq
         return ChatGroq(model_name=model_name, api_key=GROQ_API_KEY, streaming=True)
 
     if provider == "cerebras":
-        # Note: This custom class does not support streaming.
         return CustomChatCerebras(model_name=model_name)
         
     raise ValueError(f"Provider '{provider}' not configured.")
\ No newline at end of file
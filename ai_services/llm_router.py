@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Callable, Optional
+
+import httpx
+from langchain_core.runnables import Runnable, RunnableConfig
+
+from config import ROUTER_PROVIDERS, ROUTER_HEDGE_DELAY, ROUTER_STATS_WINDOW
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderStats:
+    """Rolling time-to-first-token and error-rate statistics for one provider."""
+    PRIOR_LATENCY = 1.0  # Seconds assumed for a provider we have not measured yet
+
+    def __init__(self, window: int = ROUTER_STATS_WINDOW):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)  # True = success
+
+    def record_success(self, first_token_latency: float):
+        self.latencies.append(first_token_latency)
+        self.outcomes.append(True)
+
+    def record_failure(self):
+        self.outcomes.append(False)
+
+    def record_censored(self, elapsed: float):
+        """A hedge cancelled after `elapsed` seconds without a first token: its latency is at least that."""
+        self.latencies.append(max(elapsed, self.mean_latency))
+
+    @property
+    def error_rate(self) -> float:
+        return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    @property
+    def mean_latency(self) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else self.PRIOR_LATENCY
+
+    def score(self) -> float:
+        """Lower is better: expected latency inflated by the recent error rate."""
+        return self.mean_latency * (1 + 4 * self.error_rate)
+
+    def as_dict(self) -> dict:
+        return {"mean_ttft_s": round(self.mean_latency, 4), "error_rate": round(self.error_rate, 4),
+                "samples": len(self.outcomes), "score": round(self.score(), 4)}
+
+
+# Shared across all router instances so every request benefits from what others observed.
+provider_stats = {}
+
+def get_provider_stats(provider: str) -> ProviderStats:
+    return provider_stats.setdefault(provider, ProviderStats())
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return getattr(getattr(exc, "response", None), "status_code", None)
+
+# Provider SDK errors (groq, openai) for requests that never got a response.
+_TRANSPORT_ERROR_NAMES = ("APIConnectionError", "APITimeoutError")
+
+def is_retryable(exc: BaseException) -> bool:
+    """Timeouts, connection errors, 408, 429 and 5xx are worth failing over; anything else is raised."""
+    if isinstance(exc, (httpx.TransportError, TimeoutError, ConnectionError)):
+        return True
+    if any(cls.__name__ in _TRANSPORT_ERROR_NAMES for cls in type(exc).__mro__):
+        return True
+    code = _status_code(exc)
+    return code is not None and (code in (408, 429) or code >= 500)
+
+
+class LLMRouter(Runnable):
+    """
+    A runnable that spreads one request over several providers.
+
+    Providers are tried in order of their rolling score. If the current one has
+    not produced a first token within `hedge_delay` seconds, the next one is
+    started in parallel and whichever streams first wins (the other is
+    cancelled). Retryable errors before the first token fail over to the next
+    provider; once tokens have been streamed the chosen provider is kept.
+    """
+    def __init__(self, providers: list, llm_factory: Callable[[str], Runnable], hedge_delay: float = ROUTER_HEDGE_DELAY):
+        if not providers:
+            raise ValueError("LLMRouter needs at least one provider.")
+        self.providers = list(providers)
+        self.llm_factory = llm_factory
+        self.hedge_delay = hedge_delay
+
+    def ranked_providers(self) -> list:
+        return sorted(self.providers, key=lambda p: get_provider_stats(p).score())
+
+    def invoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        last_error = None
+        for provider in self.ranked_providers():
+            stats = get_provider_stats(provider)
+            started = time.monotonic()
+            try:
+                result = self.llm_factory(provider).invoke(input, config, **kwargs)
+            except Exception as e:
+                stats.record_failure()
+                if not is_retryable(e):
+                    raise
+                logger.warning("Router: '%s' failed (%s); failing over.", provider, e)
+                last_error = e
+                continue
+            stats.record_success(time.monotonic() - started)
+            return result
+        raise RuntimeError(f"All providers failed: {last_error}") from last_error
+
+    async def ainvoke(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> Any:
+        result = None
+        async for chunk in self.astream(input, config, **kwargs):
+            result = chunk if result is None else result + chunk
+        return result
+
+    async def astream(self, input: Any, config: Optional[RunnableConfig] = None, **kwargs: Any) -> AsyncIterator[Any]:
+        candidates = self.ranked_providers()
+        pending = {}  # first-chunk task -> (provider, iterator, start time)
+        last_error = None
+
+        def launch():
+            provider = candidates.pop(0)
+            iterator = self.llm_factory(provider).astream(input, config, **kwargs).__aiter__()
+            pending[asyncio.ensure_future(iterator.__anext__())] = (provider, iterator, time.monotonic())
+
+        winner = None
+        try:
+            launch()
+            while pending and winner is None:
+                done, _ = await asyncio.wait(pending, timeout=self.hedge_delay if candidates else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info("Router: no first token within %ss; hedging with '%s'.", self.hedge_delay, candidates[0])
+                    launch()
+                    continue
+                for task in done:
+                    provider, iterator, started = pending.pop(task)
+                    try:
+                        first_chunk = task.result()
+                    except StopAsyncIteration:
+                        get_provider_stats(provider).record_failure()
+                        last_error = RuntimeError(f"'{provider}' returned an empty response")
+                        continue
+                    except Exception as e:
+                        get_provider_stats(provider).record_failure()
+                        if not is_retryable(e):
+                            raise
+                        logger.warning("Router: '%s' failed (%s); failing over.", provider, e)
+                        last_error = e
+                        continue
+                    if winner is None:
+                        get_provider_stats(provider).record_success(time.monotonic() - started)
+                        winner = (provider, iterator, first_chunk)
+                    else:
+                        await _discard(None, iterator)
+                if winner is None and not pending and candidates:
+                    launch()
+        finally:
+            for task, (provider, iterator, started) in list(pending.items()):
+                get_provider_stats(provider).record_censored(time.monotonic() - started)
+                await _discard(task, iterator)
+
+        if winner is None:
+            raise RuntimeError(f"All providers failed: {last_error}") from last_error
+
+        provider, iterator, first_chunk = winner
+        yield first_chunk
+        try:
+            async for chunk in iterator:
+                yield chunk
+        except Exception:
+            get_provider_stats(provider).record_failure()
+            raise
+
+
+async def _discard(task: Optional[asyncio.Future], iterator):
+    """Cancels a losing provider's pending read and closes its stream."""
+    if task is not None and not task.done():
+        task.cancel()
+        try:
+            await task
+        except (asyncio.CancelledError, Exception):
+            pass
+    aclose = getattr(iterator, "aclose", None)
+    if aclose is not None:
+        try:
+            await aclose()
+        except Exception:
+            pass
+
+
+def get_router_stats() -> dict:
+    return {provider: get_provider_stats(provider).as_dict() for provider in ROUTER_PROVIDERS}
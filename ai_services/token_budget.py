@@ -0,0 +1,134 @@
+import logging
+import math
+from functools import lru_cache
+
+from config import (TOKENIZER_ENCODING, PROMPT_TOKEN_BUDGET, COMPLETION_TOKEN_RATIO, CONTEXT_SAFETY_MARGIN,
+                    ROUTER_PROVIDERS)
+from ai_services.llm_agents import MODEL_MAP
+
+logger = logging.getLogger(__name__)
+
+# --- Model Limits ---
+# Context window, longest completion and USD price per million input/output
+# tokens of every MODEL_MAP model.
+MODEL_LIMITS = {
+    "gemini-1.5-flash-latest": {"context": 1_048_576, "max_output": 8_192, "input_price": 0.075, "output_price": 0.30},
+    "llama3-8b-8192": {"context": 8_192, "max_output": 8_192, "input_price": 0.05, "output_price": 0.08},
+    "llama-4-scout-17b-16e-instruct": {"context": 32_768, "max_output": 8_192, "input_price": 0.65, "output_price": 0.85},
+}
+DEFAULT_LIMITS = {"context": 8_192, "max_output": 4_096, "input_price": 0.0, "output_price": 0.0}
+
+PER_MESSAGE_TOKENS = 4  # Chat formatting overhead per message
+TEMPLATE_ALLOWANCE = 500  # Instructions and headers around the chapter text, for estimates made without the template
+
+
+class PromptTooLarge(ValueError):
+    """A request that cannot fit the model's context window even after trimming."""
+
+
+def model_limits(provider: str) -> dict:
+    """
+    Limits of a provider's model. "auto" may be routed to any of
+    ROUTER_PROVIDERS, so it gets their tightest limits and highest prices.
+    """
+    if provider == "auto":
+        routed = [model_limits(p) for p in ROUTER_PROVIDERS if p != "auto"] or [dict(DEFAULT_LIMITS, model="auto")]
+        return {
+            "model": "auto",
+            "context": min(l["context"] for l in routed),
+            "max_output": min(l["max_output"] for l in routed),
+            "input_price": max(l["input_price"] for l in routed),
+            "output_price": max(l["output_price"] for l in routed),
+        }
+    model = MODEL_MAP.get(provider, provider)
+    return {"model": model, **MODEL_LIMITS.get(model, DEFAULT_LIMITS)}
+
+# --- Counting ---
+@lru_cache(maxsize=None)
+def _encoding():
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:  # Not installed, or the encoding file cannot be fetched
+        logger.warning("tiktoken unavailable (%s); estimating tokens from characters.", e)
+        return None
+
+def count_tokens(text: str) -> int:
+    """
+    Offline token count. No provider publishes a local tokenizer for these
+    models, so a tiktoken encoding stands in; CONTEXT_SAFETY_MARGIN absorbs
+    the difference.
+    """
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
+
+_template_tokens = {}  # id(template) -> tokens
+
+def template_tokens(template) -> int:
+    """Tokens of a chat prompt template with every variable left empty."""
+    tokens = _template_tokens.get(id(template))
+    if tokens is None:
+        messages = template.format_messages(**{name: "" for name in template.input_variables})
+        tokens = _template_tokens[id(template)] = sum(count_tokens(m.content) + PER_MESSAGE_TOKENS for m in messages)
+    return tokens
+
+# --- Budgets ---
+def completion_reserve(source_tokens: int, limits: dict) -> int:
+    """Completion tokens to leave room for when rewriting `source_tokens` of text."""
+    return min(limits["max_output"], math.ceil(source_tokens * COMPLETION_TOKEN_RATIO))
+
+def prompt_budget(limits: dict, completion_tokens: int) -> int:
+    budget = int(limits["context"] * CONTEXT_SAFETY_MARGIN) - completion_tokens
+    if PROMPT_TOKEN_BUDGET:
+        budget = min(budget, PROMPT_TOKEN_BUDGET)
+    return budget
+
+def fits_single_call(template, text: str, provider: str, current_version: str = "") -> bool:
+    """
+    Whether rewriting `text` in one call fits the model: the prompt in the
+    window and the rewrite in one completion. Later rounds also send the
+    `current_version` being revised, which must fit without trimming.
+    """
+    limits = model_limits(provider)
+    source = count_tokens(text)
+    if source * COMPLETION_TOKEN_RATIO > limits["max_output"]:
+        return False
+    prompt = template_tokens(template) + source + count_tokens(current_version)
+    return prompt <= prompt_budget(limits, completion_reserve(source, limits))
+
+def estimate_round_tokens(text: str, provider: str) -> int:
+    """Prompt plus completion tokens of a first rewrite of `text` (what a rate limiter should charge)."""
+    limits = model_limits(provider)
+    source = count_tokens(text)
+    return TEMPLATE_ALLOWANCE + source + completion_reserve(source, limits)
+
+# --- Trimming ---
+def excerpt(text: str, max_tokens: int) -> str:
+    """Shortens `text` to at most `max_tokens` by cutting out its middle; "" if too little room is left."""
+    total = count_tokens(text)
+    if total <= max_tokens:
+        return text
+    if max_tokens < 64:
+        return ""
+    keep = len(text) * (max_tokens - 24) / total
+    while True:
+        half = int(keep / 2)
+        shortened = f"{text[:half].rstrip()}\n\n[... {total - max_tokens} tokens omitted ...]\n\n{text[len(text) - half:].lstrip()}"
+        if count_tokens(shortened) <= max_tokens:
+            return shortened
+        keep *= 0.9
+
+# --- Costs ---
+def usage_estimate(provider: str, prompt_tokens: int, completion_tokens: int) -> dict:
+    limits = model_limits(provider)
+    cost = (prompt_tokens * limits["input_price"] + completion_tokens * limits["output_price"]) / 1_000_000
+    return {
+        "model": limits["model"],
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": round(cost, 6),
+    }
@@ -1,129 +1,470 @@
-from fastapi import FastAPI, HTTPException, Depends, Query
+from fastapi import FastAPI, HTTPException, Depends, Query, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, FileResponse, JSONResponse, Response
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
+from typing import List, Literal, Optional
+from sqlalchemy.ext.asyncio import AsyncSession
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import time
 import uuid
 
-from graph_workflow import app
-from storage.database import SessionLocal, init_db, ScrapedContent
-from scraper.content_fetcher import fetch_content_and_screenshot
-from storage.chromadb_manager import store_final_version, query_collection
-from retrieval.rl_agent import ContextualBanditAgent # MODIFIED: Import agent
+from observability import (configure_logging, configure_tracing, shutdown_tracing, render_metrics, span,
+                           LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS_PER_SECOND, LLM_COMPLETION_TOKENS, LLM_COST)
+from startup import Subsystem
+from streaming import streams, batch_tokens, FORMATS
+from jobs.runner import JobRunner
+from storage.database import (AsyncSessionLocal, init_db, get_async_engine, dispose_engines, get_existing_content_ids,
+                              get_scraped_content, get_legacy_screenshot, list_recent_scraped_content,
+                              list_job_chapters, get_job_chapter)
+from storage.blob_store import screenshot_store, media_type_for
+from scraper.scrape_cache import get_or_scrape, get_scrape_stats, close_http_client
+from scraper.browser_pool import browser_pool
+from scraper.crawler import ingest_book
+from storage.chromadb_manager import get_client, store_final_version, query_collection, query_collection_batch, get_chroma_stats
+from storage.query_cache import query_cache
+from storage.version_store import version_store
+from storage.ingestion import ingestion_worker
+from ai_services.response_cache import response_cache
+
+configure_logging()
+logger = logging.getLogger(__name__)
 
 # --- Initializations ---
-init_db()
-api = FastAPI()
+# Heavy subsystems start in parallel in the background once the server is
+# up; requests that need one wait for it, everything else is served at once.
+_loop = None  # The server's event loop, for async setup run from startup threads
+
+def _init_graph():
+    import graph_workflow  # Pulls in LangGraph/LangChain and the provider SDKs
+    asyncio.run_coroutine_threadsafe(graph_workflow.enable_checkpointing(), _loop).result()
+    providers = graph_workflow.warm_chains()
+    logger.info("Warmed LLM clients and chains for: %s", providers)
+    return graph_workflow
+
+def _init_bandit():
+    from retrieval.rl_agent import ContextualBanditAgent
+    from retrieval.policy_store import PolicyStore
+    rl_agent = ContextualBanditAgent(actions=["summary", "characters", "style", "setting", "plot"])
+    policy_store = PolicyStore(rl_agent)  # Rating log + background snapshots, shared across workers
+    policy_store.start()
+    return policy_store
+
+database = Subsystem("database", init_db)
+chroma = Subsystem("chroma", get_client)
+graph = Subsystem("graph", _init_graph)
+bandit = Subsystem("bandit", _init_bandit)
+subsystems = [database, chroma, graph, bandit]
+
+async def _async_db_ready():
+    await database.aget()
+    get_async_engine()
+
+job_runner = JobRunner(graph_loader=graph.aget, db_ready=_async_db_ready)
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    global _loop
+    _loop = asyncio.get_running_loop()
+    configure_tracing()
+    for subsystem in subsystems:
+        subsystem.start()
+    ingestion_worker.start(db_ready=database.get)
+    job_runner.start()
+    yield
+    await job_runner.stop()
+    await asyncio.to_thread(ingestion_worker.stop)
+    if bandit.ready:
+        await asyncio.to_thread(bandit.value.stop)
+    if graph.ready:
+        await graph.value.disable_checkpointing()
+        from ai_services.llm_agents import close_http_clients as close_llm_http_clients
+        await close_llm_http_clients()
+    await browser_pool.close()
+    await close_http_client()
+    await dispose_engines()
+    shutdown_tracing()
+
+api = FastAPI(lifespan=lifespan)
 api.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])
-rl_agent = ContextualBanditAgent(actions=["summary", "characters", "style", "setting", "plot"]) # NEW: Instantiate RL agent
 
-def get_db():
-    db = SessionLocal()
-    try: yield db
-    finally: db.close()
+async def get_db():
+    await _async_db_ready()
+    async with AsyncSessionLocal() as db:
+        yield db
 
 # --- Pydantic Models ---
 class StartRequest(BaseModel): url: str
 
-class ContinueRequest(BaseModel): 
+class IngestRequest(BaseModel):
+    toc_url: Optional[str] = None
+    urls: List[str] = []
+
+class ContinueRequest(BaseModel):
     thread_id: str
     feedback: str = ""
-    llm_provider: str
-    scraped_text: str
-    generated_text: str
+    llm_provider: str  # "gemini", "groq", "cerebras" or "auto"
+    generation_mode: str = "auto"  # "single", "chunked" or "auto"
+    # Texts live in the thread's checkpoint; send them only to override it.
+    scraped_text: Optional[str] = None
+    generated_text: Optional[str] = None
+    generated_chunks: Optional[List[str]] = None
 
 # NEW: Model for the approve endpoint
 class ApproveRequest(BaseModel):
     content: str
     collection_name: str = "approved_versions"
+    # Stored with every passage so retrieval hits can be traced back.
+    source_url: Optional[str] = None
+    chapter: Optional[str] = None
+    version: Optional[int] = None
+    wait: bool = False  # Embed before responding instead of queueing
+
+class RetrieveRequest(BaseModel):
+    query: str
+    n_results: int
+    mode: Literal["dense", "keyword", "hybrid"] = "dense"
+    with_metadata: bool = False
+
+class JobRequest(BaseModel):
+    content_ids: List[int]  # ScrapedContent ids, in book order
+    llm_provider: str = "auto"
+    feedback: str = "Initial spin."
+    generation_mode: str = "auto"
 
-class RetrieveRequest(BaseModel): query: str; n_results: int
+class BatchRetrieveRequest(BaseModel): queries: List[str]; n_results: int; with_metadata: bool = False
 
 class RateRequest(BaseModel): query: str; action: str; rating: int # NEW: Model for rating
 
 # --- Stream Generator ---
-async def stream_llm_outputs(req: ContinueRequest):
-    """A generator that streams LLM outputs and prints all events for debugging."""
+async def generate_round(session, req: ContinueRequest):
+    """Runs one feedback round, emitting start/token/end events into the stream session."""
     config = {"configurable": {"thread_id": req.thread_id}}
-    provider = req.llm_provider
-    
-    start_tag = f"[MODEL_START:{provider}]\n"
-    print(f"BACKEND SENDING: {start_tag.strip()}")
-    yield start_tag
+    state_update = {
+        "feedback": [req.feedback],
+        "llm_provider": req.llm_provider,
+        "generation_mode": req.generation_mode,
+    }
+    for field in ("scraped_text", "generated_text", "generated_chunks"):
+        if getattr(req, field) is not None:
+            state_update[field] = getattr(req, field)
 
-    try:
-        state_update = {
-            "feedback": [req.feedback],
-            "llm_provider": provider,
-            "scraped_text": req.scraped_text,
-            "generated_text": req.generated_text,
-        }
-        
-        async for event in app.astream_events(state_update, config=config, version="v1"):
-            # --- THIS IS THE DEBUGGING PRINT STATEMENT ---
-            # print("EVENT RECEIVED:", event)
-            # ---------------------------------------------
-            
-            # The original filter (which is likely wrong) remains for now.
-            if event["event"] == "on_chain_stream" and event["name"] == "generator":
-                content_chunk = event["data"]["chunk"].get("spun_content")
-                if content_chunk:
-                    print(f"BACKEND SENDING: '{content_chunk}'")
-                    yield content_chunk
-    except Exception as e:
-        print(f"ERROR streaming from {provider}: {e}")
-        yield f"\n[ERROR] Failed from {provider}.\n"
-        
-    end_tag = f"\n[MODEL_END]\n"
-    print(f"BACKEND SENDING: {end_tag.strip()}")
-    yield end_tag
+    graph_workflow = await graph.aget()
+    session.emit("start", {"stream_id": session.stream_id, "thread_id": req.thread_id, "provider": req.llm_provider})
+    usage = {}
+
+    def on_event(chunk: dict):
+        # The preflight estimate goes out before the first token; actual usage rides on "end".
+        if "budget" in chunk:
+            session.emit("budget", chunk["budget"])
+        usage.update(chunk.get("usage") or {})
+
+    started, first_token_at, chars = time.perf_counter(), None, 0
+    with span("generation_round", thread_id=req.thread_id, provider=req.llm_provider):
+        async for text in batch_tokens(graph_workflow.stream_tokens(state_update, config, on_event)):
+            first_token_at = first_token_at or time.perf_counter()
+            chars += len(text)
+            session.emit("token", {"text": text})
+    finished = time.perf_counter()
+    _record_round(req.llm_provider, started, first_token_at, finished, usage)
+    generated_text = (await graph_workflow.get_thread_state(req.thread_id)).get("generated_text")
+    version = None
+    if generated_text:
+        version = (await asyncio.to_thread(version_store.add_version, req.thread_id, generated_text,
+                                           label=req.llm_provider, feedback=req.feedback))["version"]
+    session.emit("end", {
+        "chars": chars,
+        "version": version,
+        "first_token_seconds": round(first_token_at - started, 3) if first_token_at else None,
+        "total_seconds": round(finished - started, 3),
+        "usage": usage or None,
+    })
+
+def _record_round(provider: str, started: float, first_token_at: float, finished: float, usage: dict):
+    if first_token_at is None:
+        return
+    LLM_FIRST_TOKEN_SECONDS.labels(provider=provider).observe(first_token_at - started)
+    completion_tokens = usage.get("completion_tokens") or 0  # Zero when every call was served from the cache
+    if completion_tokens:
+        LLM_COMPLETION_TOKENS.labels(provider=provider).inc(completion_tokens)
+        LLM_COST.labels(provider=provider).inc(usage.get("cost_usd") or 0)
+        if finished > first_token_at:
+            LLM_TOKENS_PER_SECOND.labels(provider=provider).observe(completion_tokens / (finished - first_token_at))
+
+def stream_response(session, request: Request, last_event_id: int = 0, format: str = "sse") -> StreamingResponse:
+    """Replays the session from `last_event_id` and follows it live in SSE or NDJSON."""
+    media_type, encode = FORMATS[format]
+
+    async def body():
+        async for event_id, event, data in session.subscribe(last_event_id, request.is_disconnected):
+            yield encode(event_id, event, data)
+
+    headers = {"X-Stream-Id": session.stream_id, "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(body(), media_type=media_type, headers=headers)
 
 # --- API Endpoints ---
 @api.post("/api/start")
-def start_workflow(req: StartRequest, db: Session = Depends(get_db)):
-    cached = db.query(ScrapedContent).filter(ScrapedContent.url == req.url).first()
-    if cached: raw_text = cached.raw_text
-    else:
-        scraped_data = fetch_content_and_screenshot(req.url)
-        if not scraped_data: raise HTTPException(status_code=500, detail="Scrape failed.")
-        new_content = ScrapedContent(url=req.url, raw_text=scraped_data["text"], screenshot=scraped_data["screenshot_bytes"])
-        db.add(new_content); db.commit(); raw_text = new_content.raw_text
-    return {"thread_id": str(uuid.uuid4()), "raw_content": raw_text}
+async def start_workflow(req: StartRequest, db: AsyncSession = Depends(get_db)):
+    cached = await get_or_scrape(db, req.url)
+    if not cached: raise HTTPException(status_code=500, detail="Scrape failed.")
+    thread_id = str(uuid.uuid4())
+    await (await graph.aget()).start_thread(thread_id, cached["row"].raw_text)
+    await asyncio.to_thread(version_store.add_version, thread_id, cached["row"].raw_text, label=req.url)
+    return {
+        "thread_id": thread_id,
+        "raw_content": cached["row"].raw_text,
+        "cache_status": cached["status"],
+        "content_changed": cached["changed"],
+        "coalesced": cached["coalesced"],
+    }
 
 @api.post("/api/continue")
-async def continue_workflow(req: ContinueRequest):
-    return StreamingResponse(stream_llm_outputs(req), media_type="text/event-stream")
+async def continue_workflow(req: ContinueRequest, request: Request, format: Literal["sse", "ndjson"] = "sse"):
+    """
+    Starts a feedback round and streams it as `start`, `token`..., then `end`
+    (or `error` / `cancelled`) events. The generation runs independently of the
+    connection: reconnect to /api/stream/{stream_id} with Last-Event-ID to resume.
+    """
+    graph_workflow = await graph.aget()
+    if req.scraped_text is None and not (await graph_workflow.get_thread_state(req.thread_id)).get("scraped_text"):
+        raise HTTPException(status_code=404, detail="Unknown thread; call /api/start first.")
+    session = streams.start(lambda s: generate_round(s, req), meta={"thread_id": req.thread_id})
+    return stream_response(session, request, format=format)
+
+@api.get("/api/stream/{stream_id}")
+async def resume_stream(stream_id: str, request: Request, format: Literal["sse", "ndjson"] = "sse",
+                        last_event_id: int = Query(0, ge=0), last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")):
+    """Resumes a stream after the given event id (header takes precedence, as sent by EventSource)."""
+    session = streams.get(stream_id)
+    if session is None: raise HTTPException(status_code=404, detail="Unknown or expired stream.")
+    if last_event_id_header and last_event_id_header.isdigit():
+        last_event_id = int(last_event_id_header)
+    return stream_response(session, request, last_event_id, format)
+
+@api.delete("/api/stream/{stream_id}")
+async def cancel_stream(stream_id: str):
+    """Stops a generation nobody needs any more (also happens automatically after the disconnect grace period)."""
+    if not streams.cancel(stream_id): raise HTTPException(status_code=404, detail="Unknown or finished stream.")
+    return {"status": "cancelled", "stream_id": stream_id}
+
+@api.get("/api/thread/{thread_id}")
+async def get_thread(thread_id: str):
+    """Returns the server-side state of a thread (latest version and feedback history)."""
+    state = await (await graph.aget()).get_thread_state(thread_id)
+    if not state: raise HTTPException(status_code=404, detail="Unknown thread.")
+    return {
+        "thread_id": thread_id,
+        "generated_text": state.get("generated_text", ""),
+        "feedback": state.get("feedback", []),
+        "generation_mode": state.get("generation_mode"),
+    }
+
+@api.get("/api/thread/{thread_id}/versions")
+def thread_versions(thread_id: str):
+    """Revision history of a thread; version 0 is the scraped source."""
+    history = version_store.history(thread_id)
+    if not history: raise HTTPException(status_code=404, detail="Unknown thread.")
+    return {"thread_id": thread_id, "versions": history}
+
+@api.get("/api/thread/{thread_id}/versions/{version}")
+def thread_version(thread_id: str, version: int):
+    try:
+        return {"thread_id": thread_id, "version": version, "text": version_store.get_version(thread_id, version)}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown thread or version.")
+
+@api.get("/api/thread/{thread_id}/diff")
+def thread_diff(thread_id: str, from_version: int = Query(..., alias="from"), to_version: int = Query(..., alias="to")):
+    try:
+        return {"thread_id": thread_id, "from": from_version, "to": to_version,
+                "diff": version_store.diff(thread_id, from_version, to_version)}
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Unknown thread or version.")
+
+# In-memory progress of bulk ingestion runs (the table itself is the durable record).
+ingest_runs = {}
+_background_tasks = set()  # Keeps fire-and-forget tasks referenced until they finish
+
+async def _run_ingest(run_id: str, req: IngestRequest):
+    progress = ingest_runs[run_id]
+    try:
+        await ingest_book(toc_url=req.toc_url, urls=req.urls, progress=progress)
+        progress["status"] = "done"
+    except Exception as e:
+        logger.exception("Ingest run %s failed: %s", run_id, e)
+        progress.update({"status": "failed", "error": str(e)})
+
+@api.post("/api/ingest")
+async def ingest(req: IngestRequest):
+    if not req.toc_url and not req.urls:
+        raise HTTPException(status_code=400, detail="Provide toc_url or urls.")
+    run_id = str(uuid.uuid4())
+    ingest_runs[run_id] = {"status": "running"}
+    task = asyncio.create_task(_run_ingest(run_id, req))
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return {"run_id": run_id, "status": "running"}
+
+@api.get("/api/ingest/{run_id}")
+def ingest_status(run_id: str):
+    if run_id not in ingest_runs:
+        raise HTTPException(status_code=404, detail="Unknown ingest run.")
+    return ingest_runs[run_id]
+
+# --- Generation Jobs ---
+@api.post("/api/jobs")
+async def create_job(req: JobRequest, db: AsyncSession = Depends(get_db)):
+    """Queues a whole book of chapters for unattended generation; poll /api/jobs/{job_id} for progress."""
+    if not req.content_ids: raise HTTPException(status_code=400, detail="Provide at least one content id.")
+    content_ids = list(dict.fromkeys(req.content_ids))
+    missing = set(content_ids) - await get_existing_content_ids(db, content_ids)
+    if missing: raise HTTPException(status_code=404, detail=f"Unknown content ids: {sorted(missing)}")
+    job = await job_runner.submit(db, content_ids, req.llm_provider, req.feedback, req.generation_mode)
+    return {"job_id": job.id, "status": "running", "chapters": len(content_ids)}
+
+@api.get("/api/jobs/{job_id}")
+async def job_progress(job_id: str, db: AsyncSession = Depends(get_db)):
+    progress = await job_runner.progress(db, job_id)
+    if progress is None: raise HTTPException(status_code=404, detail="Unknown job.")
+    return progress
+
+@api.get("/api/jobs/{job_id}/chapters")
+async def job_chapters(job_id: str, db: AsyncSession = Depends(get_db)):
+    """Per-chapter status (without texts)."""
+    return await list_job_chapters(db, job_id)
+
+@api.get("/api/jobs/{job_id}/chapters/{content_id}")
+async def job_chapter_result(job_id: str, content_id: int, db: AsyncSession = Depends(get_db)):
+    chapter = await get_job_chapter(db, job_id, content_id)
+    if chapter is None: raise HTTPException(status_code=404, detail="Unknown job chapter.")
+    return chapter
+
+@api.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str, db: AsyncSession = Depends(get_db)):
+    """Cancels queued chapters and interrupts running ones; finished results are kept."""
+    if not await job_runner.cancel(db, job_id): raise HTTPException(status_code=404, detail="Unknown job.")
+    return await job_runner.progress(db, job_id)
+
+# --- Health ---
+@api.get("/healthz")
+def healthz():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "ok"}
+
+@api.get("/readyz")
+def readyz():
+    """Readiness: every subsystem has finished starting (503 until then, or if one failed)."""
+    statuses = {subsystem.name: subsystem.status() for subsystem in subsystems}
+    ready = all(subsystem.ready for subsystem in subsystems)
+    return JSONResponse({"ready": ready, "subsystems": statuses}, status_code=200 if ready else 503)
+
+@api.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint (latencies, cache hit rates, token throughput)."""
+    rendered = render_metrics()
+    if rendered is None: raise HTTPException(status_code=501, detail="prometheus_client is not installed.")
+    body, content_type = rendered
+    return Response(body, media_type=content_type)
+
+@api.get("/api/llm-cache/stats")
+def llm_cache_stats():
+    return response_cache.stats()
+
+@api.get("/api/llm-router/stats")
+def llm_router_stats():
+    from ai_services.llm_router import get_router_stats  # LangChain loads with the graph, not at import
+    return get_router_stats()
+
+@api.get("/api/stats")
+def stats(refresh: bool = False):
+    """Aggregated, counter-backed stats for dashboards; `refresh` forces a Chroma recount."""
+    from ai_services.llm_router import get_router_stats
+    return {
+        # Subsystems still starting are reported as such rather than waited for.
+        "chroma": get_chroma_stats(refresh=refresh) if chroma.ready else chroma.status(),
+        "scrape": get_scrape_stats(),
+        "retrieval_cache": query_cache.stats(),
+        "embedding_queue": {"pending": ingestion_worker.pending()},
+        "streams": streams.stats(),
+        "llm_cache": response_cache.stats(),
+        "llm_router": get_router_stats(),
+        "bandit": {"ratings_seen": bandit.value.agent.ratings_seen} if bandit.ready else bandit.status(),
+    }
 
 # NEW: Endpoint for approving and saving the final version
 @api.post("/api/approve")
 def approve_version(req: ApproveRequest):
     doc_id = f"approved_{uuid.uuid4()}"
-    store_final_version("approved_versions", doc_id, req.content)
-    return {"status": "approved", "doc_id": doc_id}
+    metadata = {"source_url": req.source_url, "chapter": req.chapter, "version": req.version}
+    if req.wait:
+        store_final_version("approved_versions", doc_id, req.content, metadata)
+        return {"status": "approved", "doc_id": doc_id}
+    database.get()  # The queued approval is persisted before it is acknowledged
+    passages = ingestion_worker.submit("approved_versions", doc_id, req.content, metadata)
+    return {"status": "queued", "doc_id": doc_id, "passages": passages}
+
+@api.get("/api/approve/{doc_id}")
+def approve_status(doc_id: str):
+    status = ingestion_worker.status(doc_id)
+    if status is None: raise HTTPException(status_code=404, detail="Unknown document.")
+    return {"doc_id": doc_id, **status}
 
 @api.get("/api/view-postgres")
-def view_postgres_cache(db: Session = Depends(get_db), limit: int = Query(5, ge=1, le=100)):
-    items = db.query(ScrapedContent).order_by(ScrapedContent.id.desc()).limit(limit).all()
+async def view_postgres_cache(db: AsyncSession = Depends(get_db), limit: int = Query(5, ge=1, le=100)):
+    items = await list_recent_scraped_content(db, limit)
     return [{"id": item.id, "url": item.url} for item in items]
 
+@api.get("/api/screenshot/{content_id}")
+async def get_screenshot(content_id: int, variant: str = Query("original", pattern="^(original|webp|thumb)$"),
+                         db: AsyncSession = Depends(get_db)):
+    """Streams a chapter screenshot from the blob store."""
+    item = await get_scraped_content(db, content_id)
+    if item is None: raise HTTPException(status_code=404, detail="Content not found.")
+    if item.screenshot_key is None:
+        legacy = await get_legacy_screenshot(db, content_id)
+        if legacy:
+            # Legacy row: move the inline PNG into the blob store on first access.
+            item.screenshot_key = await asyncio.to_thread(screenshot_store.put, legacy)
+            item.screenshot = None
+            await db.commit()
+    path = await asyncio.to_thread(screenshot_store.get_path, item.screenshot_key, variant) if item.screenshot_key else None
+    if path is None: raise HTTPException(status_code=404, detail=f"Screenshot variant '{variant}' not available.")
+    return FileResponse(path, media_type=media_type_for(path))
+
 @api.post("/api/retrieve-chroma")
 def retrieve_from_chroma(req: RetrieveRequest):
-    action_keyword = rl_agent.choose_action(req.query)
+    action_keyword = bandit.get().agent.choose_action(req.query)
     enhanced_query = f"{req.query} {action_keyword}".strip()
-    print(f"RL Agent Used: '{action_keyword}' -> Query: '{enhanced_query}'")
-    results = query_collection("approved_versions", enhanced_query, n_results=req.n_results)
+    logger.info("RL Agent Used: '%s' -> Query: '%s'", action_keyword, enhanced_query)
+    results = query_collection("approved_versions", enhanced_query, n_results=req.n_results, mode=req.mode,
+                               with_metadata=req.with_metadata)
     return {
         "results": results,
         "action_keyword": action_keyword,
         "query": req.query,
-        "enhanced_query": enhanced_query # ADD THIS LINE
+        "enhanced_query": enhanced_query
     }
 
+@api.post("/api/retrieve-chroma/batch")
+def retrieve_from_chroma_batch(req: BatchRetrieveRequest):
+    """Routes all queries with one bandit scoring pass and runs them as one Chroma query."""
+    action_keywords = bandit.get().agent.choose_actions(req.queries)
+    enhanced_queries = [f"{q} {a}".strip() for q, a in zip(req.queries, action_keywords)]
+    results = query_collection_batch("approved_versions", enhanced_queries, n_results=req.n_results,
+                                     with_metadata=req.with_metadata)
+    return [
+        {"results": r, "action_keyword": a, "query": q, "enhanced_query": e}
+        for q, a, e, r in zip(req.queries, action_keywords, enhanced_queries, results)
+    ]
+
 @api.post("/api/rate-retrieval") # NEW: Endpoint for RL feedback
 def rate_retrieval(req: RateRequest):
     reward = (req.rating - 2.5) / 2.5  # Normalize 0-5 rating to -1.0 to 1.0 reward
-    rl_agent.update(req.query, req.action, reward)
-    rl_agent.save_policy()
+    try:
+        bandit.get().record(req.query, req.action, reward)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     return {"status": "updated", "reward": reward}
 
 # Add at the end of api.py
@@ -132,23 +473,10 @@ def rate_retrieval(req: RateRequest):
 def get_policy():
     """Extracts a human-readable version of the RL policy."""
     try:
-        policy = {}
-        # Ensure vectorizer is fitted by checking for vocabulary
-        if not hasattr(rl_agent.vectorizer, 'vocabulary_'):
+        rl_agent = bandit.get().agent
+        if rl_agent.ratings_seen == 0:
             return {"error": "Policy not trained yet."}
-            
-        feature_names = rl_agent.vectorizer.get_feature_names_out()
-        
-        for action, model in rl_agent.models.items():
-            # Ensure model is fitted by checking for coefficients
-            if hasattr(model, 'coef_'):
-                # Sort weights to show most influential words first
-                weights = sorted(zip(model.coef_, feature_names), reverse=True)
-                policy[action] = {word: round(coef, 4) for coef, word in weights if abs(coef) > 0.01}
-            else:
-                policy[action] = "Not trained yet"
-                
-        return policy
+        return rl_agent.describe_policy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 # ----------------------------------------------------
\ No newline at end of file
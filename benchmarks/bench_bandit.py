@@ -0,0 +1,115 @@
+"""
+Microbenchmarks for ContextualBanditAgent.
+
+    python -m benchmarks.bench_bandit update --checkpoints 100,1000,10000,100000,1000000
+    python -m benchmarks.bench_bandit choose --batch-sizes 1,16,256
+
+`update` measures rating latency as the number of ratings grows.
+
+Between checkpoints the agent is driven with real `update` calls up to
+--replay-limit ratings per gap; larger gaps are fast-forwarded by filling the
+bounded history directly (the only state that grows with the rating count),
+which is exactly what real updates would leave behind.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from retrieval.rl_agent import ContextualBanditAgent
+
+ACTIONS = ["summary", "characters", "style", "setting", "plot"]
+
+
+def synthetic_rating(rng: random.Random):
+    # Every query carries a never-seen word: the worst case for vocabulary-based featurizers.
+    query = f"{rng.choice(['who', 'what', 'where', 'describe'])} chapter w{rng.randrange(10**9)}"
+    return query, rng.choice(ACTIONS), rng.uniform(-1.0, 1.0)
+
+
+def advance(agent: ContextualBanditAgent, count: int, replay_limit: int, rng: random.Random) -> str:
+    if count <= replay_limit:
+        for _ in range(count):
+            agent.update(*synthetic_rating(rng))
+        return "replayed"
+    agent.history.extend(synthetic_rating(rng) for _ in range(min(count, agent.history_limit)))
+    agent.ratings_seen += count
+    return "fast-forwarded"
+
+
+def run_update(checkpoints: list, samples: int, replay_limit: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        agent = ContextualBanditAgent(actions=ACTIONS, policy_path=os.path.join(tmp, "policy.joblib"))
+        results = []
+        for checkpoint in sorted(checkpoints):
+            how = advance(agent, checkpoint - agent.ratings_seen, replay_limit, rng)
+            timings = []
+            for _ in range(samples):
+                rating = synthetic_rating(rng)
+                start = time.perf_counter()
+                agent.update(*rating)
+                timings.append((time.perf_counter() - start) * 1e6)
+            timings.sort()
+            results.append({
+                "ratings": checkpoint,
+                "advance": how,
+                "mean_us": round(statistics.fmean(timings), 1),
+                "p50_us": round(timings[len(timings) // 2], 1),
+                "p95_us": round(timings[int(len(timings) * 0.95)], 1),
+            })
+            print(f"{checkpoint:>9} ratings ({how:>14}): mean {results[-1]['mean_us']:>8} us  "
+                  f"p50 {results[-1]['p50_us']:>8} us  p95 {results[-1]['p95_us']:>8} us")
+    return results
+
+
+def run_choose(batch_sizes: list, rounds: int, trained_ratings: int = 1000, seed: int = 0) -> list:
+    """Per-query cost of choose_action vs. batched choose_actions."""
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        agent = ContextualBanditAgent(actions=ACTIONS, epsilon=0.0, policy_path=os.path.join(tmp, "policy.joblib"))
+        advance(agent, trained_ratings, trained_ratings, rng)
+        results = []
+        for batch_size in batch_sizes:
+            queries = [synthetic_rating(rng)[0] for _ in range(batch_size)]
+            start = time.perf_counter()
+            for _ in range(rounds):
+                for query in queries:
+                    agent.choose_action(query)
+            single_us = (time.perf_counter() - start) * 1e6 / (rounds * batch_size)
+            start = time.perf_counter()
+            for _ in range(rounds):
+                agent.choose_actions(queries)
+            batched_us = (time.perf_counter() - start) * 1e6 / (rounds * batch_size)
+            results.append({"batch_size": batch_size, "single_us_per_query": round(single_us, 1),
+                            "batched_us_per_query": round(batched_us, 1)})
+            print(f"batch {batch_size:>5}: choose_action {single_us:>8.1f} us/query  "
+                  f"choose_actions {batched_us:>8.1f} us/query")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["update", "choose"], nargs="?", default="update")
+    parser.add_argument("--checkpoints", default="100,1000,10000,100000,1000000")
+    parser.add_argument("--samples", type=int, default=500, help="Timed updates per checkpoint.")
+    parser.add_argument("--replay-limit", type=int, default=10000)
+    parser.add_argument("--batch-sizes", default="1,16,256")
+    parser.add_argument("--rounds", type=int, default=20, help="Repetitions per batch size.")
+    parser.add_argument("--output", help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    if args.mode == "update":
+        results = run_update([int(c) for c in args.checkpoints.split(",")], args.samples, args.replay_limit)
+    else:
+        results = run_choose([int(b) for b in args.batch_sizes.split(",")], args.rounds)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+End-to-end load test of /api/start -> /api/continue -> /api/approve.
+
+    python -m benchmarks.bench_e2e --concurrency 1,4,16 --flows 32
+
+Everything external is replaced by a local stand-in (see benchmarks.stand_ins):
+the API runs as a uvicorn subprocess on SQLite and a temporary Chroma dir,
+chapters come from a static HTML corpus served on localhost, and generation
+goes to a fake streaming LLM with a fixed time-to-first-token and token rate.
+
+--scrape cold   each flow's /api/start scrapes its chapter with Chromium
+--scrape warm   the scrape cache is pre-filled, so /api/start is a cache hit
+                (no browser needed)
+
+For every concurrency level, `--flows` flows run with at most that many in
+flight; per-step latency percentiles, time to first token and flows/second
+are reported.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.stand_ins import write_corpus, serve_directory, sandbox_env
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        "mean_ms": round(statistics.fmean(values) * 1000, 1),
+        "p50_ms": round(values[len(values) // 2] * 1000, 1),
+        "p95_ms": round(values[min(len(values) - 1, int(len(values) * 0.95))] * 1000, 1),
+        "p99_ms": round(values[min(len(values) - 1, int(len(values) * 0.99))] * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+
+def seed_scrape_cache(env: dict, urls: dict):
+    """Pre-fills ScrapedContent with the corpus text (warm mode) in a child process using the sandbox env."""
+    script = (
+        "import json, sys\n"
+        "from datetime import datetime, timezone\n"
+        "from storage.database import init_db, get_session, ScrapedContent\n"
+        "from scraper.content_fetcher import compute_content_hash\n"
+        "init_db()\n"
+        "with get_session() as db:\n"
+        "    for url, text in json.load(sys.stdin).items():\n"
+        "        db.add(ScrapedContent(url=url, raw_text=text, content_hash=compute_content_hash(text),\n"
+        "                              checked_at=datetime.now(timezone.utc)))\n"
+        "    db.commit()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], input=json.dumps(urls), text=True, check=True,
+                   cwd=REPO_ROOT, env={**os.environ, **env})
+
+
+class Services:
+    """Fake LLM + corpus server + API subprocess, all torn down on exit."""
+    def __init__(self, directory: str, chapters: int, paragraphs: int, ttft: float, tokens_per_second: float,
+                 reply_words: int, scrape: str):
+        self.directory = directory
+        self.chapters, self.paragraphs = chapters, paragraphs
+        self.llm_args = ["--ttft", str(ttft), "--tokens-per-second", str(tokens_per_second),
+                         "--reply-words", str(reply_words)]
+        self.scrape = scrape
+        self._processes = []
+        self._corpus_server = None
+
+    def __enter__(self):
+        pages = write_corpus(os.path.join(self.directory, "corpus"), self.chapters, self.paragraphs)
+        self._corpus_server, corpus_url = serve_directory(os.path.join(self.directory, "corpus"))
+        self.chapter_urls = {f"{corpus_url}/{path}": text for path, text in pages.items()}
+
+        llm_port = _free_port()
+        self._spawn([sys.executable, "-m", "benchmarks.stand_ins", "llm", "--port", str(llm_port), *self.llm_args], {})
+        self.env = sandbox_env(os.path.join(self.directory, "state"), f"http://127.0.0.1:{llm_port}")
+        os.makedirs(os.path.join(self.directory, "state"), exist_ok=True)
+        if self.scrape == "warm":
+            seed_scrape_cache(self.env, self.chapter_urls)
+
+        api_port = _free_port()
+        self.api_url = f"http://127.0.0.1:{api_port}"
+        self._spawn([sys.executable, "-m", "uvicorn", "api:api", "--port", str(api_port), "--log-level", "warning"],
+                    self.env)
+        self._wait_ready()
+        return self
+
+    def _spawn(self, command: list, env: dict):
+        self._processes.append(subprocess.Popen(command, cwd=REPO_ROOT, env={**os.environ, **env},
+                                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE))
+
+    def _wait_ready(self, timeout: float = 120.0):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            for process in self._processes:
+                if process.poll() is not None:
+                    raise RuntimeError(f"A benchmark service exited:\n{process.stderr.read().decode()[-2000:]}")
+            try:
+                if httpx.get(f"{self.api_url}/readyz", timeout=2).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.25)
+        raise RuntimeError("API did not become ready in time.")
+
+    def __exit__(self, *exc):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self._corpus_server.shutdown()
+
+
+async def run_flow(client: httpx.AsyncClient, url: str, provider: str, mode: str) -> dict:
+    """One start -> continue -> approve round; returns per-step timings."""
+    timings = {}
+    started = time.perf_counter()
+    response = await client.post("/api/start", json={"url": url})
+    response.raise_for_status()
+    start = response.json()
+    timings["start"] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    first_token, end, pieces = None, None, []
+    body = {"thread_id": start["thread_id"], "feedback": "Tighten the prose.", "llm_provider": provider,
+            "generation_mode": mode}
+    async with client.stream("POST", "/api/continue", params={"format": "ndjson"}, json=body) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["event"] == "token":
+                first_token = first_token or time.perf_counter()
+                pieces.append(event["data"]["text"])
+            elif event["event"] == "end":
+                end = event["data"]
+            elif event["event"] in ("error", "cancelled"):
+                raise RuntimeError(f"Generation {event['event']}: {event['data']}")
+    timings["continue"] = time.perf_counter() - started
+    timings["first_token"] = (first_token or time.perf_counter()) - started
+
+    started = time.perf_counter()
+    response = await client.post("/api/approve", json={"content": "".join(pieces), "source_url": url,
+                                                       "version": (end or {}).get("version"), "wait": True})
+    response.raise_for_status()
+    timings["approve"] = time.perf_counter() - started
+    timings["cache_status"] = start["cache_status"]
+    return timings
+
+
+async def run_level(api_url: str, urls: list, concurrency: int, flows: int, provider: str, mode: str) -> dict:
+    semaphore = asyncio.Semaphore(concurrency)
+    results, errors = [], []
+
+    async def one(index: int):
+        async with semaphore:
+            try:
+                results.append(await run_flow(client, urls[index % len(urls)], provider, mode))
+            except Exception as e:
+                errors.append(str(e))
+
+    limits = httpx.Limits(max_connections=concurrency * 2)
+    async with httpx.AsyncClient(base_url=api_url, timeout=300, limits=limits) as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(flows)))
+        wall = time.perf_counter() - started
+
+    summary = {"concurrency": concurrency, "flows": flows, "errors": len(errors),
+               "flows_per_s": round(len(results) / wall, 3), "wall_s": round(wall, 2)}
+    for step in ("start", "first_token", "continue", "approve"):
+        summary[step] = _percentiles([r[step] for r in results])
+    summary["cache_status"] = {s: sum(1 for r in results if r["cache_status"] == s) for s in {r["cache_status"] for r in results}}
+    if errors:
+        summary["first_error"] = errors[0][:300]
+    return summary
+
+
+def run(concurrency_levels: list, flows: int, chapters: int = 20, paragraphs: int = 12, ttft: float = 0.3,
+        tokens_per_second: float = 200.0, reply_words: int = 300, scrape: str = "warm", mode: str = "single") -> list:
+    with tempfile.TemporaryDirectory() as directory, \
+            Services(directory, chapters, paragraphs, ttft, tokens_per_second, reply_words, scrape) as services:
+        urls = list(services.chapter_urls)
+        results = []
+        for concurrency in concurrency_levels:
+            level = asyncio.run(run_level(services.api_url, urls, concurrency, flows, "cerebras", mode))
+            results.append(level)
+            print(f"concurrency {concurrency:>3}: {level['flows_per_s']:>7.2f} flows/s  errors {level['errors']}  "
+                  f"start p50 {level['start'].get('p50_ms')} ms  ttft p50 {level['first_token'].get('p50_ms')} ms  "
+                  f"continue p95 {level['continue'].get('p95_ms')} ms  approve p95 {level['approve'].get('p95_ms')} ms")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated in-flight flow limits.")
+    parser.add_argument("--flows", type=int, default=32, help="Flows per concurrency level.")
+    parser.add_argument("--chapters", type=int, default=20)
+    parser.add_argument("--paragraphs", type=int, default=12, help="Paragraphs per chapter.")
+    parser.add_argument("--scrape", choices=["warm", "cold"], default="warm")
+    parser.add_argument("--mode", choices=["single", "chunked", "auto"], default="single", help="generation_mode")
+    parser.add_argument("--ttft", type=float, default=0.3, help="Fake LLM seconds to first token.")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--reply-words", type=int, default=300)
+    parser.add_argument("--output", help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    results = run([int(c) for c in args.concurrency.split(",")], args.flows, args.chapters, args.paragraphs,
+                  args.ttft, args.tokens_per_second, args.reply_words, args.scrape, args.mode)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
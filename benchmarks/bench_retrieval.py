@@ -0,0 +1,96 @@
+"""
+Microbenchmarks for query_collection / query_collection_batch.
+
+    python -m benchmarks.bench_retrieval --chapters 50 --queries 200
+
+Runs against a temporary Chroma directory filled with the synthetic corpus
+and embedded with HashEmbeddingFunction, so no model download is needed.
+Measures uncached latency per mode (dense, keyword, hybrid), cached latency,
+and the per-query cost of one batched dense call.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.stand_ins import chapter_text, sandbox_env
+
+COLLECTION = "benchmark_passages"
+
+
+def _summary(timings: list) -> dict:
+    timings = sorted(t * 1e6 for t in timings)
+    return {
+        "mean_us": round(statistics.fmean(timings), 1),
+        "p50_us": round(timings[len(timings) // 2], 1),
+        "p95_us": round(timings[int(len(timings) * 0.95)], 1),
+    }
+
+
+def _queries(count: int, rng: random.Random) -> list:
+    # Short and long queries, so hybrid takes both its keyword-only and fused paths.
+    words = chapter_text(0, 8, seed=1).lower().replace(".", "").split()
+    return [" ".join(rng.choice(words) for _ in range(rng.choice([2, 3, 8, 14]))) + f" q{i}" for i in range(count)]
+
+
+def run(chapters: int, paragraphs: int, queries: int, batch_size: int, n_results: int = 3, seed: int = 0) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        os.environ.update(sandbox_env(directory))
+        from storage import chromadb_manager  # After the env: config is read at import
+
+        started = time.perf_counter()
+        for index in range(1, chapters + 1):
+            chromadb_manager.store_final_version(COLLECTION, f"chapter_{index:03d}", chapter_text(index, paragraphs, seed),
+                                                 {"chapter": str(index)})
+        results = {"chapters": chapters, "load_s": round(time.perf_counter() - started, 3)}
+        print(f"Loaded {chapters} chapters in {results['load_s']} s.")
+
+        rng = random.Random(seed)
+        for mode in ("dense", "keyword", "hybrid"):
+            texts = _queries(queries, rng)  # Fresh texts: every call misses the retrieval cache
+            chromadb_manager.query_collection(COLLECTION, texts[0], n_results, mode)  # Builds the keyword index
+            uncached = []
+            for text in texts[1:]:
+                start = time.perf_counter()
+                chromadb_manager.query_collection(COLLECTION, text, n_results, mode)
+                uncached.append(time.perf_counter() - start)
+            cached = []
+            for text in texts[1:]:
+                start = time.perf_counter()
+                chromadb_manager.query_collection(COLLECTION, text, n_results, mode)
+                cached.append(time.perf_counter() - start)
+            results[mode] = _summary(uncached)
+            results[f"{mode}_cached"] = _summary(cached)
+            print(f"{mode:>8}: uncached p50 {results[mode]['p50_us']:>9} us  p95 {results[mode]['p95_us']:>9} us  "
+                  f"cached p50 {results[mode + '_cached']['p50_us']:>7} us")
+
+        texts = _queries(batch_size * max(1, queries // batch_size), rng)
+        start = time.perf_counter()
+        for i in range(0, len(texts), batch_size):
+            chromadb_manager.query_collection_batch(COLLECTION, texts[i:i + batch_size], n_results)
+        results["batch"] = {"batch_size": batch_size,
+                            "us_per_query": round((time.perf_counter() - start) * 1e6 / len(texts), 1)}
+        print(f"   batch: {results['batch']['us_per_query']} us/query at batch size {batch_size}")
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chapters", type=int, default=50)
+    parser.add_argument("--paragraphs", type=int, default=12, help="Paragraphs per chapter.")
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries per mode.")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--output", help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    results = run(args.chapters, args.paragraphs, args.queries, args.batch_size)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
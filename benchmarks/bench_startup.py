@@ -0,0 +1,72 @@
+"""
+Startup-time measurement for the API.
+
+    python -m benchmarks.bench_startup --runs 5
+
+Each run starts a fresh interpreter and measures:
+  - import: `import api` (what a replica pays before it can bind a port)
+  - live: lifespan startup until /healthz answers
+  - ready: until /readyz reports every subsystem as ready (or one failed),
+    with the per-subsystem init times
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+_PROBE = r"""
+import json, time
+started = time.perf_counter()
+import api
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(api.api) as client:
+    client.get("/healthz").raise_for_status()
+    live = time.perf_counter()
+    deadline = live + {timeout}
+    while True:
+        body = client.get("/readyz").json()
+        if all(s["status"] in ("ready", "failed") for s in body["subsystems"].values()) or time.perf_counter() > deadline:
+            break
+        time.sleep(0.05)
+    ready = time.perf_counter()
+print("RESULT " + json.dumps({{
+    "import_s": imported - started, "live_s": live - started, "ready_s": ready - started,
+    "all_ready": body["ready"], "subsystems": body["subsystems"],
+}}))
+"""
+
+
+def run_once(timeout: float) -> dict:
+    proc = subprocess.run([sys.executable, "-c", _PROBE.format(timeout=timeout)],
+                          capture_output=True, text=True, timeout=timeout + 60)
+    for line in proc.stdout.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"Startup probe failed:\n{proc.stderr[-2000:]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for readiness per run.")
+    parser.add_argument("--output", help="Optional JSON file for the results.")
+    args = parser.parse_args()
+
+    runs = [run_once(args.timeout) for _ in range(args.runs)]
+    summary = {
+        key: {"median": round(statistics.median(r[key] for r in runs), 3), "max": round(max(r[key] for r in runs), 3)}
+        for key in ("import_s", "live_s", "ready_s")
+    }
+    for key, values in summary.items():
+        print(f"{key:>9}: median {values['median']:>6.3f} s  max {values['max']:>6.3f} s")
+    for name, status in runs[-1]["subsystems"].items():
+        print(f"  {name:>9}: {status}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"summary": summary, "runs": runs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
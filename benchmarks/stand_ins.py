@@ -0,0 +1,208 @@
+"""
+Local stand-ins for the services the hot paths normally call, so benchmarks
+run offline and give the same numbers from run to run:
+
+  - HashEmbeddingFunction: deterministic bag-of-words embeddings instead of
+    Chroma's downloaded model (set via CHROMA_EMBEDDING_FUNCTION)
+  - a fake OpenAI-compatible LLM that streams with a set time-to-first-token
+    and token rate (served as the "cerebras" provider)
+  - a static HTML corpus in the page layout the scraper expects
+  - sandbox_env(): SQLite, Chroma, caches and policy files in a temp dir
+
+    python -m benchmarks.stand_ins llm --port 8790 --ttft 0.3 --tokens-per-second 200
+    python -m benchmarks.stand_ins corpus ./corpus --chapters 20 --serve 8791
+"""
+import argparse
+import asyncio
+import functools
+import hashlib
+import html
+import json
+import os
+import random
+import re
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from chromadb.api.types import EmbeddingFunction
+
+# --- Embeddings ---
+class HashEmbeddingFunction(EmbeddingFunction):
+    """Hashed bag-of-words vectors: no model download, stable across processes."""
+    def __init__(self, dimensions: int = 384):
+        self.dimensions = dimensions
+
+    def __call__(self, input):
+        vectors = np.zeros((len(input), self.dimensions), dtype=np.float32)
+        for row, text in enumerate(input):
+            for word in re.findall(r"\w+", text.lower()):
+                digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+                vectors[row, int.from_bytes(digest[:4], "little") % self.dimensions] += 1.0 if digest[4] & 1 else -1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm:
+                vectors[row] /= norm
+        return list(vectors)
+
+    @staticmethod
+    def name() -> str:
+        return "benchmark_hash"
+
+    def get_config(self) -> dict:
+        return {"dimensions": self.dimensions}
+
+    @staticmethod
+    def build_from_config(config: dict) -> "HashEmbeddingFunction":
+        return HashEmbeddingFunction(config.get("dimensions", 384))
+
+# --- Fake LLM ---
+def build_fake_llm(ttft: float = 0.3, tokens_per_second: float = 200.0, reply_words: int = 300):
+    """
+    OpenAI-style /v1/chat/completions that "rewrites" the prompt: it replies
+    with up to `reply_words` words taken from the last message, after `ttft`
+    seconds, at `tokens_per_second` (one word per token).
+    """
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    app = FastAPI()
+    app.state.requests = 0
+
+    def reply_for(body: dict) -> list:
+        words = body["messages"][-1]["content"].split() or ["empty"]
+        return [words[i % len(words)] for i in range(reply_words)]
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        words = reply_for(body)
+        usage = {"prompt_tokens": len(body["messages"][-1]["content"].split()), "completion_tokens": len(words)}
+        if not body.get("stream"):
+            await asyncio.sleep(ttft + len(words) / tokens_per_second)
+            return {"choices": [{"message": {"role": "assistant", "content": " ".join(words)}}], "usage": usage}
+
+        async def events():
+            await asyncio.sleep(ttft)
+            for i, word in enumerate(words):
+                delta = {"choices": [{"delta": {"content": word if i == 0 else " " + word}}]}
+                yield f"data: {json.dumps(delta)}\n\n"
+                await asyncio.sleep(1 / tokens_per_second)
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/stats")
+    def stats():
+        return {"requests": app.state.requests}
+
+    return app
+
+# --- HTML Corpus ---
+_VOCABULARY = ("ship sea storm captain harbour wind sail night island crew letter voyage lantern shore tide "
+               "silence distant ancient garden window morning river mountain journey stranger promise secret "
+               "memory shadow village market road winter summer forest bridge castle king daughter friend "
+               "quietly slowly suddenly never always again before after beneath across toward within").split()
+
+def chapter_text(index: int, paragraphs: int, seed: int = 0) -> str:
+    """Deterministic pseudo-prose for chapter `index` (paragraphs separated by blank lines)."""
+    rng = random.Random(seed * 100003 + index)
+    result = []
+    for _ in range(paragraphs):
+        sentences = []
+        for _ in range(rng.randint(4, 8)):
+            words = [rng.choice(_VOCABULARY) for _ in range(rng.randint(8, 18))]
+            sentences.append(" ".join(words).capitalize() + ".")
+        result.append(" ".join(sentences))
+    return "\n\n".join(result)
+
+def write_corpus(directory: str, chapters: int = 20, paragraphs: int = 12, seed: int = 0) -> dict:
+    """
+    Writes chapter_NNN.html pages (content inside .mw-parser-output, like the
+    real source) plus an index.html table of contents. Returns {path: text}.
+    """
+    os.makedirs(directory, exist_ok=True)
+    pages = {}
+    for index in range(1, chapters + 1):
+        path = f"chapter_{index:03d}.html"
+        text = chapter_text(index, paragraphs, seed)
+        body = "".join(f"<p>{html.escape(p)}</p>\n" for p in text.split("\n\n"))
+        with open(os.path.join(directory, path), "w", encoding="utf-8") as f:
+            f.write(f"<html><head><title>Chapter {index}</title></head><body>"
+                    f"<nav>Navigation</nav><div class=\"mw-parser-output\">\n{body}</div></body></html>")
+        pages[path] = text
+    links = "".join(f'<li><a href="{path}">{path}</a></li>' for path in pages)
+    with open(os.path.join(directory, "index.html"), "w", encoding="utf-8") as f:
+        f.write(f"<html><body><div class=\"mw-parser-output\"><ul>{links}</ul></div></body></html>")
+    return pages
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve_directory(directory: str, port: int = 0):
+    """Serves `directory` over HTTP on a background thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), functools.partial(_QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, name="corpus-server", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+# --- Sandbox ---
+def sandbox_env(directory: str, llm_url: str = None) -> dict:
+    """Environment overrides that keep every store in `directory` and route LLM calls to the fake server."""
+    env = {
+        "DATABASE_URL": f"sqlite:///{os.path.join(directory, 'bench.sqlite3')}",
+        "CHROMA_DB_PATH": os.path.join(directory, "chroma"),
+        "CHROMA_EMBEDDING_FUNCTION": "benchmarks.stand_ins:HashEmbeddingFunction",
+        "SCREENSHOT_STORE_PATH": os.path.join(directory, "screenshots"),
+        "VERSION_STORE_PATH": os.path.join(directory, "versions.sqlite3"),
+        "CHECKPOINT_DB_PATH": os.path.join(directory, "checkpoints.sqlite3"),
+        "LLM_CACHE_PATH": os.path.join(directory, "llm_cache.sqlite3"),
+        "LLM_CACHE_ENABLED": "false",
+        "BANDIT_POLICY_PATH": os.path.join(directory, "bandit_policy.joblib"),
+        "BANDIT_RATINGS_LOG_PATH": os.path.join(directory, "ratings.log"),
+        "LOG_LEVEL": "WARNING",
+        "TRACING_ENABLED": "false",
+    }
+    if llm_url:
+        env.update({
+            "CEREBRAS_BASE_URL": f"{llm_url}/v1",
+            "CEREBRAS_API_KEY": "benchmark",
+            "GEMINI_API_KEY": "",  # Empty values keep real keys from .env out of the run
+            "GROQ_API_KEY": "",
+            "ROUTER_PROVIDERS": "cerebras",
+        })
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    llm = commands.add_parser("llm", help="Run the fake streaming LLM server.")
+    llm.add_argument("--port", type=int, default=8790)
+    llm.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token.")
+    llm.add_argument("--tokens-per-second", type=float, default=200.0)
+    llm.add_argument("--reply-words", type=int, default=300)
+    corpus = commands.add_parser("corpus", help="Write (and optionally serve) the HTML corpus.")
+    corpus.add_argument("directory")
+    corpus.add_argument("--chapters", type=int, default=20)
+    corpus.add_argument("--paragraphs", type=int, default=12)
+    corpus.add_argument("--serve", type=int, metavar="PORT", help="Serve the corpus on this port until interrupted.")
+    args = parser.parse_args()
+
+    if args.command == "llm":
+        import uvicorn
+        uvicorn.run(build_fake_llm(args.ttft, args.tokens_per_second, args.reply_words),
+                    host="127.0.0.1", port=args.port, log_level="warning")
+    else:
+        pages = write_corpus(args.directory, args.chapters, args.paragraphs)
+        print(f"Wrote {len(pages)} chapters to {args.directory}.")
+        if args.serve is not None:
+            server, base_url = serve_directory(args.directory, args.serve)
+            print(f"Serving at {base_url}/index.html (Ctrl+C to stop).")
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Runs the benchmarks with fixed parameters and compares saved results.
+
+    python -m benchmarks.suite run --label baseline
+    python -m benchmarks.suite run --label my-change --profile quick --only e2e,retrieval
+    python -m benchmarks.suite compare baseline my-change --threshold 0.2
+
+`run` executes each benchmark in its own process (they configure the
+environment before importing the app) and saves the flattened metrics with
+the git commit, Python version and parameters to benchmarks/results/<label>.json.
+
+`compare` lists every metric that got worse by more than --threshold
+(relative) and exits with status 1 if there is any. Metrics ending in
+`_per_s` are higher-is-better; all others are latencies, lower-is-better.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+PROFILES = {
+    "quick": {
+        "e2e": ["--concurrency", "1,4", "--flows", "8", "--chapters", "8"],
+        "bandit": ["--checkpoints", "100,10000", "--samples", "200"],
+        "retrieval": ["--chapters", "20", "--queries", "50"],
+    },
+    "full": {
+        "e2e": ["--concurrency", "1,4,16", "--flows", "48", "--chapters", "20"],
+        "bandit": ["--checkpoints", "100,1000,10000,100000", "--samples", "500"],
+        "retrieval": ["--chapters", "100", "--queries", "200"],
+    },
+}
+
+# --- Flattening ---
+def _flatten_e2e(results: list) -> dict:
+    metrics = {}
+    for level in results:
+        prefix = f"e2e.c{level['concurrency']}"
+        metrics[f"{prefix}.flows_per_s"] = level["flows_per_s"]
+        metrics[f"{prefix}.errors"] = level["errors"]
+        for step in ("start", "first_token", "continue", "approve"):
+            for stat in ("p50_ms", "p95_ms", "p99_ms"):
+                if stat in level[step]:
+                    metrics[f"{prefix}.{step}_{stat}"] = level[step][stat]
+    return metrics
+
+def _flatten_bandit(update: list, choose: list) -> dict:
+    metrics = {}
+    for row in update:
+        metrics[f"bandit.update.r{row['ratings']}.p50_us"] = row["p50_us"]
+        metrics[f"bandit.update.r{row['ratings']}.p95_us"] = row["p95_us"]
+    for row in choose:
+        metrics[f"bandit.choose.b{row['batch_size']}.single_us"] = row["single_us_per_query"]
+        metrics[f"bandit.choose.b{row['batch_size']}.batched_us"] = row["batched_us_per_query"]
+    return metrics
+
+def _flatten_retrieval(results: dict) -> dict:
+    metrics = {"retrieval.load_s": results["load_s"], "retrieval.batch_us": results["batch"]["us_per_query"]}
+    for mode in ("dense", "keyword", "hybrid"):
+        for suffix in ("", "_cached"):
+            metrics[f"retrieval.{mode}{suffix}.p50_us"] = results[mode + suffix]["p50_us"]
+            metrics[f"retrieval.{mode}{suffix}.p95_us"] = results[mode + suffix]["p95_us"]
+    return metrics
+
+# --- Running ---
+def _run_benchmark(module: str, args: list) -> object:
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, "result.json")
+        subprocess.run([sys.executable, "-m", f"benchmarks.{module}", *args, "--output", output], cwd=REPO_ROOT, check=True)
+        with open(output) as f:
+            return json.load(f)
+
+def run_suite(profile: str, only: list, extra_e2e: list) -> dict:
+    parameters = PROFILES[profile]
+    metrics = {}
+    if "e2e" in only:
+        metrics.update(_flatten_e2e(_run_benchmark("bench_e2e", parameters["e2e"] + extra_e2e)))
+    if "bandit" in only:
+        update = _run_benchmark("bench_bandit", ["update", *parameters["bandit"]])
+        choose = _run_benchmark("bench_bandit", ["choose"])
+        metrics.update(_flatten_bandit(update, choose))
+    if "retrieval" in only:
+        metrics.update(_flatten_retrieval(_run_benchmark("bench_retrieval", parameters["retrieval"])))
+    return metrics
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def _results_path(label: str) -> str:
+    return label if label.endswith(".json") else os.path.join(RESULTS_DIR, f"{label}.json")
+
+# --- Comparing ---
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+def compare(baseline: dict, candidate: dict, threshold: float) -> list:
+    """Metrics present in both runs that regressed by more than `threshold`: (metric, baseline, candidate, change)."""
+    regressions = []
+    for metric, before in baseline.items():
+        after = candidate.get(metric)
+        if after is None:
+            continue
+        if before == 0:
+            change = 0.0 if after == 0 else float("inf")
+        else:
+            change = (after - before) / abs(before)
+        if higher_is_better(metric):
+            change = -change
+        if change > threshold:
+            regressions.append((metric, before, after, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="Run the benchmarks and save the results.")
+    run.add_argument("--label", required=True, help="Results name (benchmarks/results/<label>.json).")
+    run.add_argument("--profile", choices=sorted(PROFILES), default="full")
+    run.add_argument("--only", default="e2e,bandit,retrieval", help="Comma-separated benchmarks to run.")
+    run.add_argument("--scrape", choices=["warm", "cold"], default="warm", help="Passed to bench_e2e.")
+    diff = commands.add_parser("compare", help="Compare two saved results.")
+    diff.add_argument("baseline")
+    diff.add_argument("candidate")
+    diff.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown.")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        only = [name.strip() for name in args.only.split(",") if name.strip()]
+        metrics = run_suite(args.profile, only, ["--scrape", args.scrape])
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        result = {
+            "meta": {
+                "label": args.label, "commit": _git_commit(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+                "profile": args.profile, "parameters": {name: PROFILES[args.profile][name] for name in only},
+                "scrape": args.scrape,
+            },
+            "metrics": metrics,
+        }
+        with open(_results_path(args.label), "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved {len(metrics)} metrics to {_results_path(args.label)}.")
+        return
+
+    with open(_results_path(args.baseline)) as f:
+        baseline = json.load(f)
+    with open(_results_path(args.candidate)) as f:
+        candidate = json.load(f)
+    if baseline["meta"].get("profile") != candidate["meta"].get("profile"):
+        print(f"Warning: comparing profile {baseline['meta'].get('profile')} with {candidate['meta'].get('profile')}.")
+    regressions = compare(baseline["metrics"], candidate["metrics"], args.threshold)
+    shared = len(set(baseline["metrics"]) & set(candidate["metrics"]))
+    for metric, before, after, change in regressions:
+        print(f"REGRESSION {metric}: {before} -> {after} ({change:+.0%} worse)")
+    print(f"{len(regressions)} of {shared} metrics regressed by more than {args.threshold:.0%} "
+          f"({baseline['meta']['commit']} -> {candidate['meta']['commit']}).")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
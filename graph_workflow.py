@@ -1,17 +1,29 @@
-from typing import TypedDict, List
+import asyncio
+import logging
+import operator
+import threading
+from typing import Annotated, TypedDict, List
 from langgraph.graph import StateGraph, END
+from langgraph.types import StreamWriter
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.runnables import Runnable
 
-from ai_services.llm_agents import get_llm_chain
+from ai_services.llm_agents import get_llm_chain, warm_llm_clients, MODEL_MAP
+from ai_services.response_cache import response_cache
+from ai_services.chunking import split_into_chunks, chunks_touched_by_feedback
+from ai_services import token_budget
+from config import CHUNK_THRESHOLD_CHARS, CHUNK_CONCURRENCY, CHECKPOINT_DB_PATH
 
-# --- State Definition (Unchanged) ---
+logger = logging.getLogger(__name__)
+
+# --- State Definition ---
 class GraphState(TypedDict):
-    feedback: List[str]
+    feedback: Annotated[List[str], operator.add]  # Appended to on every round
     llm_provider: str
     scraped_text: str
     generated_text: str
-    spun_content: str
+    generation_mode: str  # "single", "chunked" or "auto" (chunk only long chapters)
+    generated_chunks: List[str]  # Per-section output of the last chunked run
 
 # --- Prompt Engineering (Unchanged) ---
 generator_prompt = ChatPromptTemplate.from_messages([
@@ -22,40 +34,295 @@ generator_prompt = ChatPromptTemplate.from_messages([
 --- Current Generated Version ---
 {generated_text}
 
+--- Earlier Feedback (already applied) ---
+{earlier_feedback}
+
 --- User Feedback ---
 {feedback}
 
 --- New, Improved Version Below (write only the text) ---""")
 ])
 
+chunk_prompt = ChatPromptTemplate.from_messages([
+    ("system", "You are an expert editor. You are rewriting one section of a longer chapter; the other sections are handled separately, so do not summarise or refer to them. You will be given the 'Scraped Original' of this section and its 'Current Generated Version'. Use both along with the user's 'Feedback' to produce an improved version of this section only. Prioritize the user's feedback. If the 'Current Generated Version' is empty, focus on rewriting the 'Scraped Original'."),
+    ("human", """--- Section {section_number} of {section_count}: Scraped Original ---
+{scraped_text}
+
+--- Current Generated Version of This Section ---
+{generated_text}
+
+--- User Feedback ---
+{feedback}
+
+--- New, Improved Version of This Section Below (write only the text) ---""")
+])
+
 def create_generator_chain(llm: Runnable) -> Runnable:
     return generator_prompt | llm
 
+def create_chunk_chain(llm: Runnable) -> Runnable:
+    return chunk_prompt | llm
+
+# Prebuilt chains, shared by all requests (the LLM underneath comes from the client registry).
+_CHAIN_BUILDERS = {"full": create_generator_chain, "chunk": create_chunk_chain}
+_chain_registry = {}
+_chain_registry_lock = threading.Lock()
+
+def get_chain(provider: str, kind: str = "full") -> Runnable:
+    key = (kind, provider)
+    chain = _chain_registry.get(key)
+    if chain is None:
+        with _chain_registry_lock:
+            chain = _chain_registry.get(key)
+            if chain is None:
+                chain = _chain_registry[key] = _CHAIN_BUILDERS[kind](get_llm_chain(provider))
+    return chain
+
+def warm_chains() -> list:
+    """Warms LLM clients and prebuilds both chains for every usable provider."""
+    providers = warm_llm_clients()
+    token_budget.count_tokens("warm")  # Loads the tokenizer off the request path
+    for provider in providers:
+        for kind in _CHAIN_BUILDERS:
+            get_chain(provider, kind)
+    return providers
+
+# --- Token Budgeting ---
+# Every call's prompt is sized offline before anything is sent, so oversize
+# requests are trimmed or rejected up front instead of failing at the provider.
+def _fit_prompt(template, prompt_inputs: dict, provider: str, earlier_feedback: list = None) -> tuple:
+    """
+    Fits one call's prompt to the model's budget: the oldest earlier-feedback
+    notes are dropped first, then the middle of the current version is cut
+    out. Raises PromptTooLarge if the prompt still does not fit; otherwise
+    returns the prompt inputs and the call's token estimate.
+    """
+    count = token_budget.count_tokens
+    limits = token_budget.model_limits(provider)
+    completion = token_budget.completion_reserve(count(prompt_inputs["scraped_text"]), limits)
+    budget = token_budget.prompt_budget(limits, completion)
+    fixed = token_budget.template_tokens(template) + sum(
+        count(str(value)) for name, value in prompt_inputs.items() if name != "generated_text")
+    generated = count(prompt_inputs["generated_text"])
+
+    notes = earlier_feedback or []
+    note_tokens = [count(note) + 2 for note in notes]
+    dropped = 0
+    while dropped < len(notes) and fixed + generated + sum(note_tokens[dropped:]) > budget:
+        dropped += 1
+    fixed += sum(note_tokens[dropped:]) + (8 if dropped else 0)
+
+    fitted = dict(prompt_inputs)
+    if earlier_feedback is not None:
+        lines = ([f"({dropped} earlier notes omitted)"] if dropped else []) + [f"- {note}" for note in notes[dropped:]]
+        fitted["earlier_feedback"] = "\n".join(lines) or "(none)"
+    if fixed + generated > budget:
+        fitted["generated_text"] = token_budget.excerpt(prompt_inputs["generated_text"], budget - fixed)
+        generated = count(fitted["generated_text"])
+    prompt_tokens = fixed + generated
+    if prompt_tokens > budget:
+        raise token_budget.PromptTooLarge(
+            f"Prompt needs ~{prompt_tokens} tokens but {limits['model']} allows {budget} "
+            f"after reserving {completion} for the reply; use chunked generation or a larger model."
+        )
+    return fitted, {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion,
+        "dropped_feedback": dropped,
+        "trimmed_generated_text": fitted["generated_text"] != prompt_inputs["generated_text"],
+    }
+
+def _report_budget(writer: StreamWriter, provider: str, calls: list):
+    """Streams the preflight estimate of the calls about to be made; cache hits cost nothing."""
+    billable = [call for call in calls if not call["cached"]]
+    estimate = token_budget.usage_estimate(provider, sum(c["prompt_tokens"] for c in billable),
+                                           sum(c["completion_tokens"] for c in billable))
+    estimate.update({
+        "calls": len(billable),
+        "cached_calls": len(calls) - len(billable),
+        "dropped_feedback": max((c["dropped_feedback"] for c in calls), default=0),
+        "trimmed_generated_text": any(c["trimmed_generated_text"] for c in calls),
+    })
+    writer({"budget": estimate})
+
 # --- Graph Nodes ---
-# FIXED: Converted the node to be fully asynchronous
-async def generator_node(state: GraphState):
+# Nodes push tokens through the stream writer (read with stream_mode="custom")
+# and return only their state update.
+async def generator_node(state: GraphState, writer: StreamWriter):
     """An ASYNCHRONOUS node that streams text token-by-token."""
-    print(f"---NODE: ASYNC GENERATING (using {state['llm_provider']})---")
-    llm = get_llm_chain(state['llm_provider'])
-    generator_chain = create_generator_chain(llm)
+    logger.debug("Generating in one call with %s.", state['llm_provider'])
 
-    prompt_inputs = {
+    provider = state['llm_provider']
+    feedback = state.get('feedback') or ["Initial spin."]
+    prompt_inputs, call = _fit_prompt(generator_prompt, {
         "scraped_text": state['scraped_text'],
-        "generated_text": state['generated_text'],
-        "feedback": state.get('feedback', ["Initial spin."])[-1]
-    }
-    
+        "generated_text": state.get('generated_text', ""),
+        "feedback": feedback[-1]
+    }, provider, earlier_feedback=[f for f in feedback[:-1] if f])
+
+    # Identical prompt + model → replay the cached chunks through the same stream.
+    model_name = MODEL_MAP.get(provider, provider)
+    cache_key = response_cache.make_key(model_name, generator_prompt.format(**prompt_inputs))
+    cached_chunks = await asyncio.to_thread(response_cache.get, cache_key)
+    call["cached"] = cached_chunks is not None
+    _report_budget(writer, provider, [call])
+    if cached_chunks is not None:
+        for content in cached_chunks:
+            writer({"token": content})
+        writer({"usage": token_budget.usage_estimate(provider, 0, 0)})
+        return {"generated_text": "".join(cached_chunks), "generated_chunks": []}
+
+    generator_chain = get_chain(provider, "full")
+
     # Use the asynchronous streaming method: .astream()
     stream = generator_chain.astream(prompt_inputs)
-    
+
     # Use 'async for' to iterate over the asynchronous stream
+    chunks = []
     async for chunk in stream:
         content = chunk.content if hasattr(chunk, 'content') else chunk
-        yield {"spun_content": content}
+        if isinstance(content, str) and content:
+            chunks.append(content)
+            writer({"token": content})
+    # Only complete responses are cached; an interrupted stream never reaches here.
+    await asyncio.to_thread(response_cache.put, cache_key, chunks)
+    generated_text = "".join(chunks)
+    writer({"usage": token_budget.usage_estimate(provider, call["prompt_tokens"], token_budget.count_tokens(generated_text))})
+    # The sections no longer match generated_text; the next chunked round must rewrite them all.
+    return {"generated_text": generated_text, "generated_chunks": []}
+
+async def chunked_generator_node(state: GraphState, writer: StreamWriter):
+    """
+    Map-reduce variant for long chapters: sections are rewritten in parallel
+    (at most CHUNK_CONCURRENCY at once) and streamed back in order. On later
+    feedback rounds only the sections the feedback refers to are regenerated.
+    """
+    logger.debug("Generating section by section with %s.", state['llm_provider'])
+    original_chunks = split_into_chunks(state['scraped_text'])
+    previous_chunks = state.get('generated_chunks') or []
+    feedback = (state.get('feedback') or ["Initial spin."])[-1]
+
+    if len(previous_chunks) == len(original_chunks):
+        touched = chunks_touched_by_feedback(feedback, original_chunks, previous_chunks)
+    else:
+        previous_chunks = [""] * len(original_chunks)
+        touched = set(range(len(original_chunks)))
+    logger.debug("Regenerating %d of %d sections.", len(touched), len(original_chunks))
+
+    provider = state['llm_provider']
+    model_name = MODEL_MAP.get(provider, provider)
+
+    # Size every section's prompt before the first call goes out.
+    plans = {}
+    for index in sorted(touched):
+        prompt_inputs, call = _fit_prompt(chunk_prompt, {
+            "section_number": index + 1,
+            "section_count": len(original_chunks),
+            "scraped_text": original_chunks[index],
+            "generated_text": previous_chunks[index],
+            "feedback": feedback,
+        }, provider)
+        cache_key = response_cache.make_key(model_name, chunk_prompt.format(**prompt_inputs))
+        cached_chunks = await asyncio.to_thread(response_cache.get, cache_key)
+        call["cached"] = cached_chunks is not None
+        plans[index] = (prompt_inputs, cache_key, cached_chunks, call)
+    _report_budget(writer, provider, [plan[3] for plan in plans.values()])
+
+    chunk_chain = get_chain(provider, "chunk") if touched else None
+    semaphore = asyncio.Semaphore(CHUNK_CONCURRENCY)
 
-# --- Graph Assembly (Unchanged) ---
+    async def rewrite(index: int) -> str:
+        prompt_inputs, cache_key, cached_chunks, _ = plans[index]
+        if cached_chunks is not None:
+            return "".join(cached_chunks)
+        async with semaphore:
+            result = await chunk_chain.ainvoke(prompt_inputs)
+        content = result.content if hasattr(result, 'content') else result
+        await asyncio.to_thread(response_cache.put, cache_key, [content])
+        return content
+
+    tasks = [asyncio.create_task(rewrite(i)) if i in touched else None for i in range(len(original_chunks))]
+    outputs = []
+    try:
+        for i, task in enumerate(tasks):
+            content = await task if task else previous_chunks[i]
+            outputs.append(content)
+            separator = "\n\n" if i < len(tasks) - 1 else ""
+            writer({"token": content + separator})
+    finally:
+        for task in tasks:
+            if task and not task.done():
+                task.cancel()
+    billable = [i for i, plan in plans.items() if plan[2] is None]
+    writer({"usage": token_budget.usage_estimate(provider, sum(plans[i][3]["prompt_tokens"] for i in billable),
+                                                 sum(token_budget.count_tokens(outputs[i]) for i in billable))})
+    return {"generated_chunks": outputs, "generated_text": "\n\n".join(outputs)}
+
+def route_generation(state: GraphState) -> str:
+    """"auto" chunks long chapters and any chapter a single call could not hold or rewrite in one reply."""
+    mode = state.get('generation_mode') or "single"
+    if mode == "chunked":
+        return "chunked_generator"
+    if mode == "auto" and (len(state['scraped_text']) > CHUNK_THRESHOLD_CHARS or
+                           not token_budget.fits_single_call(generator_prompt, state['scraped_text'], state['llm_provider'],
+                                                             state.get('generated_text') or "")):
+        return "chunked_generator"
+    return "generator"
+
+# --- Graph Assembly ---
 workflow = StateGraph(GraphState)
 workflow.add_node("generator", generator_node)
-workflow.set_entry_point("generator")
+workflow.add_node("chunked_generator", chunked_generator_node)
+workflow.set_conditional_entry_point(route_generation, {"generator": "generator", "chunked_generator": "chunked_generator"})
 workflow.add_edge("generator", END)
-app = workflow.compile()
\ No newline at end of file
+workflow.add_edge("chunked_generator", END)
+app = workflow.compile()
+
+# --- Durable Checkpointing ---
+# With a checkpointer, thread state (texts, chunks, feedback history) lives
+# server-side, so continue requests only need the thread id and new feedback.
+_checkpoint_conn = None
+
+async def enable_checkpointing(path: str = CHECKPOINT_DB_PATH):
+    """Recompiles `app` with a SQLite checkpointer. Call once at startup."""
+    global app, _checkpoint_conn
+    import aiosqlite
+    from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+
+    _checkpoint_conn = await aiosqlite.connect(path)
+    saver = AsyncSqliteSaver(_checkpoint_conn)
+    await saver.setup()
+    app = workflow.compile(checkpointer=saver)
+    logger.info("Graph checkpointing enabled at '%s'.", path)
+    return app
+
+async def disable_checkpointing():
+    global app, _checkpoint_conn
+    if _checkpoint_conn is not None:
+        await _checkpoint_conn.close()
+        _checkpoint_conn = None
+    app = workflow.compile()
+
+async def start_thread(thread_id: str, scraped_text: str):
+    """Seeds a new thread with the scraped chapter so later rounds need not resend it."""
+    config = {"configurable": {"thread_id": thread_id}}
+    await app.aupdate_state(config, {"scraped_text": scraped_text, "generated_text": "", "generated_chunks": []},
+                            as_node="__start__")
+
+async def stream_tokens(state_update: dict, config: dict, on_event=None):
+    """
+    Runs one round on a thread and yields the generated text as it streams.
+    Other node output (the "budget" preflight and final "usage") goes to `on_event`.
+    """
+    async for chunk in app.astream(state_update, config=config, stream_mode="custom"):
+        if not isinstance(chunk, dict):
+            continue
+        token = chunk.get("token")
+        if token:
+            yield token
+        elif on_event is not None:
+            on_event(chunk)
+
+async def get_thread_state(thread_id: str) -> dict:
+    snapshot = await app.aget_state({"configurable": {"thread_id": thread_id}})
+    return snapshot.values
\ No newline at end of file
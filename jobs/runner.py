@@ -0,0 +1,333 @@
+import asyncio
+import logging
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+
+from sqlalchemy import select, update, func, or_
+
+from config import (JOB_WORKERS, JOB_QUEUE_SIZE, JOB_MAX_ATTEMPTS, JOB_RETRY_BACKOFF, JOB_STALE_SECONDS,
+                    JOB_HEARTBEAT_SECONDS, JOB_PROVIDER_CONCURRENCY, JOB_PROVIDER_TPM, JOB_DEFAULT_CONCURRENCY, JOB_DEFAULT_TPM)
+from storage.database import AsyncSessionLocal, GenerationJob, JobChapter, ScrapedContent
+
+logger = logging.getLogger(__name__)
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class TokenBucket:
+    """
+    Token-rate budget of `rate_per_minute`, allowing bursts of up to one
+    minute's worth. Waiters are served in arrival order.
+    """
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: int):
+        amount = min(amount, self.capacity)  # An oversized request waits for a full bucket instead of forever
+        async with self._lock:
+            self._refill()
+            while self.tokens < amount:
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= amount
+
+    def drain(self):
+        """Empties the bucket after the provider pushed back (e.g. a 429)."""
+        self._refill()
+        self.tokens = min(self.tokens, 0.0)
+
+
+class ProviderLimits:
+    """Per-provider concurrency semaphore plus token bucket."""
+    def __init__(self, concurrency: dict = None, tokens_per_minute: dict = None):
+        self.concurrency = concurrency if concurrency is not None else JOB_PROVIDER_CONCURRENCY
+        self.tokens_per_minute = tokens_per_minute if tokens_per_minute is not None else JOB_PROVIDER_TPM
+        self.semaphores = {}
+        self.buckets = {}
+
+    def semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self.semaphores:
+            self.semaphores[provider] = asyncio.Semaphore(self.concurrency.get(provider, JOB_DEFAULT_CONCURRENCY))
+        return self.semaphores[provider]
+
+    def bucket(self, provider: str) -> TokenBucket:
+        if provider not in self.buckets:
+            self.buckets[provider] = TokenBucket(self.tokens_per_minute.get(provider, JOB_DEFAULT_TPM))
+        return self.buckets[provider]
+
+    def least_busy(self, ranked: list) -> str:
+        """The first of `ranked` providers with a free concurrency slot (the first one if all are busy)."""
+        return next((p for p in ranked if not self.semaphore(p).locked()), ranked[0])
+
+
+class JobRunner:
+    """
+    Works through queued job chapters in the background.
+
+    The database is the backlog: a feeder keeps a bounded asyncio queue topped
+    up with the oldest queued chapters, and `workers` tasks take chapters from
+    it, claim them with a conditional UPDATE (so several processes can share
+    the backlog), wait for their provider's concurrency slot and token budget,
+    and run the generation graph. Retryable provider errors put the chapter
+    straight back in the queue with an exponential-backoff `retry_at` that
+    the feeder honours, so waiting retries never hold a worker. Running
+    chapters refresh a heartbeat; one silent for JOB_STALE_SECONDS (its
+    process crashed) is requeued.
+    """
+    def __init__(self, graph_loader, db_ready=None, workers: int = JOB_WORKERS, queue_size: int = JOB_QUEUE_SIZE,
+                 limits: ProviderLimits = None):
+        self.graph_loader = graph_loader  # async () -> graph_workflow module
+        self.db_ready = db_ready  # async () -> None, awaited before touching the database
+        self.workers = workers
+        self.limits = limits or ProviderLimits()
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._dispatched = set()  # Chapter ids in the queue or being worked on by this process
+        self._running = {}  # chapter id -> task, for cancellation
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    # --- Lifecycle ---
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._feed())]
+            self._tasks += [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        self._wakeup.set()
+
+    # --- Jobs ---
+    async def submit(self, db, content_ids: list, llm_provider: str, feedback: str, generation_mode: str) -> GenerationJob:
+        job = GenerationJob(id=str(uuid.uuid4()), llm_provider=llm_provider, feedback=feedback,
+                            generation_mode=generation_mode, status="running")
+        db.add(job)
+        db.add_all(JobChapter(job_id=job.id, content_id=content_id, position=i, status="queued", attempts=0)
+                   for i, content_id in enumerate(content_ids))
+        await db.commit()
+        self.wake()
+        return job
+
+    async def cancel(self, db, job_id: str) -> bool:
+        job = await db.get(GenerationJob, job_id)
+        if job is None:
+            return False
+        if job.status == "running":
+            job.status, job.finished_at = "cancelled", _utcnow()
+            await db.execute(update(JobChapter).where(JobChapter.job_id == job_id, JobChapter.status == "queued")
+                             .values(status="cancelled"))
+            await db.commit()
+            for chapter_id in await db.scalars(select(JobChapter.id).where(JobChapter.job_id == job_id,
+                                                                            JobChapter.status == "running")):
+                task = self._running.get(chapter_id)
+                if task is not None:
+                    task.cancel()
+        return True
+
+    async def progress(self, db, job_id: str):
+        job = await db.get(GenerationJob, job_id)
+        if job is None:
+            return None
+        rows = await db.execute(select(JobChapter.status, func.count(), func.sum(JobChapter.tokens_estimated))
+                                .where(JobChapter.job_id == job_id).group_by(JobChapter.status))
+        counts, tokens = {}, 0
+        for status, count, status_tokens in rows:
+            counts[status] = count
+            tokens += status_tokens or 0
+        return {
+            "job_id": job.id, "status": job.status, "llm_provider": job.llm_provider,
+            "generation_mode": job.generation_mode, "chapters": sum(counts.values()), "counts": counts,
+            "tokens_estimated": tokens, "created_at": job.created_at, "finished_at": job.finished_at,
+        }
+
+    # --- Feeder ---
+    async def _feed(self):
+        if self.db_ready is not None:
+            await self.db_ready()
+        while True:
+            self._wakeup.clear()
+            idle = JOB_STALE_SECONDS / 2
+            try:
+                async with AsyncSessionLocal() as db:
+                    await self._requeue_stale(db)
+                    now = _utcnow()
+                    queued = (JobChapter.status == "queued", JobChapter.id.notin_(self._dispatched))
+                    chapter_ids = list(await db.scalars(
+                        select(JobChapter.id).where(*queued, or_(JobChapter.retry_at.is_(None), JobChapter.retry_at <= now))
+                        .order_by(JobChapter.id).limit(self._queue.maxsize)
+                    ))
+                    next_retry = await db.scalar(select(func.min(JobChapter.retry_at)).where(*queued, JobChapter.retry_at > now))
+                    if next_retry is not None:
+                        if next_retry.tzinfo is None:  # SQLite returns naive datetimes
+                            next_retry = next_retry.replace(tzinfo=timezone.utc)
+                        idle = min(idle, max(0.0, (next_retry - now).total_seconds()))
+            except Exception as e:
+                logger.error("Job feeder error: %s", e)
+                chapter_ids = []
+            for chapter_id in chapter_ids:
+                self._dispatched.add(chapter_id)
+                await self._queue.put(chapter_id)  # Blocks while the workers are saturated
+            if not chapter_ids:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), idle)
+                except asyncio.TimeoutError:
+                    pass
+
+    @staticmethod
+    async def _requeue_stale(db):
+        cutoff = _utcnow() - timedelta(seconds=JOB_STALE_SECONDS)
+        last_seen = func.coalesce(JobChapter.heartbeat_at, JobChapter.started_at)  # Rows claimed before heartbeats
+        result = await db.execute(update(JobChapter).where(JobChapter.status == "running", last_seen < cutoff)
+                                  .values(status="queued"))
+        if result.rowcount:
+            logger.warning("Requeued %d stale job chapters.", result.rowcount)
+        await db.commit()
+
+    # --- Workers ---
+    async def _work(self):
+        while True:
+            chapter_id = await self._queue.get()
+            task = asyncio.create_task(self._run_chapter(chapter_id))
+            self._running[chapter_id] = task
+            try:
+                await task
+            except asyncio.CancelledError:
+                if not task.cancelled():  # This worker itself is being stopped
+                    task.cancel()
+                    raise
+            except Exception as e:
+                logger.exception("Job chapter %s crashed: %s", chapter_id, e)
+            finally:
+                self._running.pop(chapter_id, None)
+                self._dispatched.discard(chapter_id)
+                if self._queue.empty():
+                    self.wake()
+
+    async def _claim(self, chapter_id: int):
+        """Marks a queued chapter as running; returns (chapter, job, text) or None if someone else has it."""
+        async with AsyncSessionLocal() as db:
+            claimed = await db.execute(
+                update(JobChapter).where(JobChapter.id == chapter_id, JobChapter.status == "queued")
+                .values(status="running", attempts=JobChapter.attempts + 1, started_at=None, heartbeat_at=_utcnow())
+            )
+            await db.commit()
+            if claimed.rowcount != 1:
+                return None
+            row = (await db.execute(
+                select(JobChapter, GenerationJob, ScrapedContent.raw_text)
+                .join(GenerationJob, GenerationJob.id == JobChapter.job_id)
+                .join(ScrapedContent, ScrapedContent.id == JobChapter.content_id)
+                .where(JobChapter.id == chapter_id)
+            )).first()
+            return row
+
+    async def _run_chapter(self, chapter_id: int):
+        claimed = await self._claim(chapter_id)
+        if claimed is None:
+            return
+        job_id, attempts, provider, tokens = None, None, None, None
+        heartbeat = asyncio.create_task(self._heartbeat(chapter_id))
+        try:
+            chapter, job, text = claimed
+            job_id, attempts = job.id, chapter.attempts
+            provider = self._provider_for(job.llm_provider)
+            from ai_services.token_budget import estimate_round_tokens  # Pulls in the LLM stack; loaded on first use
+            tokens = estimate_round_tokens(text, provider)
+            # One thread per attempt: the feedback reducer appends, so reusing a failed attempt's thread would repeat the note.
+            thread_id = f"job-{job.id}-{chapter.content_id}-{attempts}"
+            async with self.limits.semaphore(provider):
+                await self.limits.bucket(provider).acquire(tokens)
+                await self._mark_started(chapter_id)
+                graph_workflow = await self.graph_loader()
+                await graph_workflow.start_thread(thread_id, text)
+                state = await graph_workflow.app.ainvoke(
+                    {"feedback": [job.feedback], "llm_provider": provider, "generation_mode": job.generation_mode},
+                    config={"configurable": {"thread_id": thread_id}},
+                )
+            await self._finish(chapter_id, job_id, status="done", result_text=state.get("generated_text", ""),
+                               thread_id=thread_id, tokens_estimated=tokens)
+        except asyncio.CancelledError:
+            # Cancelled job → chapter cancelled; shutdown → back to the queue for the next run.
+            cancelled = job_id is not None and await asyncio.shield(self._job_status(job_id)) == "cancelled"
+            await asyncio.shield(self._finish(chapter_id, job_id, status="cancelled" if cancelled else "queued"))
+            raise
+        except Exception as e:
+            from ai_services.llm_router import is_retryable
+            if provider is not None and is_retryable(e) and attempts < JOB_MAX_ATTEMPTS:
+                self.limits.bucket(provider).drain()
+                delay = JOB_RETRY_BACKOFF * 2 ** (attempts - 1)
+                logger.warning("Job chapter %s failed (%s); retrying in %.0fs.", chapter_id, e, delay)
+                # Back in the queue now; the feeder skips it until retry_at, so the worker is free meanwhile.
+                await self._finish(chapter_id, job_id, status="queued", error=str(e),
+                                   retry_at=_utcnow() + timedelta(seconds=delay))
+            else:
+                logger.error("Job chapter %s failed: %s", chapter_id, e)
+                await self._finish(chapter_id, job_id, status="failed", error=str(e), tokens_estimated=tokens)
+        finally:
+            heartbeat.cancel()
+
+    def _provider_for(self, llm_provider: str) -> str:
+        """
+        The provider whose limits a chapter is charged to. "auto" chapters are
+        pinned to the router's best-ranked provider with a free slot, so they
+        share that provider's concurrency and token budget with its own jobs
+        (a failed attempt may land on another provider when retried).
+        """
+        if llm_provider != "auto":
+            return llm_provider
+        from ai_services.llm_agents import get_llm_chain
+        return self.limits.least_busy(get_llm_chain("auto").ranked_providers())
+
+    async def _heartbeat(self, chapter_id: int):
+        """Keeps a claimed chapter from looking stale, including while it waits for its provider's limits."""
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(update(JobChapter).where(JobChapter.id == chapter_id, JobChapter.status == "running")
+                                     .values(heartbeat_at=_utcnow()))
+                    await db.commit()
+            except Exception as e:
+                logger.warning("Heartbeat for job chapter %s failed: %s", chapter_id, e)
+
+    async def _mark_started(self, chapter_id: int):
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(JobChapter).where(JobChapter.id == chapter_id).values(started_at=_utcnow()))
+            await db.commit()
+
+    async def _job_status(self, job_id: str) -> str:
+        async with AsyncSessionLocal() as db:
+            return await db.scalar(select(GenerationJob.status).where(GenerationJob.id == job_id))
+
+    async def _finish(self, chapter_id: int, job_id: str, status: str, **fields):
+        async with AsyncSessionLocal() as db:
+            if job_id is None:  # Failed before the claimed row was unpacked
+                job_id = await db.scalar(select(JobChapter.job_id).where(JobChapter.id == chapter_id))
+            finished_at = _utcnow() if status in ("done", "failed", "cancelled") else None
+            await db.execute(update(JobChapter).where(JobChapter.id == chapter_id)
+                             .values(status=status, finished_at=finished_at, **fields))
+            remaining = await db.scalar(select(func.count()).where(
+                JobChapter.job_id == job_id, JobChapter.status.in_(("queued", "running"))))
+            if remaining == 0:
+                done = await db.scalar(select(func.count()).where(JobChapter.job_id == job_id, JobChapter.status == "done"))
+                await db.execute(update(GenerationJob).where(GenerationJob.id == job_id, GenerationJob.status == "running")
+                                 .values(status="done" if done else "failed", finished_at=_utcnow()))
+            await db.commit()
+        if status == "queued":
+            self.wake()
@@ -0,0 +1,120 @@
+import json
+import logging
+import os
+import time
+from contextlib import contextmanager, nullcontext
+
+from config import LOG_LEVEL, LOG_FORMAT, TRACING_ENABLED
+
+try:  # Optional: without it /metrics reports that metrics are unavailable
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+# --- Logging ---
+_RECORD_FIELDS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record; fields passed through `extra=` become keys."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+def configure_logging(level: str = LOG_LEVEL, format: str = LOG_FORMAT):
+    """Sets up the root logger once per process (call from the entry point)."""
+    handler = logging.StreamHandler()
+    if format == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    logging.basicConfig(level=level, handlers=[handler])
+
+# --- Metrics ---
+class _NoopMetric:
+    def labels(self, *args, **kwargs):
+        return self
+
+    def observe(self, amount: float):
+        pass
+
+    def inc(self, amount: float = 1):
+        pass
+
+def _metric(kind: str, name: str, documentation: str, labelnames=(), **kwargs):
+    if prometheus_client is None:
+        return _NoopMetric()
+    return getattr(prometheus_client, kind)(name, documentation, labelnames, **kwargs)
+
+_LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+SCRAPE_SECONDS = _metric("Histogram", "scrape_duration_seconds", "Browser page load and text extraction time.",
+                         ["outcome"], buckets=(0.5, 1, 2, 3, 5, 8, 13, 21, 34, 60))
+SCRAPE_LOOKUPS = _metric("Counter", "scrape_cache_lookups", "ScrapedContent lookups by result "
+                         "(fresh = cache hit; revalidated, unchanged, rescraped, scraped, failed).", ["status", "coalesced"])
+LLM_FIRST_TOKEN_SECONDS = _metric("Histogram", "llm_time_to_first_token_seconds", "Time from request to first streamed token.",
+                                  ["provider"], buckets=(0.1, 0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30))
+LLM_TOKENS_PER_SECOND = _metric("Histogram", "llm_tokens_per_second", "Completion tokens per second after the first token.",
+                                ["provider"], buckets=(5, 10, 25, 50, 100, 200, 400, 800, 1600, 3200))
+LLM_COMPLETION_TOKENS = _metric("Counter", "llm_completion_tokens", "Completion tokens generated.", ["provider"])
+LLM_COST = _metric("Counter", "llm_estimated_cost_usd", "Estimated provider spend in USD.", ["provider"])
+CHROMA_SECONDS = _metric("Histogram", "chroma_operation_seconds", "Chroma query and add latency (cache misses only).",
+                         ["operation"], buckets=_LATENCY_BUCKETS)
+BANDIT_UPDATE_SECONDS = _metric("Histogram", "bandit_update_seconds", "Time to apply one rating to the bandit policy.",
+                                buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1))
+
+def render_metrics():
+    """Returns (body, content type) in the Prometheus text format, or None without prometheus_client."""
+    if prometheus_client is None:
+        return None
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
+
+# --- Tracing ---
+_tracer = None
+
+def configure_tracing():
+    """Exports OpenTelemetry spans over OTLP when TRACING_ENABLED and the SDK is installed."""
+    global _tracer
+    if not TRACING_ENABLED or _tracer is not None:
+        return
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    except ImportError as e:
+        logging.getLogger(__name__).warning("Tracing disabled, OpenTelemetry is not installed (%s).", e)
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": os.getenv("OTEL_SERVICE_NAME", "book-workflow")}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("book-workflow")
+
+def shutdown_tracing():
+    if _tracer is not None:
+        from opentelemetry import trace
+        trace.get_tracer_provider().shutdown()
+
+def span(name: str, **attributes):
+    """An OpenTelemetry span around a block, or a no-op when tracing is off."""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes={k: v for k, v in attributes.items() if v is not None})
+
+@contextmanager
+def timed(histogram, span_name: str, **labels):
+    """Records the block's duration in `histogram` (with `labels`) and traces it as `span_name`."""
+    started = time.perf_counter()
+    with span(span_name, **labels):
+        try:
+            yield
+        finally:
+            (histogram.labels(**labels) if labels else histogram).observe(time.perf_counter() - started)
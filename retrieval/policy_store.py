@@ -0,0 +1,243 @@
+import json
+import logging
+import os
+import threading
+import time
+
+try:  # POSIX advisory locks; without them a single worker is still safe.
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from config import BANDIT_RATINGS_LOG_PATH, BANDIT_SNAPSHOT_INTERVAL, BANDIT_SYNC_INTERVAL, BANDIT_LOG_COMPACT_BYTES
+from observability import BANDIT_UPDATE_SECONDS
+from .rl_agent import ContextualBanditAgent
+
+logger = logging.getLogger(__name__)
+
+
+class _FileLock:
+    """Exclusive flock on a file descriptor, usable across processes."""
+    def __init__(self, fd: int):
+        self.fd = fd
+
+    def __enter__(self):
+        if fcntl: fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if fcntl: fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+
+class PolicyStore:
+    """
+    Crash-safe, multi-worker persistence for a ContextualBanditAgent.
+
+    - Every rating is appended as one JSON line to a shared log (under an
+      exclusive lock), which is the durable record of the rating history.
+    - Each worker tails the log and applies all ratings in log order, its own
+      and other workers', so every process converges on the same policy and no
+      update is lost.
+    - A background thread writes a snapshot of the weights (without history)
+      at most every `snapshot_interval` seconds when something changed, via
+      atomic rename, recording the log offset it covers. Startup loads the
+      snapshot and replays only the log after that offset.
+    - Once a snapshot covers `compact_bytes` of the log, the log is rewritten
+      (again via rename) keeping only the last `history_limit` covered lines,
+      for the history, and whatever follows. Offsets stay logical: a compacted
+      log starts with a {"base": N} line giving the offset of its first rating.
+      Other workers reopen the new file; one that had not yet reached the
+      dropped part catches up from the snapshot.
+    """
+    def __init__(self, agent: ContextualBanditAgent, log_path: str = BANDIT_RATINGS_LOG_PATH,
+                 snapshot_interval: float = BANDIT_SNAPSHOT_INTERVAL, sync_interval: float = BANDIT_SYNC_INTERVAL,
+                 compact_bytes: int = BANDIT_LOG_COMPACT_BYTES):
+        self.agent = agent
+        self.log_path = log_path
+        self.snapshot_interval = snapshot_interval
+        self.sync_interval = sync_interval
+        self.compact_bytes = compact_bytes
+        self.offset = agent.log_offset
+        self._lock = threading.Lock()  # Guards agent updates, self.offset and the log descriptor within this process
+        self._dirty = False
+        self._stop = threading.Event()
+        self._thread = None
+        self._log_fd = None
+        self._open_log()
+        self._snapshot_lock_fd = os.open(f"{agent.policy_path}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        if self.offset < self._base:
+            logger.warning("Policy snapshot predates the compacted rating log; ratings before it are lost.")
+            self.offset = self._base
+        self._restore_history()
+        self.sync()
+
+    # --- Log file ---
+    @staticmethod
+    def _read_header(fd: int):
+        """(base, header length) of a log: (0, 0) unless it was compacted."""
+        first = os.pread(fd, 64, 0)
+        if first.startswith(b'{"base": ') and b"\n" in first:
+            line = first[:first.index(b"\n") + 1]
+            return json.loads(line)["base"], len(line)
+        return 0, 0
+
+    def _open_log(self):
+        if self._log_fd is not None:
+            os.close(self._log_fd)
+        self._log_fd = os.open(self.log_path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._log_inode = os.fstat(self._log_fd).st_ino
+        self._base, self._header = self._read_header(self._log_fd)
+
+    def _log_replaced(self) -> bool:
+        """Whether another worker compacted the log since we opened it."""
+        try:
+            return os.stat(self.log_path).st_ino != self._log_inode
+        except FileNotFoundError:
+            return True
+
+    def _position(self, offset: int) -> int:
+        """File position of a logical log offset."""
+        return self._header + offset - self._base
+
+    # --- Ratings ---
+    def record(self, query: str, action: str, reward: float):
+        """Durably appends a rating, then applies every pending rating (including this one)."""
+        if action not in self.agent.action_index:
+            raise ValueError(f"Unknown action: {action}")
+        line = json.dumps({"q": query, "a": action, "r": reward, "t": time.time()}) + "\n"
+        with self._lock:
+            while True:
+                with _FileLock(self._log_fd):
+                    if not self._log_replaced():
+                        os.write(self._log_fd, line.encode("utf-8"))
+                        break
+                self._open_log()  # Compacted while we waited for the lock; append to the new file
+        self.sync()
+
+    def sync(self) -> int:
+        """Applies ratings appended since the last sync; returns how many were applied."""
+        with self._lock:
+            if self._log_replaced():
+                self._open_log()
+            if self.offset < self._base:
+                self._reload_snapshot()
+            start = self._position(self.offset)
+            size = os.fstat(self._log_fd).st_size
+            if size <= start:
+                return 0
+            data = os.pread(self._log_fd, size - start, start)
+            complete = data[:data.rfind(b"\n") + 1]  # Ignore a line another worker is still writing
+            applied = 0
+            for raw in complete.splitlines():
+                try:
+                    entry = json.loads(raw)
+                    started = time.perf_counter()
+                    self.agent.update(entry["q"], entry["a"], entry["r"])
+                    BANDIT_UPDATE_SECONDS.observe(time.perf_counter() - started)
+                    applied += 1
+                except (ValueError, KeyError) as e:
+                    logger.warning("Skipping bad rating log line: %s", e)
+            self.offset += len(complete)
+            self._dirty = self._dirty or applied > 0
+            return applied
+
+    def _reload_snapshot(self):
+        """The log was compacted past ratings this worker had not applied; continue from the snapshot instead."""
+        logger.info("Rating log compacted past offset %d; reloading the policy snapshot.", self.offset)
+        self.agent.reload_policy()
+        self.offset = self.agent.log_offset
+        if self.offset < self._base:
+            logger.warning("Policy snapshot predates the compacted rating log; ratings before it are lost.")
+            self.offset = self._base
+        self._restore_history()
+        self._dirty = False
+
+    def _tail(self, end: int, chunk_size: int = 1 << 16):
+        """(position, lines) of the last `history_limit` complete log lines before file position `end`."""
+        limit = self.agent.history_limit
+        if limit <= 0:
+            return end, []
+        start, buffer = end, b""
+        while start > self._header and buffer.count(b"\n") <= limit:
+            previous = max(self._header, start - chunk_size)
+            buffer = os.pread(self._log_fd, start - previous, previous) + buffer
+            start = previous
+        if start > self._header:  # The buffer starts mid-line
+            cut = buffer.index(b"\n") + 1
+            start, buffer = start + cut, buffer[cut:]
+        lines = buffer.splitlines(keepends=True)
+        if len(lines) > limit:
+            start += sum(len(line) for line in lines[:-limit])
+            lines = lines[-limit:]
+        return start, lines
+
+    def _restore_history(self):
+        """Refills the agent's bounded history from the log lines just before the snapshot offset."""
+        for raw in self._tail(self._position(self.offset))[1]:
+            try:
+                entry = json.loads(raw)
+                self.agent.history.append((entry["q"], entry["a"], entry["r"]))
+            except (ValueError, KeyError):
+                continue
+
+    # --- Snapshots ---
+    def snapshot(self):
+        """Writes the weights outside the lock (the copy is taken under it), then compacts the log if due."""
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            offset = self.offset
+            policy_data = self.agent.policy_state(include_history=False, extra={"log_offset": offset})
+        with _FileLock(self._snapshot_lock_fd):
+            with open(self.log_path, "rb") as log:
+                if self._read_header(log.fileno())[0] > offset:
+                    return  # Another worker compacted past us; its snapshot is newer
+            self.agent.write_policy(policy_data)
+            self._compact(offset)
+
+    def _compact(self, offset: int):
+        """Rewrites the log without the ratings the snapshot at `offset` covers, except the history tail."""
+        with self._lock:
+            if self._log_replaced() or self._position(offset) - self._header < self.compact_bytes:
+                return
+            with _FileLock(self._log_fd):
+                keep_from = self._tail(self._position(offset))[0]
+                base = self._base + keep_from - self._header
+                tmp_path = f"{self.log_path}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(json.dumps({"base": base}).encode("utf-8") + b"\n")
+                    position, size = keep_from, os.fstat(self._log_fd).st_size
+                    while position < size:
+                        chunk = os.pread(self._log_fd, min(1 << 20, size - position), position)
+                        f.write(chunk)
+                        position += len(chunk)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.log_path)
+            self._open_log()
+        logger.info("Compacted the rating log to %d bytes (ratings before offset %d dropped).", size - keep_from, base)
+
+    def _run(self):
+        last_snapshot = time.monotonic()
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+                if time.monotonic() - last_snapshot >= self.snapshot_interval:
+                    self.snapshot()
+                    last_snapshot = time.monotonic()
+            except Exception as e:
+                logger.exception("Policy persistence error: %s", e)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="policy-store", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the background thread and writes a final snapshot."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        self.sync()
+        self.snapshot()
@@ -1,82 +1,186 @@
+import logging
 import numpy as np
 import os
 import random
+import tempfile
 import joblib
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import SGDRegressor
-from sklearn.exceptions import NotFittedError
+from collections import deque
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from config import BANDIT_N_FEATURES, BANDIT_HISTORY_LIMIT, BANDIT_POLICY_PATH
+
+logger = logging.getLogger(__name__)
+
+LEGACY_POLICY_PATH = 'retrieval/tfidf_bandit_policy.joblib'
+POLICY_FORMAT = 2  # Packed weight matrix; files in any other format are rebuilt from the legacy ratings
 
 class ContextualBanditAgent:
-    def __init__(self, actions: list, learning_rate=0.01, epsilon=0.1):
+    """
+    Epsilon-greedy contextual bandit over query keywords.
+
+    Queries are featurized with feature hashing, so the feature space is fixed.
+    The per-action linear models are packed into one (n_features x n_actions)
+    weight matrix: scoring any number of queries against every action is a
+    single sparse-matrix product, and a rating is an SGD step that only touches
+    the query's non-zero features. Only the most recent `history_limit` ratings
+    are retained (for inspection and migration).
+    """
+    def __init__(self, actions: list, learning_rate=0.01, epsilon=0.1, alpha=0.0001,
+                 n_features: int = BANDIT_N_FEATURES, history_limit: int = BANDIT_HISTORY_LIMIT,
+                 policy_path: str = BANDIT_POLICY_PATH):
         self.actions = actions
+        self.action_index = {action: i for i, action in enumerate(actions)}
+        self.learning_rate = learning_rate
         self.epsilon = epsilon
-        self.policy_path = 'retrieval/tfidf_bandit_policy.joblib'
+        self.alpha = alpha  # L2 penalty, as in SGDRegressor
+        self.history_limit = history_limit
+        self.policy_path = policy_path
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm='l2')
         self._load_policy()
 
     def _initialize_models(self):
-        """Initializes fresh models and fits the vectorizer."""
-        print("Initializing new models and vectorizer.")
-        self.models = {action: SGDRegressor(learning_rate='constant', eta0=0.01) for action in self.actions}
-        self.vectorizer = TfidfVectorizer()
-        # Initial vocabulary is just the actions themselves
-        self.vectorizer.fit(self.actions + [q for q, a, r in self.history])
+        """Initializes a zero weight matrix for all actions."""
+        n_features = self.vectorizer.n_features
+        # Effective weights are weights[:, a] * scales[a]; the scale absorbs L2 decay
+        # so a step never has to touch every feature.
+        self.weights = np.zeros((n_features, len(self.actions)))
+        self.scales = np.ones(len(self.actions))
+        self.intercepts = np.zeros(len(self.actions))
 
     def _get_state_vector(self, query: str):
         return self.vectorizer.transform([query])
 
+    def score(self, queries: list) -> np.ndarray:
+        """Q-values of every action for every query, shape (len(queries), n_actions)."""
+        state_matrix = self.vectorizer.transform(queries)
+        return np.asarray(state_matrix @ self.weights) * self.scales + self.intercepts
+
+    def choose_actions(self, queries: list) -> list:
+        """Batched choose_action: one vectorizer pass and one matrix product for all queries."""
+        if self.ratings_seen == 0 or not queries:
+            return [random.choice(self.actions) for _ in queries]
+        best = self.score(queries).argmax(axis=1)
+        return [
+            random.choice(self.actions) if not query or random.random() < self.epsilon else self.actions[i]
+            for query, i in zip(queries, best)
+        ]
+
     def choose_action(self, query: str) -> str:
-        if not query or random.random() < self.epsilon:
-            return random.choice(self.actions)
-        
-        try:
-            state_vector = self._get_state_vector(query)
-            q_values = {action: model.predict(state_vector)[0] for action, model in self.models.items()}
-            return max(q_values, key=q_values.get)
-        except (NotFittedError, ValueError):
-            # If models aren't trained or there's a feature mismatch, act randomly.
-            return random.choice(self.actions)
+        return self.choose_actions([query])[0]
 
     def update(self, query: str, action: str, reward: float):
         self.history.append((query, action, reward))
-        
-        # Check if the query adds new vocabulary
-        current_vocab = self.vectorizer.vocabulary_
-        new_words = any(word not in current_vocab for word in self.vectorizer.build_tokenizer()(query.lower()))
-
-        if new_words:
-            print("New vocabulary detected. Re-training all models from history...")
-            self._initialize_models() # Re-fits vectorizer on new total vocab
-            # Retrain on the entire history
-            for q_hist, a_hist, r_hist in self.history:
-                state_vector = self._get_state_vector(q_hist)
-                self.models[a_hist].partial_fit(state_vector, [r_hist])
-        else:
-            # No new words, just do a normal update
-            state_vector = self._get_state_vector(query)
-            self.models[action].partial_fit(state_vector, [reward])
-            print(f"Updated TF-IDF model for action '{action}' with reward {reward}.")
-
-    def save_policy(self):
-        policy_data = {
-            'models': self.models,
-            'vectorizer': self.vectorizer,
-            'history': self.history
+        self.ratings_seen += 1
+        a = self.action_index[action]
+        state_vector = self._get_state_vector(query)
+        idx, values = state_vector.indices, state_vector.data
+
+        prediction = self.scales[a] * self.weights[idx, a].dot(values) + self.intercepts[a]
+        gradient = prediction - reward
+        self.scales[a] *= 1.0 - self.learning_rate * self.alpha
+        if self.scales[a] < 1e-9:
+            # Fold the scale back in before it underflows (rare, O(n_features)).
+            self.weights[:, a] *= self.scales[a]
+            self.scales[a] = 1.0
+        self.weights[idx, a] -= self.learning_rate * gradient * values / self.scales[a]
+        self.intercepts[a] -= self.learning_rate * gradient
+
+    def describe_policy(self, min_weight: float = 0.01) -> dict:
+        """
+        Human-readable weights per action. Hashed features have no names, so
+        words are recovered from the retained history and mapped to their buckets.
+        """
+        tokenize = self.vectorizer.build_analyzer()
+        words = sorted({word for query, _, _ in self.history for word in tokenize(query)})
+        buckets = {word: self.vectorizer.transform([word]).indices[0] for word in words}
+        policy = {}
+        for action, a in self.action_index.items():
+            weights = sorted(((self.weights[bucket, a] * self.scales[a], word) for word, bucket in buckets.items()), reverse=True)
+            policy[action] = {word: round(float(coef), 4) for coef, word in weights if abs(coef) > min_weight}
+        return policy
+
+    def save_policy(self, include_history: bool = True, extra: dict = None):
+        """
+        Writes the policy atomically (temp file + rename), so a crash mid-write
+        never leaves a truncated policy behind. `extra` is stored alongside.
+        """
+        self.write_policy(self.policy_state(include_history, extra))
+
+    def policy_state(self, include_history: bool = True, extra: dict = None) -> dict:
+        """A copy of the policy, detached from later updates (so it can be written without holding a lock)."""
+        return {
+            'format': POLICY_FORMAT,
+            'actions': list(self.actions),
+            'weights': self.weights * self.scales,
+            'intercepts': self.intercepts.copy(),
+            'n_features': self.vectorizer.n_features,
+            'history': list(self.history) if include_history else [],
+            'ratings_seen': self.ratings_seen,
+            **(extra or {}),
         }
-        joblib.dump(policy_data, self.policy_path)
-        print("TF-IDF Bandit policy saved.")
+
+    def write_policy(self, policy_data: dict):
+        directory = os.path.dirname(os.path.abspath(self.policy_path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                joblib.dump(policy_data, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.policy_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        logger.debug("Hashed bandit policy saved.")
+
+    def reload_policy(self):
+        """Replaces the in-memory policy with the saved one."""
+        self._load_policy()
 
     def _load_policy(self):
+        self.history = deque(maxlen=self.history_limit)
+        self.ratings_seen = 0
+        self.log_offset = 0  # Bytes of the rating log already reflected in the loaded weights
+        self._initialize_models()
         if os.path.exists(self.policy_path):
             try:
                 policy_data = joblib.load(self.policy_path)
-                self.models = policy_data['models']
-                self.vectorizer = policy_data['vectorizer']
-                self.history = policy_data['history']
-                print(f"Loaded saved policy with {len(self.history)} history records.")
+                if policy_data.get('format') != POLICY_FORMAT:
+                    raise ValueError(f"unsupported format {policy_data.get('format', 1)}")
+                if policy_data.get('n_features') != self.vectorizer.n_features:
+                    raise ValueError("feature dimension changed")
+                self._load_weights(policy_data)
+                self.history.extend(policy_data.get('history', []))
+                self.ratings_seen = policy_data.get('ratings_seen', len(self.history))
+                self.log_offset = policy_data.get('log_offset', 0)
+                logger.info("Loaded saved policy trained on %d ratings.", self.ratings_seen)
                 return
             except Exception as e:
-                print(f"Policy file corrupted or invalid: {e}. Initializing new policy.")
-        
-        # If loading fails or file doesn't exist
-        self.history = []
-        self._initialize_models()
\ No newline at end of file
+                logger.warning("Policy file corrupted or invalid: %s. Initializing new policy.", e)
+                self._initialize_models()
+
+        logger.info("Initializing new models.")
+        self._migrate_legacy_policy()
+
+    def _load_weights(self, policy_data: dict):
+        """Copies saved per-action weights into the matrix, matching actions by name."""
+        saved = {action: (policy_data['weights'][:, i], policy_data['intercepts'][i])
+                 for i, action in enumerate(policy_data['actions'])}
+        for action, (coef, intercept) in saved.items():
+            if action in self.action_index:
+                self.weights[:, self.action_index[action]] = coef
+                self.intercepts[self.action_index[action]] = intercept
+
+    def _migrate_legacy_policy(self):
+        """One-time replay of the ratings stored by the old TF-IDF policy file."""
+        if self.policy_path == LEGACY_POLICY_PATH or not os.path.exists(LEGACY_POLICY_PATH):
+            return
+        try:
+            legacy_history = joblib.load(LEGACY_POLICY_PATH)['history']
+        except Exception as e:
+            logger.warning("Could not read legacy policy: %s", e)
+            return
+        for query, action, reward in legacy_history:
+            if action in self.action_index:
+                self.update(query, action, reward)
+        logger.info("Migrated %d ratings from the legacy TF-IDF policy.", len(legacy_history))
@@ -1,14 +1,17 @@
-from storage.chromadb_manager import client
+import logging
+from storage.chromadb_manager import get_client
 from .rl_agent import RLSearchAgent
 
+logger = logging.getLogger(__name__)
+
 # Agent actions are keywords to enhance the query
 agent = RLSearchAgent(actions=["summary", "characters", "style", "setting"])
 
 def retrieve_version(collection_name: str, query: str):
     action_keyword = agent.choose_action()
     enhanced_query = f"{query} {action_keyword}".strip()
-    print(f"RL Agent Used: '{action_keyword}' -> Query: '{enhanced_query}'")
+    logger.info("RL Agent Used: '%s' -> Query: '%s'", action_keyword, enhanced_query)
     
-    collection = client.get_or_create_collection(name=collection_name)
+    collection = get_client().get_or_create_collection(name=collection_name)
     result = collection.query(query_texts=[enhanced_query], n_results=1)
     return result, action_keyword # Return action for learning
\ No newline at end of file
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+
+from playwright.async_api import async_playwright, Error
+
+from config import SCRAPER_POOL_SIZE, SCRAPER_PAGES_PER_BROWSER, SCRAPER_LAUNCH_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+
+class _BrowserSlot:
+    """One warm browser with a reusable context and page."""
+    def __init__(self, index: int):
+        self.index = index
+        self.browser = None
+        self.context = None
+        self.page = None
+        self.pages_served = 0
+        self.broken = False
+
+    def needs_recycle(self, max_pages: int) -> bool:
+        if self.broken or self.browser is None:
+            return True
+        if not self.browser.is_connected() or self.page is None or self.page.is_closed():
+            return True
+        return self.pages_served >= max_pages
+
+    async def launch(self, playwright):
+        await self.close()
+        self.browser = await playwright.chromium.launch(timeout=SCRAPER_LAUNCH_TIMEOUT)
+        self.context = await self.browser.new_context()
+        self.page = await self.context.new_page()
+        self.pages_served = 0
+        self.broken = False
+        logger.info("Browser slot %d launched.", self.index)
+
+    async def close(self):
+        if self.browser is not None:
+            try:
+                await self.browser.close()
+            except Error:
+                pass  # Browser already crashed or disconnected
+        self.browser = self.context = self.page = None
+
+
+class BrowserPool:
+    """
+    Keeps a fixed number of warm Chromium instances and hands their pages out
+    to concurrent scrapes. The pool size is the maximum scrape concurrency;
+    a browser is relaunched after `pages_per_browser` pages or after it fails.
+    """
+    def __init__(self, size: int = SCRAPER_POOL_SIZE, pages_per_browser: int = SCRAPER_PAGES_PER_BROWSER):
+        self.size = max(1, size)
+        self.pages_per_browser = max(1, pages_per_browser)
+        self._playwright = None
+        self._slots: asyncio.Queue = None
+        self._all_slots = []
+        self._start_lock = asyncio.Lock()
+
+    @property
+    def started(self) -> bool:
+        return self._playwright is not None
+
+    async def start(self):
+        async with self._start_lock:
+            if self.started:
+                return
+            self._playwright = await async_playwright().start()
+            self._slots = asyncio.Queue()
+            self._all_slots = [_BrowserSlot(i) for i in range(self.size)]
+            for slot in self._all_slots:
+                # Browsers are launched lazily when a slot is first handed out.
+                self._slots.put_nowait(slot)
+            logger.info("Browser pool started (size=%d, pages_per_browser=%d).", self.size, self.pages_per_browser)
+
+    async def close(self):
+        async with self._start_lock:
+            if not self.started:
+                return
+            await asyncio.gather(*(slot.close() for slot in self._all_slots))
+            await self._playwright.stop()
+            self._playwright = None
+            self._slots = None
+            self._all_slots = []
+            logger.info("Browser pool closed.")
+
+    @asynccontextmanager
+    async def page(self):
+        """Yields a warm page; waits if all browsers are busy."""
+        if not self.started:
+            await self.start()
+        slot = await self._slots.get()
+        try:
+            if slot.needs_recycle(self.pages_per_browser):
+                await slot.launch(self._playwright)
+            slot.pages_served += 1
+            yield slot.page
+        except Error:
+            # Any Playwright failure may leave the page in a bad state; relaunch next time.
+            slot.broken = True
+            raise
+        finally:
+            self._slots.put_nowait(slot)
+
+
+browser_pool = BrowserPool()
@@ -1,23 +1,74 @@
+import hashlib
+import logging
+import time
+
 from playwright.sync_api import sync_playwright, Error
 
+from observability import SCRAPE_SECONDS, span
+from .browser_pool import browser_pool
+
+logger = logging.getLogger(__name__)
+
+CONTENT_SELECTOR = ".mw-parser-output"
+
+def _record_scrape(url: str, started: float, outcome: str):
+    seconds = time.perf_counter() - started
+    SCRAPE_SECONDS.labels(outcome=outcome).observe(seconds)
+    logger.info("Scraped %s in %.2fs (%s).", url, seconds, outcome, extra={"url": url, "seconds": seconds, "outcome": outcome})
+
 def fetch_content_and_screenshot(url: str):
-    print(f"--- Starting new scrape for: {url} ---")
+    started = time.perf_counter()
     with sync_playwright() as p:
         browser = p.chromium.launch()
         try:
             page = browser.new_page()
             page.goto(url, wait_until="domcontentloaded", timeout=60000)
-            
+
             # Get screenshot as bytes
             screenshot_bytes = page.screenshot()
-            
+
             # Get content text
-            content_element = page.locator(".mw-parser-output")
+            content_element = page.locator(CONTENT_SELECTOR)
             content_text = content_element.inner_text()
-            
+
+            _record_scrape(url, started, "ok")
             return {"text": content_text, "screenshot_bytes": screenshot_bytes}
         except Error as e:
-            print(f"❌ Scraping Error: {e}")
+            logger.error("Scraping error for %s: %s", url, e)
+            _record_scrape(url, started, "error")
             return None
         finally:
-            browser.close()
\ No newline at end of file
+            browser.close()
+
+def compute_content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+async def fetch_content_and_screenshot_async(url: str, known_hash: str = None):
+    """
+    Same as fetch_content_and_screenshot, but uses a warm page from the shared browser pool.
+    If the extracted text hashes to `known_hash`, the screenshot is skipped and
+    `unchanged` is set in the result.
+    """
+    started = time.perf_counter()
+    try:
+        with span("scrape", url=url):
+            async with browser_pool.page() as page:
+                response = await page.goto(url, wait_until="domcontentloaded", timeout=60000)
+                content_text = await page.locator(CONTENT_SELECTOR).inner_text()
+                content_hash = compute_content_hash(content_text)
+                unchanged = known_hash is not None and content_hash == known_hash
+                screenshot_bytes = None if unchanged else await page.screenshot()
+                headers = response.headers if response else {}
+    except Error as e:
+        logger.error("Scraping error for %s: %s", url, e)
+        _record_scrape(url, started, "error")
+        return None
+    _record_scrape(url, started, "unchanged" if unchanged else "ok")
+    return {
+        "text": content_text,
+        "screenshot_bytes": screenshot_bytes,
+        "content_hash": content_hash,
+        "unchanged": unchanged,
+        "etag": headers.get("etag"),
+        "last_modified": headers.get("last-modified"),
+    }
@@ -0,0 +1,169 @@
+"""
+Bulk ingestion of whole books into the `scraped_content` table.
+
+Usage:
+    python -m scraper.crawler --toc https://en.wikisource.org/wiki/Some_Book
+    python -m scraper.crawler --urls URL1 URL2 ...
+"""
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlparse, urldefrag
+
+from playwright.async_api import Error
+
+from config import SCRAPER_HOST_MIN_INTERVAL, INGEST_CHUNK_SIZE
+from storage.blob_store import screenshot_store
+from .browser_pool import browser_pool
+from .content_fetcher import CONTENT_SELECTOR, fetch_content_and_screenshot_async
+
+logger = logging.getLogger(__name__)
+
+
+class HostRateLimiter:
+    """Spaces out request starts to the same host by at least `min_interval` seconds."""
+    def __init__(self, min_interval: float = SCRAPER_HOST_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._locks = {}
+        self._next_slot = {}
+
+    async def wait(self, url: str):
+        host = urlparse(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            delay = self._next_slot.get(host, 0.0) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next_slot[host] = time.monotonic() + self.min_interval
+
+
+async def discover_chapter_urls(toc_url: str, path_prefix: str = None) -> list:
+    """
+    Collects chapter links from a table-of-contents page. By default only links
+    below the TOC page's own path are kept (e.g. /wiki/Book/Chapter_1).
+    """
+    if path_prefix is None:
+        path_prefix = urlparse(toc_url).path.rstrip("/") + "/"
+    toc_host = urlparse(toc_url).netloc
+
+    async with browser_pool.page() as page:
+        await page.goto(toc_url, wait_until="domcontentloaded", timeout=60000)
+        hrefs = await page.eval_on_selector_all(f"{CONTENT_SELECTOR} a[href]", "els => els.map(e => e.href)")
+
+    urls = []
+    for href in hrefs:
+        href = urldefrag(href).url
+        parsed = urlparse(href)
+        if parsed.netloc == toc_host and parsed.path.startswith(path_prefix) and href not in urls:
+            urls.append(href)
+    logger.info("Discovered %d chapter URLs on %s.", len(urls), toc_url)
+    return urls
+
+
+async def crawl_book(urls: list, session_factory, chunk_size: int = INGEST_CHUNK_SIZE,
+                     rate_limiter: HostRateLimiter = None, progress: dict = None) -> dict:
+    """
+    Scrapes `urls` concurrently (bounded by the browser pool size) and writes them
+    to `scraped_content` in chunked bulk inserts. URLs that already have a row are
+    skipped, so re-running after a crash resumes where the last chunk ended.
+    """
+    from storage.database import get_existing_urls, bulk_insert_scraped_content
+
+    rate_limiter = rate_limiter or HostRateLimiter()
+    progress = progress if progress is not None else {}
+    urls = list(dict.fromkeys(urls))
+
+    def _existing():
+        with session_factory() as db:
+            return get_existing_urls(db, urls)
+
+    def _flush(rows):
+        with session_factory() as db:
+            return bulk_insert_scraped_content(db, rows)
+
+    existing = await asyncio.to_thread(_existing)
+    pending = [url for url in urls if url not in existing]
+    progress.update({"total": len(urls), "skipped": len(existing), "inserted": 0, "failed": []})
+    logger.info("Crawl: %d to fetch, %d already stored.", len(pending), len(existing))
+
+    buffer = []
+    flush_lock = asyncio.Lock()
+
+    async def flush():
+        async with flush_lock:
+            if not buffer:
+                return
+            rows = buffer[:]
+            buffer.clear()
+            try:
+                progress["inserted"] += await asyncio.to_thread(_flush, rows)
+            except Exception as e:
+                logger.error("Crawl: could not store %d chapters: %s", len(rows), e)
+                progress["failed"] += [row["url"] for row in rows]
+
+    async def fetch_one(url):
+        # One bad chapter is recorded as failed; it must not abort the rest of the crawl.
+        try:
+            await rate_limiter.wait(url)
+            data = await fetch_content_and_screenshot_async(url)
+            if not data:
+                progress["failed"].append(url)
+                return
+            screenshot_key = await asyncio.to_thread(screenshot_store.put, data["screenshot_bytes"])
+        except Exception as e:
+            logger.warning("Crawl: failed to fetch %s: %s", url, e)
+            progress["failed"].append(url)
+            return
+        buffer.append({
+            "url": url, "raw_text": data["text"], "screenshot_key": screenshot_key,
+            "content_hash": data["content_hash"], "etag": data["etag"],
+            "last_modified": data["last_modified"], "checked_at": datetime.now(timezone.utc),
+        })
+        if len(buffer) >= chunk_size:
+            await flush()
+
+    # The browser pool bounds how many of these actually scrape at once.
+    await asyncio.gather(*(fetch_one(url) for url in pending))
+    await flush()
+    logger.info("Crawl finished: %d inserted, %d failed.", progress['inserted'], len(progress['failed']))
+    return progress
+
+
+async def ingest_book(toc_url: str = None, urls: list = None, session_factory=None, progress: dict = None) -> dict:
+    """Resolves the chapter list (from a TOC page and/or explicit URLs) and crawls it."""
+    if session_factory is None:
+        from storage.database import get_session
+        session_factory = get_session
+    chapter_urls = list(urls or [])
+    if toc_url:
+        try:
+            chapter_urls = await discover_chapter_urls(toc_url) + chapter_urls
+        except Error as e:
+            raise RuntimeError(f"Could not read table of contents at {toc_url}: {e}") from e
+    return await crawl_book(chapter_urls, session_factory, progress=progress)
+
+
+def main():
+    from observability import configure_logging
+    configure_logging()
+    parser = argparse.ArgumentParser(description="Ingest a whole book into the scrape cache.")
+    parser.add_argument("--toc", help="Table-of-contents URL to discover chapter links from.")
+    parser.add_argument("--urls", nargs="*", default=[], help="Explicit chapter URLs.")
+    args = parser.parse_args()
+    if not args.toc and not args.urls:
+        parser.error("Provide --toc and/or --urls.")
+
+    async def run():
+        try:
+            return await ingest_book(toc_url=args.toc, urls=args.urls)
+        finally:
+            await browser_pool.close()
+
+    result = asyncio.run(run())
+    print(result)
+
+
+if __name__ == "__main__":
+    main()
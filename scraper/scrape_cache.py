@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+
+import httpx
+from sqlalchemy.exc import IntegrityError
+
+from config import SCRAPE_CACHE_TTL, SCRAPE_REVALIDATE_TIMEOUT
+from observability import SCRAPE_LOOKUPS
+from storage.database import ScrapedContent, AsyncSessionLocal, get_async_engine, get_scraped_content_by_url
+from storage.blob_store import screenshot_store
+from .content_fetcher import fetch_content_and_screenshot_async
+
+logger = logging.getLogger(__name__)
+
+_http_client = None
+_inflight = {}  # url -> asyncio.Future of the refresh currently running for it
+scrape_stats = {"flights": 0, "coalesced": 0}
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(timeout=SCRAPE_REVALIDATE_TIMEOUT, follow_redirects=True)
+    return _http_client
+
+async def close_http_client():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+def is_fresh(row: ScrapedContent, ttl: int = SCRAPE_CACHE_TTL) -> bool:
+    checked = row.checked_at or row.created_at
+    if checked is None:
+        return False
+    if checked.tzinfo is None:  # SQLite hands back naive datetimes
+        checked = checked.replace(tzinfo=timezone.utc)
+    return _utcnow() - checked < timedelta(seconds=ttl)
+
+async def is_not_modified(url: str, etag: str = None, last_modified: str = None) -> bool:
+    """
+    Asks the origin whether the page changed since it was cached, using a HEAD
+    (falling back to GET) with If-None-Match / If-Modified-Since. Any error is
+    treated as "modified" so the caller falls through to a real scrape.
+    """
+    if not etag and not last_modified:
+        return False
+    headers = {}
+    if etag: headers["If-None-Match"] = etag
+    if last_modified: headers["If-Modified-Since"] = last_modified
+    client = _get_http_client()
+    try:
+        response = await client.head(url, headers=headers)
+        if response.status_code == 405:
+            response = await client.get(url, headers=headers)
+        return response.status_code == 304
+    except httpx.HTTPError as e:
+        logger.warning("Revalidation failed for %s: %s", url, e)
+        return False
+
+async def get_or_scrape(db, url: str, force: bool = False) -> dict:
+    """
+    Returns the cached scrape for `url` (using the AsyncSession `db`),
+    revalidating or rescraping it when stale.
+
+    The result's `status` is one of:
+      fresh       - cached row within SCRAPE_CACHE_TTL, no network at all
+      revalidated - origin answered 304, browser skipped
+      unchanged   - browser ran but the text hash matched, screenshot skipped
+      rescraped   - content changed and the row was updated
+      scraped     - first scrape of this URL
+    `changed` is False whenever downstream work (re-embedding etc.) can be skipped,
+    and `coalesced` is True when the result came from another request's scrape.
+    Returns None if the scrape failed.
+
+    Concurrent calls for the same URL share one in-flight refresh (one browser
+    launch), which runs in its own session so a caller disconnecting cannot
+    cancel it for the others. A `force` call joins a refresh already in flight.
+    """
+    row = await get_scraped_content_by_url(db, url)
+    if row is not None and not force and is_fresh(row):
+        SCRAPE_LOOKUPS.labels(status="fresh", coalesced="false").inc()
+        return {"row": row, "status": "fresh", "changed": False, "coalesced": False}
+
+    flight = _inflight.get(url)
+    coalesced = flight is not None
+    if coalesced:
+        scrape_stats["coalesced"] += 1
+    else:
+        scrape_stats["flights"] += 1
+        flight = asyncio.ensure_future(_refresh(url, force))
+        _inflight[url] = flight
+        flight.add_done_callback(lambda _: _inflight.pop(url, None))
+    result = await asyncio.shield(flight)
+    SCRAPE_LOOKUPS.labels(status=result["status"] if result else "failed", coalesced=str(coalesced).lower()).inc()
+    if result is None:
+        return None
+    # Load the refreshed row into the caller's session, overwriting any stale copy it holds.
+    row = await db.get(ScrapedContent, result["row_id"], populate_existing=True)
+    return {"row": row, "status": result["status"], "changed": result["changed"], "coalesced": coalesced}
+
+async def _refresh(url: str, force: bool):
+    """Revalidates or scrapes `url` and stores the result; returns {row_id, status, changed} or None."""
+    get_async_engine()
+    async with AsyncSessionLocal() as db:
+        row = await get_scraped_content_by_url(db, url)
+        if row is not None and not force:
+            if is_fresh(row):  # Refreshed by another worker process meanwhile
+                return {"row_id": row.id, "status": "fresh", "changed": False}
+            if await is_not_modified(url, row.etag, row.last_modified):
+                row.checked_at = _utcnow()
+                await db.commit()
+                return {"row_id": row.id, "status": "revalidated", "changed": False}
+
+        scraped = await fetch_content_and_screenshot_async(url, known_hash=row.content_hash if row else None)
+        if not scraped:
+            return None
+
+        screenshot_key = None
+        if scraped["screenshot_bytes"] is not None:
+            screenshot_key = await asyncio.to_thread(screenshot_store.put, scraped["screenshot_bytes"])
+
+        if row is None:
+            row = ScrapedContent(url=url)
+            db.add(row)
+            status = "scraped"
+        else:
+            status = "unchanged" if scraped["unchanged"] else "rescraped"
+        _apply_scrape(row, scraped, screenshot_key, status)
+        try:
+            await db.commit()
+        except IntegrityError:
+            # Another worker process inserted this URL first: update its row instead.
+            await db.rollback()
+            row = await get_scraped_content_by_url(db, url)
+            status = "unchanged" if row.content_hash == scraped["content_hash"] else "rescraped"
+            if status == "unchanged":
+                screenshot_key = row.screenshot_key
+            _apply_scrape(row, scraped, screenshot_key, status)
+            await db.commit()
+        return {"row_id": row.id, "status": status, "changed": status != "unchanged"}
+
+def _apply_scrape(row: ScrapedContent, scraped: dict, screenshot_key: str, status: str):
+    if status != "unchanged":
+        row.raw_text = scraped["text"]
+        row.screenshot_key = screenshot_key
+        if status == "rescraped":
+            row.screenshot = None
+    row.content_hash = scraped["content_hash"]
+    row.etag = scraped["etag"]
+    row.last_modified = scraped["last_modified"]
+    row.checked_at = _utcnow()
+
+def get_scrape_stats() -> dict:
+    return {**scrape_stats, "in_flight": len(_inflight)}
@@ -0,0 +1,76 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Subsystems initialize in parallel on these threads, off the event loop.
+_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="startup")
+
+
+class Subsystem:
+    """
+    A heavy dependency (database, vector store, LLM graph, bandit policy) that
+    is initialized once in the background instead of at import time.
+
+    `start()` kicks off `init` on a startup thread and returns immediately;
+    `get()` / `aget()` wait for it (starting it on demand), so requests that
+    need the subsystem simply wait until it is up while everything else is
+    served straight away. A failed init is retried on the next `get()`.
+    """
+    def __init__(self, name: str, init):
+        self.name = name
+        self.init = init
+        self.value = None
+        self.error = None
+        self.started_at = None
+        self.duration = None
+        self._future = None
+        self._lock = threading.Lock()
+
+    def _run(self):
+        started = time.perf_counter()
+        try:
+            self.value = self.init()
+            self.error = None
+            return self.value
+        except Exception as e:
+            self.error = str(e)
+            logger.error("Subsystem '%s' failed to start: %s", self.name, e)
+            raise
+        finally:
+            self.duration = time.perf_counter() - started
+
+    def start(self) -> Future:
+        with self._lock:
+            if self._future is None or (self._future.done() and self._future.exception() is not None):
+                self.started_at = time.time()
+                self._future = _executor.submit(self._run)
+            return self._future
+
+    def get(self, timeout: float = None):
+        """Blocks until the subsystem is up (never call this on the event loop; use aget)."""
+        return self.start().result(timeout)
+
+    async def aget(self):
+        return await asyncio.wrap_future(self.start())
+
+    @property
+    def ready(self) -> bool:
+        return self._future is not None and self._future.done() and self._future.exception() is None
+
+    def status(self) -> dict:
+        if self._future is None:
+            state = "pending"
+        elif not self._future.done():
+            state = "starting"
+        else:
+            state = "ready" if self._future.exception() is None else "failed"
+        status = {"status": state}
+        if self.duration is not None:
+            status["seconds"] = round(self.duration, 3)
+        if state == "failed":
+            status["error"] = self.error
+        return status
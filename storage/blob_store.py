@@ -0,0 +1,89 @@
+import hashlib
+import io
+import os
+import tempfile
+from pathlib import Path
+
+from config import SCREENSHOT_STORE_PATH, SCREENSHOT_FORMAT, SCREENSHOT_THUMB_WIDTH
+
+try:  # Pillow is optional; without it only the original PNG is stored and served.
+    from PIL import Image
+except ImportError:
+    Image = None
+
+MEDIA_TYPES = {"png": "image/png", "webp": "image/webp"}
+
+
+class BlobStore:
+    """
+    Content-addressed file store: blobs live at <root>/<hash[:2]>/<hash>.<ext>,
+    so identical screenshots are stored once and paths never need updating.
+    """
+    def __init__(self, root: str = SCREENSHOT_STORE_PATH, store_format: str = SCREENSHOT_FORMAT):
+        self.root = Path(root)
+        self.store_format = store_format if (store_format == "png" or Image is not None) else "png"
+
+    def _path(self, digest: str, suffix: str) -> Path:
+        return self.root / digest[:2] / f"{digest}{suffix}"
+
+    def _write_atomic(self, path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def put(self, png_bytes: bytes) -> str:
+        """Stores a PNG screenshot (converted to SCREENSHOT_FORMAT) and returns its key."""
+        digest = hashlib.sha256(png_bytes).hexdigest()
+        path = self._path(digest, f".{self.store_format}")
+        if not path.exists():
+            data = png_bytes if self.store_format == "png" else _convert(png_bytes, self.store_format)
+            self._write_atomic(path, data)
+        return f"{digest}.{self.store_format}"
+
+    def get_path(self, key: str, variant: str = "original") -> Path:
+        """
+        Returns the file for a stored blob. Variants ("webp", "thumb") are derived
+        on first request and cached next to the original. Returns None if missing
+        or if the variant cannot be produced.
+        """
+        digest, ext = key.rsplit(".", 1)
+        original = self._path(digest, f".{ext}")
+        if not original.exists():
+            return None
+        if variant == "original":
+            return original
+        if Image is None:
+            return None
+        if variant == "webp":
+            path = self._path(digest, ".webp")
+            if not path.exists():
+                self._write_atomic(path, _convert(original.read_bytes(), "webp"))
+            return path
+        if variant == "thumb":
+            path = self._path(digest, f".thumb{SCREENSHOT_THUMB_WIDTH}.webp")
+            if not path.exists():
+                self._write_atomic(path, _convert(original.read_bytes(), "webp", max_width=SCREENSHOT_THUMB_WIDTH))
+            return path
+        raise ValueError(f"Unknown screenshot variant: {variant}")
+
+
+def _convert(data: bytes, fmt: str, max_width: int = None) -> bytes:
+    image = Image.open(io.BytesIO(data))
+    if max_width and image.width > max_width:
+        image.thumbnail((max_width, max_width * image.height // image.width))
+    out = io.BytesIO()
+    image.save(out, format=fmt.upper(), quality=80)
+    return out.getvalue()
+
+
+def media_type_for(path: Path) -> str:
+    return MEDIA_TYPES.get(path.suffix.lstrip("."), "application/octet-stream")
+
+
+screenshot_store = BlobStore()
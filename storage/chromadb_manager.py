@@ -1,34 +1,204 @@
-import chromadb
-from config import CHROMA_DB_PATH
+import importlib
+import logging
+import threading
+import time
 
-client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+from config import (CHROMA_DB_PATH, CHROMA_EMBEDDING_FUNCTION, HYBRID_SHORT_QUERY_TERMS, HYBRID_MIN_KEYWORD_SCORE,
+                    CHROMA_STATS_REFRESH)
+from observability import CHROMA_SECONDS, timed
+from storage.query_cache import query_cache
+from storage.keyword_index import keyword_indexes, tokenize
+from storage.passages import passages_for_document
 
-def store_final_version(collection_name: str, doc_id: str, document: str):
-    # Use get_or_create to avoid errors on first write
-    collection = client.get_or_create_collection(name=collection_name)
-    collection.add(documents=[document], ids=[doc_id])
-    print(f"Stored document '{doc_id}' in collection '{collection_name}'.")
+logger = logging.getLogger(__name__)
 
-def query_collection(collection_name: str, query_text: str, n_results: int = 3):
+client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Opens the persistent client on first use; importing chromadb alone takes about a second."""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                import chromadb
+                client = chromadb.PersistentClient(path=CHROMA_DB_PATH)
+    return client
+
+_embedding_function = None
+
+def _collection_options() -> dict:
+    """Extra get_collection arguments: the CHROMA_EMBEDDING_FUNCTION override, if configured."""
+    global _embedding_function
+    if not CHROMA_EMBEDDING_FUNCTION:
+        return {}
+    if _embedding_function is None:
+        module, _, attribute = CHROMA_EMBEDDING_FUNCTION.partition(":")
+        _embedding_function = getattr(importlib.import_module(module), attribute)()
+    return {"embedding_function": _embedding_function}
+
+RRF_K = 60  # Reciprocal-rank-fusion constant
+
+# --- Collection handles and counters ---
+# Handles are fetched once per collection instead of on every call. Document
+# counts are seeded from count() when a handle is first fetched and then kept
+# up to date by add_documents; a full recount (which also sees writes from
+# other worker processes) happens at most every CHROMA_STATS_REFRESH seconds.
+_collections = {}
+_doc_counts = {}
+_recounted_at = 0.0
+_handles_lock = threading.Lock()
+
+def get_collection(collection_name: str, create: bool = False):
+    """Returns a cached collection handle; raises NotFoundError if it is missing and `create` is False."""
+    collection = _collections.get(collection_name)
+    if collection is not None:
+        return collection
+    with _handles_lock:
+        collection = _collections.get(collection_name)
+        if collection is None:
+            if create:
+                collection = get_client().get_or_create_collection(name=collection_name, **_collection_options())
+            else:
+                collection = get_client().get_collection(name=collection_name, **_collection_options())
+            _doc_counts[collection_name] = collection.count()
+            _collections[collection_name] = collection
+        return collection
+
+def invalidate_collection(collection_name: str = None):
+    """Drops cached handles (all of them if no name is given), e.g. after a collection is deleted."""
+    with _handles_lock:
+        names = [collection_name] if collection_name else list(_collections)
+        for name in names:
+            _collections.pop(name, None)
+            _doc_counts.pop(name, None)
+
+def add_documents(collection_name: str, ids: list, documents: list, metadatas: list = None):
     """
-    Queries a collection for n_results similar documents.
-    Accepts n_results as a parameter.
+    The single write path into Chroma: one batched add (one embedding pass),
+    then the retrieval cache and keyword index are brought up to date.
     """
-    try:
-        collection = client.get_collection(name=collection_name)
-        # Use the n_results parameter in the actual ChromaDB query
-        results = collection.query(
-            query_texts=[query_text],
-            n_results=n_results
-        )
-        # Ensure 'documents' key exists and is not empty before accessing
-        return results['documents'][0] if results.get('documents') else []
-    except Exception as e:
-        print(f"Error querying collection '{collection_name}': {e}")
-        return []
-
-def get_chroma_stats():
-    """Returns statistics about the ChromaDB instance."""
-    collections = client.list_collections()
-    total_docs = sum(c.count() for c in collections)
-    return {"collection_count": len(collections), "document_count": total_docs}
\ No newline at end of file
+    if not ids:
+        return
+    from chromadb.errors import NotFoundError
+    with timed(CHROMA_SECONDS, "chroma.add", operation="add"):
+        try:
+            get_collection(collection_name, create=True).add(ids=ids, documents=documents, metadatas=metadatas)
+        except NotFoundError:
+            # The collection was deleted behind a cached handle; fetch a fresh one once.
+            invalidate_collection(collection_name)
+            get_collection(collection_name, create=True).add(ids=ids, documents=documents, metadatas=metadatas)
+    with _handles_lock:
+        _doc_counts[collection_name] = _doc_counts.get(collection_name, 0) + len(ids)
+    query_cache.invalidate(collection_name)
+    keyword_indexes.add(collection_name, ids, documents, metadatas)
+
+def store_final_version(collection_name: str, doc_id: str, document: str, metadata: dict = None):
+    """Synchronously splits a document into passages and stores them."""
+    ids, passages, metadatas = passages_for_document(doc_id, document, metadata)
+    add_documents(collection_name, ids, passages, metadatas)
+    logger.info("Stored document '%s' (%d passages) in collection '%s'.", doc_id, len(ids), collection_name)
+
+def _dense_hits(collection, query_texts: list, n_results: int) -> list:
+    """Embedding search; returns one list of (id, document, metadata) per query text."""
+    results = collection.query(query_texts=query_texts, n_results=n_results, include=["documents", "metadatas"])
+    ids = results.get('ids') or [[] for _ in query_texts]
+    documents = results.get('documents') or [[] for _ in query_texts]
+    metadatas = results.get('metadatas') or [[None] * len(i) for i in ids]
+    return [list(zip(i, d, (m or {} for m in ms))) for i, d, ms in zip(ids, documents, metadatas)]
+
+def _keyword_or_hybrid(collection, query_text: str, n_results: int, mode: str) -> list:
+    """
+    BM25 over the collection, fused with dense results by reciprocal rank.
+    Short queries with a confident keyword match skip the embedding model.
+    """
+    index = keyword_indexes.get(collection)
+    keyword_hits = index.search(query_text, n_results * 2)
+    confident = (len(keyword_hits) >= n_results and keyword_hits[0][1] >= HYBRID_MIN_KEYWORD_SCORE
+                 and len(tokenize(query_text)) <= HYBRID_SHORT_QUERY_TERMS)
+    if mode == "keyword" or confident:
+        return [(doc_id, index.documents[doc_id], index.metadatas[doc_id]) for doc_id, _ in keyword_hits[:n_results]]
+
+    dense_hits = _dense_hits(collection, [query_text], n_results * 2)[0]
+    by_id = {hit[0]: hit for hit in dense_hits}
+    fused = {}
+    for ranking in ([doc_id for doc_id, _ in keyword_hits], [hit[0] for hit in dense_hits]):
+        for rank, doc_id in enumerate(ranking):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (RRF_K + rank + 1)
+    best = sorted(fused, key=fused.get, reverse=True)[:n_results]
+    return [by_id.get(doc_id) or (doc_id, index.documents[doc_id], index.metadatas[doc_id]) for doc_id in best]
+
+def _format_hits(hits: list, with_metadata: bool) -> list:
+    if with_metadata:
+        return [{"id": doc_id, "document": doc, "metadata": metadata} for doc_id, doc, metadata in hits]
+    return [doc for _, doc, _ in hits]
+
+def query_collection(collection_name: str, query_text: str, n_results: int = 3, mode: str = "dense",
+                     with_metadata: bool = False):
+    """
+    Queries a collection for the n_results most similar passages.
+    `mode` is "dense" (embeddings), "keyword" (BM25) or "hybrid" (both, fused).
+    With `with_metadata`, each hit is {"id", "document", "metadata"} so callers
+    can cite the source chapter. Results are cached until the collection is written to.
+    """
+    key = (mode, query_text, n_results)
+    generation = query_cache.generation(collection_name)
+    hits = query_cache.get(collection_name, key)
+    if hits is None:
+        try:
+            collection = get_collection(collection_name)
+            with timed(CHROMA_SECONDS, "chroma.query", operation=f"query_{mode}"):
+                if mode == "dense":
+                    hits = _dense_hits(collection, [query_text], n_results)[0]
+                else:
+                    hits = _keyword_or_hybrid(collection, query_text, n_results, mode)
+        except Exception as e:
+            logger.error("Error querying collection '%s': %s", collection_name, e)
+            invalidate_collection(collection_name)
+            return []
+        query_cache.put(collection_name, key, hits, generation)
+    return _format_hits(hits, with_metadata)
+
+def query_collection_batch(collection_name: str, query_texts: list, n_results: int = 3,
+                           with_metadata: bool = False) -> list:
+    """Queries many texts in one Chroma call (cached ones are skipped); returns one list of hits per query."""
+    generation = query_cache.generation(collection_name)
+    results = [query_cache.get(collection_name, ("dense", text, n_results)) for text in query_texts]
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        try:
+            collection = get_collection(collection_name)
+            with timed(CHROMA_SECONDS, "chroma.query", operation="query_batch"):
+                hits = _dense_hits(collection, [query_texts[i] for i in misses], n_results)
+        except Exception as e:
+            logger.error("Error querying collection '%s': %s", collection_name, e)
+            invalidate_collection(collection_name)
+            hits = [[] for _ in misses]
+        for i, hit in zip(misses, hits):
+            results[i] = hit
+            query_cache.put(collection_name, ("dense", query_texts[i], n_results), hit, generation)
+    return [_format_hits(hits, with_metadata) for hits in results]
+
+def _recount():
+    global _recounted_at
+    counts = {}
+    for listed in get_client().list_collections():
+        name = listed if isinstance(listed, str) else listed.name  # list_collections returns names in newer Chroma
+        counts[name] = get_collection(name).count()
+    with _handles_lock:
+        _doc_counts.clear()
+        _doc_counts.update(counts)
+        _recounted_at = time.monotonic()
+
+def get_chroma_stats(refresh: bool = False):
+    """Returns statistics about the ChromaDB instance from the maintained counters."""
+    if refresh or time.monotonic() - _recounted_at > CHROMA_STATS_REFRESH:
+        _recount()
+    with _handles_lock:
+        counts = dict(_doc_counts)
+    return {
+        "collection_count": len(counts),
+        "document_count": sum(counts.values()),
+        "collections": counts,
+        "counted_seconds_ago": round(time.monotonic() - _recounted_at, 1),
+    }
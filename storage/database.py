@@ -1,11 +1,19 @@
+import json
+import logging
+import threading
+
 from sqlalchemy import create_engine, text, inspect
-from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker, declarative_base, deferred
 from sqlalchemy.exc import OperationalError, ProgrammingError
-from sqlalchemy import Column, Integer, String, Text, LargeBinary, DateTime
+from sqlalchemy import Column, Integer, String, Text, LargeBinary, DateTime, ForeignKey, select, update, delete
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.sql import func
 from urllib.parse import urlparse
 
-from config import DATABASE_URL
+from config import DATABASE_URL, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING
+
+logger = logging.getLogger(__name__)
 
 # --- Database Creation Logic ---
 def create_database_if_not_exists(url: str):
@@ -26,32 +34,84 @@ def create_database_if_not_exists(url: str):
             db_exists = result.scalar() == 1
 
             if not db_exists:
-                print(f"Database '{db_name}' not found. Creating it...")
+                logger.info("Database '%s' not found. Creating it...", db_name)
                 # FIX: Commit the current transaction before changing isolation level.
                 conn.commit() 
                 
                 # Now that the previous transaction is closed, we can execute CREATE DATABASE.
                 conn.execution_options(isolation_level="AUTOCOMMIT").execute(text(f"CREATE DATABASE {db_name}"))
-                print(f"Database '{db_name}' created successfully.")
+                logger.info("Database '%s' created successfully.", db_name)
             else:
-                print(f"Database '{db_name}' already exists.")
+                logger.info("Database '%s' already exists.", db_name)
     except OperationalError as e:
-        print(f"FATAL: Could not connect to PostgreSQL server. Is it running? Error: {e}")
-        exit()
-    except Exception as e:
-        print(f"An unexpected error occurred during DB setup: {e}")
-        exit()
-
-# ... (the rest of the file remains exactly the same) ...
+        raise RuntimeError(f"Could not connect to PostgreSQL server. Is it running? Error: {e}") from e
 
 # --- Main Application DB Setup ---
-# Call the creation logic before setting up the main engine
-create_database_if_not_exists(DATABASE_URL)
-
-# Now, connect to the application's database (which is guaranteed to exist)
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Nothing connects at import time: the engine is created (and the database
+# created if needed) on first use, so importing this module is cheap and a
+# database outage surfaces as a readiness failure instead of killing the process.
+engine = None
+async_engine = None
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)  # Bound by get_engine()
+# expire_on_commit=False: rows stay readable after commit without another (awaited) load.
+AsyncSessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False)  # Bound by get_async_engine()
 Base = declarative_base()
+_engine_lock = threading.Lock()
+
+def _pool_options(url: str) -> dict:
+    if url.startswith("sqlite") and ":memory:" in url:
+        return {}  # In-memory SQLite uses a single-connection pool
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def async_url(url: str) -> str:
+    """Maps a sync DATABASE_URL onto its async driver (asyncpg / aiosqlite)."""
+    scheme, rest = url.split("://", 1)
+    if scheme.startswith("postgresql"):
+        return f"postgresql+asyncpg://{rest}"
+    if scheme.startswith("sqlite"):
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+def get_engine():
+    global engine
+    if engine is None:
+        with _engine_lock:
+            if engine is None:
+                if DATABASE_URL.startswith("postgresql"):
+                    create_database_if_not_exists(DATABASE_URL)
+                new_engine = create_engine(DATABASE_URL, **_pool_options(DATABASE_URL))
+                SessionLocal.configure(bind=new_engine)
+                engine = new_engine
+    return engine
+
+def get_async_engine():
+    """Async engine for the request path; call init_db() (or get_engine()) first so the database exists."""
+    global async_engine
+    if async_engine is None:
+        with _engine_lock:
+            if async_engine is None:
+                url = async_url(DATABASE_URL)
+                new_engine = create_async_engine(url, **_pool_options(url))
+                AsyncSessionLocal.configure(bind=new_engine)
+                async_engine = new_engine
+    return async_engine
+
+async def dispose_engines():
+    if async_engine is not None:
+        await async_engine.dispose()
+    if engine is not None:
+        engine.dispose()
+
+def get_session():
+    """Opens a session, creating the engine first if needed."""
+    get_engine()
+    return SessionLocal()
 
 # --- Model Definition ---
 class ScrapedContent(Base):
@@ -59,19 +119,168 @@ class ScrapedContent(Base):
     id = Column(Integer, primary_key=True, index=True)
     url = Column(String, unique=True, index=True, nullable=False)
     raw_text = Column(Text, nullable=False)
-    screenshot = Column(LargeBinary, nullable=False)
+    # Legacy inline PNG; new rows keep only `screenshot_key` into the blob store.
+    screenshot = deferred(Column(LargeBinary, nullable=True))
+    screenshot_key = Column(String)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    # Freshness / revalidation metadata for the scrape cache
+    content_hash = Column(String(64))
+    etag = Column(String)
+    last_modified = Column(String)
+    checked_at = Column(DateTime(timezone=True))
+
+class GenerationJob(Base):
+    """A batch of chapters spun with the same provider and feedback."""
+    __tablename__ = "generation_jobs"
+    id = Column(String(36), primary_key=True)
+    llm_provider = Column(String, nullable=False)
+    feedback = Column(Text, nullable=False)
+    generation_mode = Column(String, nullable=False)
+    status = Column(String, nullable=False, index=True)  # running, done, failed, cancelled
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True))
+
+class JobChapter(Base):
+    __tablename__ = "job_chapters"
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String(36), ForeignKey("generation_jobs.id"), nullable=False, index=True)
+    content_id = Column(Integer, ForeignKey("scraped_content.id"), nullable=False)
+    position = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, index=True)  # queued, running, done, failed, cancelled
+    attempts = Column(Integer, nullable=False, default=0)
+    thread_id = Column(String)
+    tokens_estimated = Column(Integer)
+    result_text = deferred(Column(Text))
+    error = Column(Text)
+    retry_at = Column(DateTime(timezone=True))  # A queued retry is not picked up before this
+    started_at = Column(DateTime(timezone=True))  # Set once the provider limits are acquired
+    heartbeat_at = Column(DateTime(timezone=True))  # Refreshed while running; stale chapters are requeued
+    finished_at = Column(DateTime(timezone=True))
+
+class PendingApproval(Base):
+    """An approved version queued for embedding; the row is deleted once it is stored."""
+    __tablename__ = "pending_approvals"
+    doc_id = Column(String, primary_key=True)
+    collection_name = Column(String, nullable=False)
+    document = Column(Text, nullable=False)
+    metadata_json = Column(Text)
+    status = Column(String, nullable=False, index=True)  # queued, failed
+    error = Column(Text)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 def init_db():
     """Creates the tables in the database."""
+    engine = get_engine()
     try:
         # Check if table exists before creating
         inspector = inspect(engine)
         if not inspector.has_table(ScrapedContent.__tablename__):
-            print(f"Table '{ScrapedContent.__tablename__}' not found. Creating it...")
+            logger.info("Table '%s' not found. Creating it...", ScrapedContent.__tablename__)
             Base.metadata.create_all(bind=engine)
-            print("Table created.")
+            logger.info("Table created.")
         else:
-            print(f"Table '{ScrapedContent.__tablename__}' already exists.")
+            logger.info("Table '%s' already exists.", ScrapedContent.__tablename__)
+            for table in (ScrapedContent.__table__, JobChapter.__table__):
+                if inspector.has_table(table.name):
+                    _add_missing_columns(inspector, table)
+            Base.metadata.create_all(bind=engine)  # Tables added later (e.g. generation jobs); existing ones are skipped
     except Exception as e:
-        print(f"Could not create table. Error: {e}")
\ No newline at end of file
+        logger.error("Could not create table. Error: %s", e)
+        raise
+
+def _add_missing_columns(inspector, table):
+    """Adds nullable columns introduced after the table was first created (and relaxes `screenshot`)."""
+    engine = get_engine()
+    existing = {col["name"] for col in inspector.get_columns(table.name)}
+    with engine.begin() as conn:
+        if table is ScrapedContent.__table__ and engine.dialect.name == "postgresql" and not next(
+                col["nullable"] for col in inspector.get_columns(table.name) if col["name"] == "screenshot"):
+            conn.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN screenshot DROP NOT NULL"))
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                col_type = column.type.compile(dialect=engine.dialect)
+                logger.info("Adding missing column '%s' to '%s'.", column.name, table.name)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+
+# --- Async Queries ---
+async def get_scraped_content_by_url(db, url: str):
+    result = await db.execute(select(ScrapedContent).where(ScrapedContent.url == url))
+    return result.scalars().first()
+
+async def get_scraped_content(db, content_id: int):
+    return await db.get(ScrapedContent, content_id)
+
+async def get_legacy_screenshot(db, content_id: int):
+    """Loads the deferred inline screenshot of a pre-blob-store row."""
+    return await db.scalar(select(ScrapedContent.screenshot).where(ScrapedContent.id == content_id))
+
+async def list_recent_scraped_content(db, limit: int) -> list:
+    """(id, url) of the most recent rows, without loading text or screenshots."""
+    result = await db.execute(select(ScrapedContent.id, ScrapedContent.url).order_by(ScrapedContent.id.desc()).limit(limit))
+    return result.all()
+
+async def get_existing_content_ids(db, content_ids: list) -> set:
+    result = await db.scalars(select(ScrapedContent.id).where(ScrapedContent.id.in_(content_ids)))
+    return set(result)
+
+_JOB_CHAPTER_FIELDS = ("content_id", "position", "status", "attempts", "thread_id", "tokens_estimated", "error",
+                       "started_at", "finished_at")
+
+async def list_job_chapters(db, job_id: str) -> list:
+    columns = [getattr(JobChapter, field) for field in _JOB_CHAPTER_FIELDS]
+    result = await db.execute(select(*columns).where(JobChapter.job_id == job_id).order_by(JobChapter.position))
+    return [dict(zip(_JOB_CHAPTER_FIELDS, row)) for row in result]
+
+async def get_job_chapter(db, job_id: str, content_id: int):
+    """One chapter's status and generated text, or None."""
+    columns = [getattr(JobChapter, field) for field in _JOB_CHAPTER_FIELDS] + [JobChapter.result_text]
+    row = (await db.execute(select(*columns).where(JobChapter.job_id == job_id, JobChapter.content_id == content_id))).first()
+    return dict(zip(_JOB_CHAPTER_FIELDS + ("result_text",), row)) if row else None
+
+# --- Bulk Helpers ---
+def get_existing_urls(db, urls: list) -> set:
+    """Returns the subset of `urls` that already have a ScrapedContent row."""
+    if not urls:
+        return set()
+    rows = db.execute(select(ScrapedContent.url).where(ScrapedContent.url.in_(urls)))
+    return {row[0] for row in rows}
+
+def bulk_insert_scraped_content(db, rows: list) -> int:
+    """
+    Inserts many ScrapedContent column dicts (url, raw_text, screenshot, ...) in a single statement and
+    commits once. Rows whose URL already exists are skipped.
+    """
+    if not rows:
+        return 0
+    dialect_insert = sqlite.insert if db.bind.dialect.name == "sqlite" else postgresql.insert
+    stmt = dialect_insert(ScrapedContent).values(rows).on_conflict_do_nothing(index_elements=["url"])
+    result = db.execute(stmt)
+    db.commit()
+    return result.rowcount
+
+# --- Pending Approvals ---
+def add_pending_approval(db, doc_id: str, collection_name: str, document: str, metadata: dict = None):
+    db.add(PendingApproval(doc_id=doc_id, collection_name=collection_name, document=document,
+                           metadata_json=json.dumps(metadata) if metadata else None, status="queued"))
+    db.commit()
+
+def list_queued_approvals(db) -> list:
+    """(doc_id, collection_name, document, metadata) of every approval not yet embedded, oldest first."""
+    rows = db.execute(select(PendingApproval.doc_id, PendingApproval.collection_name, PendingApproval.document,
+                             PendingApproval.metadata_json)
+                      .where(PendingApproval.status == "queued").order_by(PendingApproval.created_at))
+    return [(doc_id, name, document, json.loads(meta) if meta else None) for doc_id, name, document, meta in rows]
+
+def get_pending_approval_status(db, doc_id: str):
+    row = db.execute(select(PendingApproval.status, PendingApproval.error).where(PendingApproval.doc_id == doc_id)).first()
+    return None if row is None else {"status": row.status, **({"error": row.error} if row.error else {})}
+
+def finish_pending_approvals(db, doc_ids: list, error: str = None):
+    """Deletes the rows of stored documents, or marks them failed with `error`."""
+    if not doc_ids:
+        return
+    if error is None:
+        db.execute(delete(PendingApproval).where(PendingApproval.doc_id.in_(doc_ids)))
+    else:
+        db.execute(update(PendingApproval).where(PendingApproval.doc_id.in_(doc_ids)).values(status="failed", error=error))
+    db.commit()
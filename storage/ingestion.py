@@ -0,0 +1,166 @@
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from config import EMBED_BATCH_SIZE, EMBED_BATCH_WAIT
+from storage.chromadb_manager import add_documents
+from storage.database import (get_session, add_pending_approval, list_queued_approvals, get_pending_approval_status,
+                              finish_pending_approvals)
+from storage.passages import passages_for_document
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionWorker:
+    """
+    Embeds approved documents off the request path.
+
+    `submit` only queues the document. A background thread collects queued
+    documents for up to `batch_wait` seconds (or until `batch_size` passages
+    are pending), splits them into passages and writes each collection's
+    passages with as few `collection.add` calls as possible, so the embedding
+    model sees large batches instead of one document at a time.
+
+    Every submitted document is also written to the pending_approvals table
+    and removed once embedded, so approvals still queued when the process
+    stops are picked up again by the next `start`.
+    """
+    def __init__(self, batch_size: int = EMBED_BATCH_SIZE, batch_wait: float = EMBED_BATCH_WAIT,
+                 max_tracked: int = 10000):
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.max_tracked = max_tracked
+        self._queue = queue.Queue()
+        self._status = OrderedDict()  # doc_id -> {"status", "passages", "error"}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    # --- Producer side ---
+    def submit(self, collection_name: str, doc_id: str, document: str, metadata: dict = None) -> int:
+        """Persists and queues a document; returns the number of passages it will be stored as."""
+        with get_session() as db:
+            add_pending_approval(db, doc_id, collection_name, document, metadata)
+        return self._enqueue(collection_name, doc_id, document, metadata)
+
+    def _enqueue(self, collection_name: str, doc_id: str, document: str, metadata: dict) -> int:
+        ids, passages, metadatas = passages_for_document(doc_id, document, metadata)
+        self._set_status(doc_id, {"status": "queued", "passages": len(ids)})
+        self._queue.put((collection_name, doc_id, ids, passages, metadatas))
+        return len(ids)
+
+    def status(self, doc_id: str):
+        with self._lock:
+            status = self._status.get(doc_id)
+        if status is None:
+            # Queued or failed before a restart, or no longer tracked in memory.
+            with get_session() as db:
+                status = get_pending_approval_status(db, doc_id)
+        return status
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def _set_status(self, doc_id: str, status: dict):
+        with self._lock:
+            self._status[doc_id] = status
+            self._status.move_to_end(doc_id)
+            while len(self._status) > self.max_tracked:
+                self._status.popitem(last=False)
+
+    # --- Worker side ---
+    def _next_batch(self) -> list:
+        """Blocks for the first job, then gathers more until the batch is full or the wait expires."""
+        job = self._queue.get()
+        if job is None:
+            return None
+        batch, size = [job], len(job[2])
+        deadline = time.monotonic() + self.batch_wait
+        while size < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                self._queue.put(None)  # Let the run loop see the stop signal after this batch
+                break
+            batch.append(job)
+            size += len(job[2])
+        return batch
+
+    def _write(self, batch: list):
+        by_collection = defaultdict(list)
+        for job in batch:
+            by_collection[job[0]].append(job)
+        for collection_name, jobs in by_collection.items():
+            ids, passages, metadatas = [], [], []
+            for _, _, job_ids, job_passages, job_metadatas in jobs:
+                ids += job_ids
+                passages += job_passages
+                metadatas += job_metadatas
+            try:
+                for start in range(0, len(ids), self.batch_size):
+                    end = start + self.batch_size
+                    add_documents(collection_name, ids[start:end], passages[start:end], metadatas[start:end])
+                for _, doc_id, job_ids, _, _ in jobs:
+                    self._set_status(doc_id, {"status": "stored", "passages": len(job_ids)})
+                self._finish([job[1] for job in jobs])
+                logger.info("Embedded %d documents (%d passages) into '%s'.", len(jobs), len(ids), collection_name)
+            except Exception as e:
+                logger.exception("Error embedding into '%s': %s", collection_name, e)
+                for _, doc_id, job_ids, _, _ in jobs:
+                    self._set_status(doc_id, {"status": "failed", "passages": len(job_ids), "error": str(e)})
+                self._finish([job[1] for job in jobs], str(e))
+
+    @staticmethod
+    def _finish(doc_ids: list, error: str = None):
+        try:
+            with get_session() as db:
+                finish_pending_approvals(db, doc_ids, error)
+        except Exception as e:
+            # The documents are re-embedded after a restart; Chroma skips ids it already has.
+            logger.error("Could not update %d pending approvals: %s", len(doc_ids), e)
+
+    def _replay(self):
+        """Queues the approvals a previous process accepted but did not embed."""
+        with get_session() as db:
+            rows = list_queued_approvals(db)
+        with self._lock:
+            rows = [row for row in rows if row[0] not in self._status]  # Not already submitted by this process
+        for doc_id, collection_name, document, metadata in rows:
+            self._enqueue(collection_name, doc_id, document, metadata)
+        if rows:
+            logger.info("Re-queued %d approvals left pending by a previous run.", len(rows))
+
+    def _run(self, db_ready):
+        try:
+            if db_ready is not None:
+                db_ready()
+            self._replay()
+        except Exception as e:
+            logger.error("Could not re-queue pending approvals: %s", e)
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._write(batch)
+
+    def start(self, db_ready=None):
+        """Starts the worker thread; it waits for `db_ready()` (if given) before re-queueing pending approvals."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, args=(db_ready,), name="embedding-ingestion", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the worker after everything already queued has been written."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+
+ingestion_worker = IngestionWorker()
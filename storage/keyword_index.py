@@ -0,0 +1,104 @@
+import logging
+import math
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+
+from config import KEYWORD_INDEX_REFRESH
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"\w+")
+
+def tokenize(text: str) -> list:
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Index:
+    """In-memory BM25 index over the documents of one collection."""
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = defaultdict(dict)  # term -> {doc_id: term frequency}
+        self.doc_lengths = {}
+        self.documents = {}
+        self.metadatas = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, doc_id: str, document: str, metadata: dict = None):
+        if doc_id in self.documents:
+            return
+        terms = tokenize(document)
+        for term, tf in Counter(terms).items():
+            self.postings[term][doc_id] = tf
+        self.doc_lengths[doc_id] = len(terms)
+        self.documents[doc_id] = document
+        self.metadatas[doc_id] = metadata or {}
+        self.total_length += len(terms)
+
+    def search(self, query: str, n_results: int) -> list:
+        """Returns up to n_results (doc_id, score) pairs, best first."""
+        if not self.documents:
+            return []
+        n_docs = len(self.documents)
+        avg_length = self.total_length / n_docs or 1.0
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for doc_id, tf in postings.items():
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:n_results]
+
+
+class KeywordIndexRegistry:
+    """
+    One BM25 index per collection, built lazily from the collection's documents.
+    Writes made through this process are added directly; writes from other
+    processes are picked up by re-checking the collection's count at most
+    every `refresh_interval` seconds.
+    """
+    def __init__(self, refresh_interval: float = KEYWORD_INDEX_REFRESH):
+        self.refresh_interval = refresh_interval
+        self._indexes = {}
+        self._checked_at = {}
+        self._lock = threading.Lock()
+
+    def get(self, collection) -> BM25Index:
+        name = collection.name
+        with self._lock:
+            index = self._indexes.get(name)
+            now = time.monotonic()
+            stale = index is None or now - self._checked_at.get(name, 0) > self.refresh_interval
+            if stale:
+                if index is None or collection.count() != len(index):
+                    index = self._build(collection)
+                    self._indexes[name] = index
+                self._checked_at[name] = now
+            return index
+
+    def add(self, collection_name: str, doc_ids: list, documents: list, metadatas: list = None):
+        with self._lock:
+            index = self._indexes.get(collection_name)
+            if index is not None:
+                for doc_id, document, metadata in zip(doc_ids, documents, metadatas or [None] * len(doc_ids)):
+                    index.add(doc_id, document, metadata)
+
+    @staticmethod
+    def _build(collection) -> BM25Index:
+        index = BM25Index()
+        data = collection.get(include=["documents", "metadatas"])
+        for doc_id, document, metadata in zip(data["ids"], data["documents"], data["metadatas"]):
+            index.add(doc_id, document or "", metadata)
+        logger.info("Built keyword index for '%s' (%d documents).", collection.name, len(index))
+        return index
+
+
+keyword_indexes = KeywordIndexRegistry()
@@ -0,0 +1,31 @@
+import re
+
+from config import PASSAGE_WORDS, PASSAGE_OVERLAP_WORDS
+
+_WORD = re.compile(r"\S+")
+
+def split_into_passages(text: str, passage_words: int = PASSAGE_WORDS, overlap_words: int = PASSAGE_OVERLAP_WORDS) -> list:
+    """
+    Splits text into windows of `passage_words` words, each sharing
+    `overlap_words` with the previous one so a sentence cut at a boundary is
+    still whole in one of the two passages.
+    """
+    words = _WORD.findall(text)
+    if len(words) <= passage_words:
+        return [" ".join(words)] if words else []
+    step = max(1, passage_words - overlap_words)
+    passages = []
+    for start in range(0, len(words), step):
+        passages.append(" ".join(words[start:start + passage_words]))
+        if start + passage_words >= len(words):
+            break
+    return passages
+
+def passages_for_document(doc_id: str, document: str, metadata: dict = None):
+    """Returns (ids, passages, metadatas) for one approved document."""
+    passages = split_into_passages(document)
+    # Chroma metadata values must be str/int/float/bool, so unset fields are dropped.
+    base = {key: value for key, value in (metadata or {}).items() if value is not None}
+    ids = [f"{doc_id}#{i}" for i in range(len(passages))]
+    metadatas = [{**base, "doc_id": doc_id, "passage": i, "passage_count": len(passages)} for i in range(len(passages))]
+    return ids, passages, metadatas
@@ -0,0 +1,63 @@
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from config import RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_TTL
+
+
+class QueryCache:
+    """
+    In-process LRU cache of retrieval results, partitioned by collection.
+
+    Writes to a collection bump its generation, which invalidates every cached
+    result for it at once. The TTL bounds staleness from writes made by other
+    worker processes, which this process never hears about.
+    """
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_MAX_ENTRIES, ttl: float = RETRIEVAL_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (collection, key) -> (generation, expires_at, value)
+        self._generations = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def get(self, collection_name: str, key: tuple):
+        with self._lock:
+            entry = self._entries.get((collection_name, key))
+            if entry is not None:
+                generation, expires_at, value = entry
+                if generation == self._generations[collection_name] and expires_at > time.monotonic():
+                    self._entries.move_to_end((collection_name, key))
+                    self.hits += 1
+                    return value
+                del self._entries[(collection_name, key)]
+            self.misses += 1
+            return None
+
+    def generation(self, collection_name: str) -> int:
+        """The collection's current generation; take it before querying and hand it to `put`."""
+        with self._lock:
+            return self._generations[collection_name]
+
+    def put(self, collection_name: str, key: tuple, value, generation: int):
+        """Caches `value` unless the collection was written to since `generation` (the result may predate the write)."""
+        with self._lock:
+            if generation != self._generations[collection_name]:
+                return
+            self._entries[(collection_name, key)] = (generation, time.monotonic() + self.ttl, value)
+            self._entries.move_to_end((collection_name, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection_name: str):
+        with self._lock:
+            self._generations[collection_name] += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0}
+
+
+query_cache = QueryCache()
@@ -0,0 +1,147 @@
+import difflib
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from config import VERSION_STORE_PATH, VERSION_KEYFRAME_INTERVAL
+
+
+def make_delta(base: str, text: str) -> list:
+    """
+    Line-level delta from `base` to `text`: a list of ["=", start, end] (copy
+    base lines start:end) and ["+", lines] (insert new lines) operations.
+    """
+    base_lines = base.splitlines(keepends=True)
+    lines = text.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in difflib.SequenceMatcher(None, base_lines, lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append(["=", i1, i2])
+        elif j2 > j1:  # replace / insert; deletes need no op
+            ops.append(["+", "".join(lines[j1:j2])])
+    return ops
+
+def apply_delta(base: str, ops: list) -> str:
+    base_lines = base.splitlines(keepends=True)
+    return "".join("".join(base_lines[op[1]:op[2]]) if op[0] == "=" else op[1] for op in ops)
+
+
+class VersionStore:
+    """
+    Revision history of every thread's text, stored as compressed deltas.
+
+    Version 0 is the scraped source; each feedback round appends a version
+    stored as a zlib-compressed line delta against the previous one. Every
+    `keyframe_interval` versions (or whenever the delta would not be smaller)
+    the full text is stored instead, so rebuilding any version applies at most
+    `keyframe_interval - 1` deltas. Recently rebuilt versions are kept in a
+    small LRU so appending to an active thread never replays its history.
+    """
+    def __init__(self, path: str = VERSION_STORE_PATH, keyframe_interval: int = VERSION_KEYFRAME_INTERVAL,
+                 cache_size: int = 256):
+        self.path = path
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # (thread_id, version) -> text
+        self._lock = threading.Lock()
+        self._conn = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS versions ("
+                " thread_id TEXT NOT NULL, version INTEGER NOT NULL, kind TEXT NOT NULL, payload BLOB NOT NULL,"
+                " text_hash TEXT NOT NULL, chars INTEGER NOT NULL, stored_bytes INTEGER NOT NULL,"
+                " label TEXT, feedback TEXT, created_at REAL NOT NULL, PRIMARY KEY (thread_id, version))"
+            )
+        return self._conn
+
+    # --- Writes ---
+    def add_version(self, thread_id: str, text: str, label: str = None, feedback: str = None) -> dict:
+        """Appends `text` as the thread's next version; returns the latest version if the text is unchanged."""
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        with self._lock:
+            conn = self._connect()
+            latest = conn.execute(
+                "SELECT version, text_hash FROM versions WHERE thread_id = ? ORDER BY version DESC LIMIT 1", (thread_id,)
+            ).fetchone()
+            if latest is not None and latest[1] == text_hash:
+                return {"version": latest[0], "created": False}
+            version = 0 if latest is None else latest[0] + 1
+            kind, payload = "full", zlib.compress(text.encode("utf-8"))
+            if version % self.keyframe_interval:
+                delta = zlib.compress(json.dumps(make_delta(self._text(conn, thread_id, version - 1), text)).encode("utf-8"))
+                if len(delta) < len(payload):
+                    kind, payload = "delta", delta
+            conn.execute(
+                "INSERT INTO versions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (thread_id, version, kind, payload, text_hash, len(text), len(payload), label, feedback, time.time()),
+            )
+            conn.commit()
+            self._remember(thread_id, version, text)
+        return {"version": version, "created": True, "kind": kind, "stored_bytes": len(payload)}
+
+    # --- Reads ---
+    def _remember(self, thread_id: str, version: int, text: str):
+        self._cache[(thread_id, version)] = text
+        self._cache.move_to_end((thread_id, version))
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _text(self, conn: sqlite3.Connection, thread_id: str, version: int) -> str:
+        cached = self._cache.get((thread_id, version))
+        if cached is not None:
+            return cached
+        keyframe = version - version % self.keyframe_interval
+        rows = conn.execute(
+            "SELECT version, kind, payload FROM versions WHERE thread_id = ? AND version BETWEEN ? AND ? ORDER BY version",
+            (thread_id, keyframe, version),
+        ).fetchall()
+        if not rows or rows[-1][0] != version:
+            raise KeyError(f"Version {version} of thread {thread_id} not found")
+        # Start from the newest stored full text at or before the requested version.
+        start = max(i for i, row in enumerate(rows) if row[1] == "full")
+        text = zlib.decompress(rows[start][2]).decode("utf-8")
+        for _, _, payload in rows[start + 1:]:
+            text = apply_delta(text, json.loads(zlib.decompress(payload)))
+        self._remember(thread_id, version, text)
+        return text
+
+    def get_version(self, thread_id: str, version: int = None) -> str:
+        """Rebuilds a version's text (the latest if `version` is None); raises KeyError if missing."""
+        with self._lock:
+            conn = self._connect()
+            if version is None:
+                row = conn.execute("SELECT MAX(version) FROM versions WHERE thread_id = ?", (thread_id,)).fetchone()
+                if row[0] is None:
+                    raise KeyError(f"Thread {thread_id} has no versions")
+                version = row[0]
+            return self._text(conn, thread_id, version)
+
+    def history(self, thread_id: str) -> list:
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT version, kind, chars, stored_bytes, label, feedback, created_at FROM versions"
+                " WHERE thread_id = ? ORDER BY version", (thread_id,)
+            ).fetchall()
+        keys = ("version", "kind", "chars", "stored_bytes", "label", "feedback", "created_at")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def diff(self, thread_id: str, from_version: int, to_version: int) -> str:
+        """Unified diff between two versions of a thread."""
+        old, new = self.get_version(thread_id, from_version), self.get_version(thread_id, to_version)
+        return "".join(difflib.unified_diff(
+            old.splitlines(keepends=True), new.splitlines(keepends=True),
+            fromfile=f"v{from_version}", tofile=f"v{to_version}",
+        ))
+
+
+version_store = VersionStore()
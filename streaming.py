@@ -0,0 +1,178 @@
+import asyncio
+import json
+import time
+import uuid
+from typing import AsyncIterator
+
+from config import (STREAM_BATCH_CHARS, STREAM_BATCH_INTERVAL, STREAM_BATCH_QUEUE, STREAM_DISCONNECT_GRACE,
+                    STREAM_RETENTION)
+
+# --- Wire Formats ---
+def format_sse(event_id: int, event: str, data: dict) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+def format_ndjson(event_id: int, event: str, data: dict) -> str:
+    return json.dumps({"id": event_id, "event": event, "data": data}) + "\n"
+
+FORMATS = {
+    "sse": ("text/event-stream", format_sse),
+    "ndjson": ("application/x-ndjson", format_ndjson),
+}
+
+# --- Token Batching ---
+async def batch_tokens(tokens: AsyncIterator[str], max_chars: int = STREAM_BATCH_CHARS,
+                       max_delay: float = STREAM_BATCH_INTERVAL,
+                       max_pending: int = STREAM_BATCH_QUEUE) -> AsyncIterator[str]:
+    """
+    Merges provider tokens into larger pieces: a batch is flushed once it holds
+    `max_chars` characters or `max_delay` seconds after its first token,
+    whichever comes first, so clients get few events without added lag. At most
+    `max_pending` tokens are read ahead of the consumer.
+    """
+    queue = asyncio.Queue(maxsize=max_pending)
+    done = object()
+    stopping = False
+
+    async def pump():
+        try:
+            async for token in tokens:
+                await queue.put(token)
+            await queue.put(done)
+        except Exception as e:
+            await queue.put(e)
+        except asyncio.CancelledError as e:
+            if not stopping:  # Cancelled upstream rather than by our cleanup: the consumer must see it too
+                await queue.put(e)
+            raise
+
+    pump_task = asyncio.create_task(pump())
+    buffer, deadline = [], None
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                item = None
+            if item is done or isinstance(item, BaseException) or item is None:
+                if buffer:
+                    yield "".join(buffer)
+                    buffer, deadline = [], None
+                if item is done:
+                    return
+                if item is not None:
+                    raise item
+                continue
+            buffer.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + max_delay
+            if sum(map(len, buffer)) >= max_chars:
+                yield "".join(buffer)
+                buffer, deadline = [], None
+    finally:
+        stopping = True
+        pump_task.cancel()
+
+
+# --- Resumable Streams ---
+class StreamSession:
+    """
+    One generation's event log. The producer runs as its own task and appends
+    numbered events; any number of clients replay the log from an event id and
+    then follow it live, so a client that reconnects with Last-Event-ID picks
+    up exactly where it dropped off. When the last client leaves, the producer
+    is cancelled (stopping the upstream LLM call) after `grace` seconds unless
+    someone reconnects first.
+    """
+    def __init__(self, stream_id: str, meta: dict, grace: float):
+        self.stream_id = stream_id
+        self.meta = meta
+        self.grace = grace
+        self.events = []  # (id, event, data); ids start at 1
+        self.finished = False
+        self.task = None
+        self._subscribers = 0
+        self._cancel_handle = None
+        self._changed = asyncio.Event()
+
+    def emit(self, event: str, data: dict):
+        self.events.append((len(self.events) + 1, event, data))
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def finish(self):
+        self.finished = True
+        self._changed.set()
+
+    def _attach(self):
+        self._subscribers += 1
+        if self._cancel_handle is not None:
+            self._cancel_handle.cancel()
+            self._cancel_handle = None
+
+    def _detach(self):
+        self._subscribers -= 1
+        if self._subscribers == 0 and not self.finished and self.task is not None:
+            self._cancel_handle = asyncio.get_running_loop().call_later(self.grace, self.task.cancel)
+
+    async def subscribe(self, last_event_id: int = 0, is_disconnected=None, poll: float = 1.0):
+        """Yields (id, event, data) after `last_event_id` until the stream ends or the client goes away."""
+        self._attach()
+        try:
+            index = max(0, last_event_id)
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.finished:
+                    return
+                changed = self._changed
+                try:
+                    await asyncio.wait_for(changed.wait(), poll)
+                except asyncio.TimeoutError:
+                    if is_disconnected is not None and await is_disconnected():
+                        return
+        finally:
+            self._detach()
+
+
+class StreamRegistry:
+    def __init__(self, grace: float = STREAM_DISCONNECT_GRACE, retention: float = STREAM_RETENTION):
+        self.grace = grace
+        self.retention = retention
+        self._sessions = {}
+
+    def start(self, producer, meta: dict = None) -> StreamSession:
+        """Runs `producer(session)` in the background; it reports progress through session.emit."""
+        session = StreamSession(str(uuid.uuid4()), meta or {}, self.grace)
+        self._sessions[session.stream_id] = session
+        session.task = asyncio.create_task(self._run(session, producer))
+        return session
+
+    async def _run(self, session: StreamSession, producer):
+        try:
+            await producer(session)
+        except asyncio.CancelledError:
+            session.emit("cancelled", {"reason": "client disconnected"})
+        except Exception as e:
+            session.emit("error", {"message": str(e)})
+        finally:
+            session.finish()
+            asyncio.get_running_loop().call_later(self.retention, self._sessions.pop, session.stream_id, None)
+
+    def get(self, stream_id: str):
+        return self._sessions.get(stream_id)
+
+    def cancel(self, stream_id: str) -> bool:
+        session = self._sessions.get(stream_id)
+        if session is None or session.finished:
+            return False
+        session.task.cancel()
+        return True
+
+    def stats(self) -> dict:
+        active = sum(1 for s in self._sessions.values() if not s.finished)
+        return {"active": active, "retained": len(self._sessions) - active}
+
+
+streams = StreamRegistry()
@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from langchain_core.messages import HumanMessage
+
+from ai_services import llm_agents
+from ai_services.llm_agents import CustomChatCerebras
+
+MESSAGES = [HumanMessage(content="Rewrite this.")]
+
+
+def _sse(*pieces: str) -> bytes:
+    events = [f"data: {json.dumps({'choices': [{'delta': {'content': p}}]})}\n\n" for p in pieces]
+    return ("".join(events) + ": keep-alive\n\ndata: [DONE]\n\n").encode()
+
+
+def _completion(text: str) -> dict:
+    return {"choices": [{"message": {"role": "assistant", "content": text}}], "usage": {"completion_tokens": 2}}
+
+
+class FakeServer:
+    """MockTransport handler replaying a scripted list of responses (or exceptions)."""
+    def __init__(self, *script):
+        self.script = list(script)
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(json.loads(request.content))
+        step = self.script.pop(0)
+        if isinstance(step, Exception):
+            raise step
+        return step
+
+
+@pytest.fixture
+def llm(monkeypatch):
+    monkeypatch.setattr(CustomChatCerebras, "_backoff", staticmethod(lambda attempt: 0))
+    monkeypatch.setattr(llm_agents, "_sync_client", None)
+    monkeypatch.setattr(llm_agents, "_async_clients", {})
+    return CustomChatCerebras(base_url="http://cerebras.test/v1", api_key="key", max_retries=2)
+
+
+def _use(monkeypatch, server: FakeServer):
+    monkeypatch.setattr(llm_agents, "_sync_client", httpx.Client(transport=httpx.MockTransport(server)))
+
+
+def test_stream_parses_sse_deltas(llm, monkeypatch):
+    server = FakeServer(httpx.Response(200, content=_sse("Once", " upon", " a time")))
+    _use(monkeypatch, server)
+    assert [chunk.content for chunk in llm.stream(MESSAGES) if chunk.content] == ["Once", " upon", " a time"]
+    assert server.requests[0]["stream"] is True
+    assert server.requests[0]["messages"] == [{"role": "user", "content": "Rewrite this."}]
+
+
+def test_retries_rate_limits_and_server_errors(llm, monkeypatch):
+    server = FakeServer(httpx.Response(429), httpx.Response(503), httpx.Response(200, json=_completion("done")))
+    _use(monkeypatch, server)
+    assert llm.invoke(MESSAGES).content == "done"
+    assert len(server.requests) == 3
+
+
+def test_retries_timeouts_then_gives_up(llm, monkeypatch):
+    server = FakeServer(*[httpx.ReadTimeout("slow")] * 3)
+    _use(monkeypatch, server)
+    with pytest.raises(httpx.ReadTimeout):
+        llm.invoke(MESSAGES)
+    assert len(server.requests) == 3  # The first try plus max_retries
+
+
+def test_client_errors_are_not_retried(llm, monkeypatch):
+    server = FakeServer(httpx.Response(401, json={"error": "bad key"}))
+    _use(monkeypatch, server)
+    with pytest.raises(httpx.HTTPStatusError):
+        llm.invoke(MESSAGES)
+    assert len(server.requests) == 1
+
+
+def test_async_stream_retries_then_streams(llm, monkeypatch):
+    server = FakeServer(httpx.Response(502), httpx.Response(200, content=_sse("Hello", "!")))
+
+    async def run():
+        llm_agents._async_clients[asyncio.get_running_loop()] = httpx.AsyncClient(transport=httpx.MockTransport(server))
+        return [chunk.content async for chunk in llm.astream(MESSAGES) if chunk.content]
+
+    assert asyncio.run(run()) == ["Hello", "!"]
+    assert len(server.requests) == 2
+
+
+def test_async_clients_of_closed_loops_are_dropped(llm):
+    async def client():
+        return llm_agents._get_async_client()
+
+    first_loop = asyncio.new_event_loop()
+    first_loop.run_until_complete(client())
+    first_loop.close()
+    asyncio.run(client())
+    assert first_loop not in llm_agents._async_clients
+    assert len(llm_agents._async_clients) == 1